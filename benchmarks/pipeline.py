@@ -0,0 +1,361 @@
+"""Throughput benchmarks for the flight computer packet pipeline.
+
+Synthetic packets with valid CRCs are handed to a `FlightComputerReceiver`
+at a controlled rate, alone or with one processor, and the benchmark reports
+the sustained packets per second, per-packet latency percentiles and memory
+growth. Latency is the time from a packet reaching the receiver until the
+processor is done with it, so for queued processors it includes the time
+waiting in the queue.
+
+Results are written as JSON, by default to `benchmarks/results/`, and an
+earlier result can be given with `--compare` to flag regressions.
+
+    python benchmarks/pipeline.py --rate 0 --rate 20000 --size 64
+"""
+import asyncio
+import json
+import math
+import os
+import platform
+import select
+import socket
+import sys
+import tempfile
+import time
+import tracemalloc
+import tty
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from threading import Event, Thread
+
+import click
+import numpy as np
+
+from booms_gse.__about__ import __version__
+from booms_gse.computer_gse import network
+from booms_gse.computer_gse.packet import build_packet
+
+RESULTS_DIR = Path(__file__).parent / 'results'
+# The synthetic packets cycle through the instruments, which every
+# processor subscribes to.
+SYSIDS = sorted(network.PacketLogger.IMAG_IDS | network.PacketLogger.SPEC_IDS)
+# Distinct packets generated for each size.
+POOL_SIZE = 1024
+# Packets sent between yields to the event loop.
+BURST = 64
+# Seconds to wait for queued processors to finish after the last packet.
+DRAIN_TIMEOUT = 30.0
+PERCENTILES = (50, 90, 99, 99.9)
+# Relative drop in packets per second reported as a regression.
+TOLERANCE = 0.1
+
+
+def make_packets(size, count=POOL_SIZE):
+    """Packets with valid CRCs and payloads of size bytes."""
+    return [build_packet(SYSIDS[i % len(SYSIDS)], 0x01,
+                         bytes((i + j) & 0xFF for j in range(size)),
+                         sequence=i, ticks=i * 1000)
+            for i in range(count)]
+
+
+class PtyDrain(Thread):
+    """Read the far side of pseudo terminals so writes to them never
+    block."""
+    def __init__(self, paths):
+        super().__init__(daemon=True)
+        self.fds = []
+        for path in paths:
+            fd = os.open(path, os.O_RDONLY | os.O_NOCTTY | os.O_NONBLOCK)
+            tty.setraw(fd)
+            self.fds.append(fd)
+        self.stopped = Event()
+        self.bytes_read = 0
+
+    def run(self):
+        while not self.stopped.is_set():
+            ready, _, _ = select.select(self.fds, [], [], 0.1)
+            for fd in ready:
+                try:
+                    self.bytes_read += len(os.read(fd, 1 << 16))
+                except BlockingIOError:
+                    pass
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        for fd in self.fds:
+            os.close(fd)
+
+
+class HeadlessMMGSE(network.MMGSEPacket):
+    """`MMGSEPacket` without its Bokeh server, so only the forwarding to
+    mm_gse is measured."""
+    def setup(self, transport):
+        network.PacketForwarder.setup(self, transport)
+
+    def close(self):
+        network.PacketForwarder.close(self)
+
+
+def udp_sink(port=0):
+    """A UDP socket on localhost that is never read, so the kernel discards
+    what is sent to it. None if the port is taken."""
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sink.bind(('127.0.0.1', port))
+    except OSError:
+        sink.close()
+        return None
+    return sink
+
+
+def receiver_only(workdir):
+    return None, []
+
+
+def forward(workdir):
+    sink = udp_sink()
+    return network.PacketForwarder('127.0.0.1', sink.getsockname()[1]), \
+        [sink.close]
+
+
+def record(workdir):
+    return network.PacketLogger(workdir / 'record'), []
+
+
+def capture(workdir):
+    return network.PacketCapture(workdir / 'capture.pcap'), []
+
+
+def pseudoserial(workdir):
+    processor = network.PacketPseudoSerial()
+    drain = PtyDrain(processor.serial.values())
+    drain.start()
+    return processor, [drain.stop]
+
+
+def mm_gse(workdir):
+    processor = HeadlessMMGSE()
+    # Catch the packets unless a real mm_gse is listening.
+    sink = udp_sink(processor.destinations[0].address[1])
+    return processor, [] if sink is None else [sink.close]
+
+
+PROCESSORS = {'receiver': receiver_only, 'forward': forward,
+              'record': record, 'capture': capture,
+              'pseudoserial': pseudoserial, 'mm_gse': mm_gse}
+
+
+class LatencyProbe:
+    """Time each packet from the receiver until its processor is done."""
+    def __init__(self, processor, timing=True):
+        self.queued = isinstance(processor, network.QueuedProcessor)
+        # Off when measuring memory, so the times are not counted.
+        self.timing = timing
+        self.latencies = []
+        self.done = 0
+        self.last_done = None
+        # Times packets were received, for those still in the queue.
+        self.received = deque()
+        if self.queued:
+            process = processor.process
+
+            async def timed_process(packets):
+                count = len(packets)
+                # Dropped packets are the oldest, so the batch is the most
+                # recent count packets received.
+                times = list(self.received)[-count:] \
+                    if count and self.timing else []
+                self.received.clear()
+                await process(packets)
+                now = time.perf_counter()
+                self.latencies.extend(now - t for t in times)
+                self.done += count
+                self.last_done = now
+
+            processor.process = timed_process
+
+
+async def run_case(name, size, rate, count, trace=False):
+    """Run one benchmark case.
+
+    Args:
+        name (str): Key of the processor in PROCESSORS.
+        size (int): Payload bytes in each packet.
+        rate (float): Packets per second to send. 0 for as fast as possible.
+        count (int): Number of packets to send.
+        trace (bool): Measure memory with tracemalloc instead of timing.
+
+    Returns:
+        dict: The measurements.
+    """
+    loop = asyncio.get_running_loop()
+    packets = make_packets(size)
+    addr = ('127.0.0.1', 0)
+    with tempfile.TemporaryDirectory() as workdir:
+        if trace:
+            tracemalloc.start()
+        processor, cleanups = PROCESSORS[name](Path(workdir))
+        processors = () if processor is None else (processor,)
+        transport, receiver = await loop.create_datagram_endpoint(
+            lambda: network.FlightComputerReceiver(processors),
+            local_addr=addr)
+        probe = LatencyProbe(processor, timing=not trace)
+        timing = probe.timing
+        if trace:
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+
+        received = probe.received
+        latencies = probe.latencies
+        datagram_received = receiver.datagram_received
+        perf_counter = time.perf_counter
+        sent = 0
+        start = perf_counter()
+        try:
+            while sent < count:
+                if rate:
+                    due = min(count, int((perf_counter() - start) * rate) + 1,
+                              sent + BURST * 16)
+                    if due <= sent:
+                        await asyncio.sleep(
+                            start + sent / rate - perf_counter())
+                        continue
+                else:
+                    due = min(count, sent + BURST)
+                for i in range(sent, due):
+                    if not timing:
+                        datagram_received(packets[i % POOL_SIZE], addr)
+                        continue
+                    before = perf_counter()
+                    datagram_received(packets[i % POOL_SIZE], addr)
+                    if probe.queued:
+                        received.append(before)
+                    else:
+                        latencies.append(perf_counter() - before)
+                sent = due
+                await asyncio.sleep(0)
+            end = perf_counter()
+
+            if probe.queued:
+                queue = processor.queue
+                deadline = end + DRAIN_TIMEOUT
+                while probe.done + queue.dropped < count \
+                        and perf_counter() < deadline:
+                    await asyncio.sleep(0.001)
+                end = probe.last_done or end
+            stats = processor.stats() if processor is not None else None
+
+            if trace:
+                current, peak = tracemalloc.get_traced_memory()
+        finally:
+            transport.close()
+            # Let the processors close.
+            await asyncio.sleep(0)
+            for cleanup in cleanups:
+                cleanup()
+            if trace:
+                tracemalloc.stop()
+
+    if trace:
+        return {'growth_bytes': current - baseline,
+                'peak_bytes': peak - baseline}
+
+    processed = count if not probe.queued else probe.done
+    seconds = end - start
+    result = {'sent': count, 'processed': processed, 'seconds': seconds,
+              'packets_per_second': processed / seconds if seconds else None,
+              'latency_us': None, 'stats': stats}
+    if latencies:
+        values = np.percentile(np.array(latencies) * 1e6, PERCENTILES)
+        result['latency_us'] = dict(
+            {f'p{p:g}': float(v) for p, v in zip(PERCENTILES, values)},
+            max=max(latencies) * 1e6)
+    return result
+
+
+def compare(results, previous, tolerance):
+    """Print the change from an earlier run and return the regressions."""
+    earlier = {(r['processor'], r['size'], r['rate']): r
+               for r in previous['results']}
+    regressions = []
+    for result in results:
+        key = (result['processor'], result['size'], result['rate'])
+        old = earlier.get(key)
+        if old is None or not old['packets_per_second']:
+            continue
+        change = result['packets_per_second'] / old['packets_per_second'] - 1
+        flag = ''
+        if change < -tolerance:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        click.echo(f'{key[0]:>12} {key[1]:>6} B {key[2]:>8} pps: '
+                   f'{change:+.1%} packets/s{flag}')
+    return regressions
+
+
+@click.command()
+@click.option('-p', '--processor', 'names', multiple=True,
+              type=click.Choice(tuple(PROCESSORS)),
+              help='Processor to benchmark. May be repeated. All by default.')
+@click.option('--rate', 'rates', multiple=True, type=click.FloatRange(min=0),
+              default=(0,), show_default=True,
+              help='Packets per second to send, 0 for as fast as possible. '
+                   'May be repeated.')
+@click.option('--size', 'sizes', multiple=True, type=click.IntRange(0, 65000),
+              default=(64, 1024), show_default=True,
+              help='Payload bytes per packet. May be repeated.')
+@click.option('-n', '--count', default=50000, type=click.IntRange(min=1),
+              show_default=True, help='Packets sent in each case.')
+@click.option('--memory/--no-memory', default=True, show_default=True,
+              help='Repeat each case with tracemalloc to measure memory.')
+@click.option('-o', '--output', type=click.Path(dir_okay=False,
+                                                path_type=Path),
+              help='JSON file for the results. By default a new file in '
+                   'benchmarks/results.')
+@click.option('--compare', 'previous', type=click.File(),
+              help='Earlier results to compare against.')
+@click.option('--tolerance', default=TOLERANCE, show_default=True,
+              type=click.FloatRange(0, 1),
+              help='Relative drop in packets per second counted as a '
+                   'regression.')
+def main(names, rates, sizes, count, memory, output, previous, tolerance):
+    """Benchmark the receiver and processors with synthetic packets."""
+    results = []
+    for name in names or tuple(PROCESSORS):
+        for size in sizes:
+            for rate in rates:
+                result = asyncio.run(run_case(name, size, rate, count))
+                if memory:
+                    result['memory'] = asyncio.run(
+                        run_case(name, size, rate, count, trace=True))
+                result = dict(processor=name, size=size, rate=rate, **result)
+                results.append(result)
+
+                latency = result['latency_us'] or {}
+                click.echo(f'{name:>12} {size:>6} B {rate:>8g} pps: '
+                           f'{result["packets_per_second"]:>10.0f} packets/s '
+                           f'p50 {latency.get("p50", math.nan):8.1f} us '
+                           f'p99 {latency.get("p99", math.nan):8.1f} us')
+
+    now = datetime.now(timezone.utc)
+    report = {'version': __version__,
+              'time': now.isoformat(timespec='seconds'),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'machine': platform.machine(),
+              'results': results}
+    if output is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        output = RESULTS_DIR / f'pipeline-{__version__}-{now:%Y%m%dT%H%M%S}.json'
+    output.write_text(json.dumps(report, indent=2) + '\n')
+    click.echo(f'Results written to {output}')
+
+    if previous is not None:
+        if compare(results, json.load(previous), tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""Startup time of the console scripts.
+
+Each script's entry point is imported and run with `--help` in a fresh
+interpreter several times, and the benchmark reports the median wall time,
+the time spent importing its modules and the modules that took longest.
+The time of an interpreter doing nothing is reported alongside, since no
+script can start faster than that.
+
+Results are written as JSON, by default to `benchmarks/results/`, and an
+earlier result can be given with `--compare` to flag regressions.
+
+    python benchmarks/startup.py --runs 20
+"""
+import json
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import click
+
+from booms_gse.__about__ import __version__
+
+RESULTS_DIR = Path(__file__).parent / 'results'
+# Console scripts and their entry points, as in pyproject.toml.
+SCRIPTS = {'bgse-computer': ('booms_gse.computer_gse.cli', 'gse'),
+           'bgse-imag': ('booms_gse.instrument_gse.cli', 'imager'),
+           'bgse-spec': ('booms_gse.instrument_gse.cli', 'spectrometer')}
+# Modules listed as the slowest imports of each script.
+TOP_MODULES = 10
+# Relative increase in median wall time reported as a regression.
+TOLERANCE = 0.2
+IMPORT_TIME = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def command(module, entry_point):
+    """Python code running an entry point like its console script."""
+    return (f'import sys; from {module} import {entry_point}; '
+            f'sys.argv[0] = {entry_point!r}; '
+            f'{entry_point}(["--help"], standalone_mode=False)')
+
+
+def run(code, import_time=False):
+    """Run code in a fresh interpreter.
+
+    Returns:
+        tuple(float, str): Wall time in seconds and standard error.
+    """
+    args = [sys.executable]
+    if import_time:
+        args += ['-X', 'importtime']
+    start = time.perf_counter()
+    result = subprocess.run(args + ['-c', code], capture_output=True,
+                            text=True, check=True)
+    return time.perf_counter() - start, result.stderr
+
+
+def import_profile(code):
+    """Total import time and the slowest top level imports of code, in
+    seconds, leaving out those the interpreter makes on its own."""
+    _, stderr = run(code, import_time=True)
+    _, startup = run('pass', import_time=True)
+    startup = {match[4] for match in IMPORT_TIME.finditer(startup)}
+    total = 0
+    modules = []
+    for match in IMPORT_TIME.finditer(stderr):
+        cumulative, indent, name = (int(match[2]), len(match[3]), match[4])
+        # Nested imports are already counted in the module importing them.
+        if indent == 1 and name not in startup:
+            total += cumulative
+            modules.append((cumulative, name))
+    modules.sort(reverse=True)
+    return total / 1e6, {name: us / 1e6 for us, name in modules[:TOP_MODULES]}
+
+
+def measure(code, runs):
+    """Median and spread of wall times over runs."""
+    times = [run(code)[0] for _ in range(runs)]
+    return {'median_seconds': statistics.median(times),
+            'min_seconds': min(times), 'max_seconds': max(times)}
+
+
+def compare(results, previous, tolerance):
+    """Print the change from an earlier run and return the regressions."""
+    regressions = []
+    for name, result in results.items():
+        old = previous['results'].get(name)
+        if old is None:
+            continue
+        change = result['median_seconds'] / old['median_seconds'] - 1
+        flag = ''
+        if change > tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        click.echo(f'{name:>14}: {change:+.1%} startup time{flag}')
+    return regressions
+
+
+@click.command()
+@click.option('-s', '--script', 'names', multiple=True,
+              type=click.Choice(tuple(SCRIPTS)),
+              help='Script to benchmark. May be repeated. All by default.')
+@click.option('-n', '--runs', default=10, type=click.IntRange(min=1),
+              show_default=True, help='Times each script is started.')
+@click.option('-o', '--output', type=click.Path(dir_okay=False,
+                                                path_type=Path),
+              help='JSON file for the results. By default a new file in '
+                   'benchmarks/results.')
+@click.option('--compare', 'previous', type=click.File(),
+              help='Earlier results to compare against.')
+@click.option('--tolerance', default=TOLERANCE, show_default=True,
+              type=click.FloatRange(min=0),
+              help='Relative increase in startup time counted as a '
+                   'regression.')
+def main(names, runs, output, previous, tolerance):
+    """Benchmark how long the console scripts take to start."""
+    baseline = measure('pass', runs)
+    click.echo(f'{"python":>14}: {baseline["median_seconds"] * 1e3:7.1f} ms')
+
+    results = {}
+    for name in names or tuple(SCRIPTS):
+        code = command(*SCRIPTS[name])
+        result = measure(code, runs)
+        result['import_seconds'], result['slowest_imports'] = \
+            import_profile(code)
+        results[name] = result
+        click.echo(f'{name:>14}: {result["median_seconds"] * 1e3:7.1f} ms, '
+                   f'{result["import_seconds"] * 1e3:7.1f} ms importing')
+
+    now = datetime.now(timezone.utc)
+    report = {'version': __version__,
+              'time': now.isoformat(timespec='seconds'),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'machine': platform.machine(),
+              'runs': runs,
+              'interpreter': baseline,
+              'results': results}
+    if output is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        output = RESULTS_DIR / f'startup-{__version__}-{now:%Y%m%dT%H%M%S}.json'
+    output.write_text(json.dumps(report, indent=2) + '\n')
+    click.echo(f'Results written to {output}')
+
+    if previous is not None:
+        if compare(results, json.load(previous), tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
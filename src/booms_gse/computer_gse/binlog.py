@@ -0,0 +1,253 @@
+"""Random access to flight computer logged `.bin` files.
+
+`BinLog` memory-maps a log and indexes every packet by its offset, length,
+system ID, telemetry type, sequence number and gondola time. Queries select
+packets from the index, so only the packets asked for are read.
+
+    with BinLog('flight.bin') as log:
+        for packet in log.packets(sysid=0xB0, start=t0, stop=t1):
+            ...
+
+Packets are found the same way as by `playback.BinFile`, at sync words that
+start a packet with a valid CRC. The sync words are located with numpy in
+one pass over the map, and only the candidates are checked in Python.
+
+The index is saved next to the log with the suffix `.bidx`, and reused while
+the log's size and modification time are unchanged. It holds a header and
+then one `INDEX_DTYPE` record per packet, so it is read straight into an
+array and not parsed when reopened.
+"""
+import logging
+import mmap
+import os
+import struct
+from bisect import bisect_left
+from pathlib import Path
+
+import numpy as np
+
+from . import recording
+from .packet import GONDOLA_TICKS_PER_S, HEADER_LENGTH, Packet, crc_valid
+from .playback import MAX_PACKET_LENGTH
+
+INDEX_SUFFIX = '.bidx'
+INDEX_MAGIC = b'BGBX'
+# 2 reads sequence numbers big endian.
+INDEX_VERSION = 2
+# Magic, version, log size, log modification time (ns) and bytes skipped.
+INDEX_HEADER = struct.Struct('<4sIQqQ')
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('ticks', '<u8'),
+                        ('length', '<u4'), ('sequence', '<u2'),
+                        ('sysid', 'u1'), ('tmtype', 'u1')])
+SYNC_BYTES = (0x90, 0xEB)
+
+logger = logging.getLogger(__name__)
+
+
+def index_path(path):
+    """Path of the index for a `.bin` file."""
+    path = Path(path)
+    return path.with_name(path.name + INDEX_SUFFIX)
+
+
+def _header_field(data, offsets, start, length, byteorder='little'):
+    """Header field at start of each packet, as uint64."""
+    value = np.zeros(len(offsets), dtype=np.uint64)
+    for i in range(length):
+        shift = 8 * (i if byteorder == 'little' else length - 1 - i)
+        value |= data[offsets + start + i].astype(np.uint64) << np.uint64(shift)
+    return value
+
+
+def build_index(data):
+    """Find the packets in a log.
+
+    Args:
+        data (mmap.mmap or bytes): The whole log.
+
+    Returns:
+        tuple(np.ndarray, int): `INDEX_DTYPE` records in file order and the
+            number of bytes not in a packet.
+    """
+    size = len(data)
+    array = np.frombuffer(data, dtype=np.uint8)
+    syncs = np.flatnonzero((array[:-1] == SYNC_BYTES[0])
+                           & (array[1:] == SYNC_BYTES[1])).tolist()
+
+    offsets = []
+    lengths = []
+    with memoryview(data) as view:
+        i = 0
+        while i < len(syncs):
+            start = syncs[i]
+            j = bisect_left(syncs, start + HEADER_LENGTH, i + 1)
+            while True:
+                # The sync word can appear in a payload, so extend the packet
+                # to later sync words until the CRC matches.
+                stop = syncs[j] if j < len(syncs) else size
+                if crc_valid(view[start:stop]):
+                    offsets.append(start)
+                    lengths.append(stop - start)
+                    i = j
+                    break
+                if j >= len(syncs) or stop - start > MAX_PACKET_LENGTH:
+                    # No valid packet starts here.
+                    i += 1
+                    break
+                j += 1
+
+    index = np.empty(len(offsets), dtype=INDEX_DTYPE)
+    index['offset'] = offsets
+    index['length'] = lengths
+    if len(index):
+        starts = index['offset'].astype(np.intp)
+        index['sysid'] = array[starts + 4]
+        index['tmtype'] = array[starts + 5]
+        index['sequence'] = _header_field(array, starts, 7, 2, 'big')
+        index['ticks'] = _header_field(array, starts, 10, 6)
+    del array
+    return index, size - int(index['length'].sum())
+
+
+class BinLog:
+    """Memory-mapped flight computer log with an index of its packets."""
+    def __init__(self, path, cache=True):
+        """Map the log and load its index, building it if needed.
+
+        Args:
+            path (Path): An uncompressed `.bin` file logged by the flight
+                computer.
+            cache (bool): Save a newly built index next to the log, and
+                reuse a saved one.
+
+        Raises:
+            ValueError: If the log is compressed, since it can not be mapped.
+        """
+        self.path = Path(path)
+        if recording.is_compressed(self.path):
+            raise ValueError(f'{self.path} is compressed and can not be '
+                             'memory-mapped. Decompress it first.')
+        with open(self.path, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            try:
+                self._map = mmap.mmap(file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can not be mapped.
+                self._map = b''
+        self._source = (stat.st_size, stat.st_mtime_ns)
+
+        self.index = self._load_index() if cache else None
+        if self.index is None:
+            self.index, self.junk_bytes = build_index(self._map)
+            if cache:
+                self._save_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        """The bytes of packet i in the file."""
+        entry = self.index[i]
+        offset = int(entry['offset'])
+        return self._map[offset:offset + int(entry['length'])]
+
+    @property
+    def gondola_times(self):
+        """Gondola time of each packet in seconds."""
+        return self.index['ticks'] / GONDOLA_TICKS_PER_S
+
+    def select(self, sysid=None, tmtype=None, start=None, stop=None):
+        """Positions in the index of the packets matching every condition
+        given.
+
+        Args:
+            sysid (int or iterable(int)): System IDs.
+            tmtype (int or iterable(int)): Telemetry types.
+            start (float): Earliest gondola time in seconds.
+            stop (float): Gondola time in seconds the packets are before.
+
+        Returns:
+            np.ndarray: Positions in file order.
+        """
+        mask = np.ones(len(self.index), dtype=bool)
+        for field, values in (('sysid', sysid), ('tmtype', tmtype)):
+            if values is None:
+                continue
+            if np.isscalar(values):
+                mask &= self.index[field] == values
+            else:
+                mask &= np.isin(self.index[field], list(values))
+        # Gondola time is not assumed to increase through the file.
+        if start is not None:
+            mask &= self.index['ticks'] >= round(start * GONDOLA_TICKS_PER_S)
+        if stop is not None:
+            mask &= self.index['ticks'] < round(stop * GONDOLA_TICKS_PER_S)
+        return np.flatnonzero(mask)
+
+    def packets(self, sysid=None, tmtype=None, start=None, stop=None):
+        """Yield the matching packets in file order. See select().
+
+        Yields:
+            Packet: Each packet. Their CRCs were checked by the index.
+        """
+        for i in self.select(sysid, tmtype, start, stop):
+            yield Packet(self[i], valid=True)
+
+    def counts(self):
+        """Number of packets of each system ID and telemetry type."""
+        keys, counts = np.unique(
+            self.index['sysid'].astype(np.uint16) << 8 | self.index['tmtype'],
+            return_counts=True)
+        return {(int(key) >> 8, int(key) & 0xFF): int(count)
+                for key, count in zip(keys, counts)}
+
+    def _load_index(self):
+        """Read a saved index, or return None if there is none for this
+        version of the log."""
+        path = index_path(self.path)
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        with file:
+            header = file.read(INDEX_HEADER.size)
+            if len(header) < INDEX_HEADER.size:
+                return None
+            magic, version, size, mtime_ns, junk_bytes = \
+                INDEX_HEADER.unpack(header)
+            body = os.fstat(file.fileno()).st_size - INDEX_HEADER.size
+            if (magic != INDEX_MAGIC or version != INDEX_VERSION
+                    or (size, mtime_ns) != self._source
+                    or body % INDEX_DTYPE.itemsize):
+                logger.info('Rebuilding the out of date index %s', path)
+                return None
+            self.junk_bytes = junk_bytes
+            # Read, not mapped, so slices of the index outlive close().
+            return np.fromfile(file, dtype=INDEX_DTYPE)
+
+    def _save_index(self):
+        """Write the index next to the log, replacing any older one."""
+        path = index_path(self.path)
+        temporary = path.with_name(path.name + '.tmp')
+        try:
+            with open(temporary, 'wb') as file:
+                file.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION,
+                                             *self._source, self.junk_bytes))
+                file.write(self.index.tobytes())
+            os.replace(temporary, path)
+        except OSError as exc:
+            # The log may be in a read-only directory.
+            logger.warning('Could not save the index %s: %s', path, exc)
+
+    def close(self):
+        """Unmap the log."""
+        self.index = None
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
@@ -0,0 +1,148 @@
+"""Captures of every packet received with its arrival time.
+
+A `PacketLogger` recording keeps only instrument payloads. A capture keeps
+each whole datagram with the time it arrived, so a session can be replayed
+through every processor, `mm_gse` included, with its original timing.
+
+Captures are written in the pcap format with nanosecond timestamps and the
+`LINKTYPE_USER0` link type, so they can also be opened in tools like
+Wireshark. Each record is a 16 byte header giving the arrival time in
+seconds and nanoseconds and the packet length, followed by the packet.
+"""
+import struct
+from pathlib import Path
+
+from .recording import BufferedWriter
+
+CAPTURE_SUFFIX = '.pcap'
+# Magic numbers of pcap files with nanosecond and microsecond timestamps
+MAGIC_NANO = 0xa1b23c4d
+MAGIC_MICRO = 0xa1b2c3d4
+VERSION = (2, 4)
+# Largest packet stored whole, the largest UDP payload.
+SNAPLEN = 65535
+# Link type reserved for private use, since the packets are not Ethernet.
+LINKTYPE_USER0 = 147
+
+# Magic, major version, minor version, UTC offset, accuracy, snaplen,
+# link type
+FILE_HEADER = struct.Struct('<IHHiIII')
+# Seconds, fraction of a second, bytes stored, bytes in the packet
+RECORD_HEADER = struct.Struct('<IIII')
+
+
+def _byte_order(magic):
+    """Byte order and timestamp units in nanoseconds for a file magic,
+    or None if it is not a pcap file."""
+    for order in '<>':
+        number = struct.unpack(order + 'I', magic)[0]
+        if number == MAGIC_NANO:
+            return order, 1
+        if number == MAGIC_MICRO:
+            return order, 1000
+    return None
+
+
+def is_capture(path):
+    """True if the file at path starts like a pcap capture."""
+    try:
+        with open(path, 'rb') as file:
+            magic = file.read(4)
+    except OSError:
+        return False
+    return len(magic) == 4 and _byte_order(magic) is not None
+
+
+class CaptureWriter(BufferedWriter):
+    """Collect packets with their arrival times and write them to a capture
+    in blocks."""
+    def __init__(self, path, fsync=False):
+        """Open the capture, appending if it exists.
+
+        Args:
+            path (Path): Path of the capture file.
+            fsync (bool): Ask the OS to commit each block to disk.
+        """
+        self.path = Path(path)
+        file = open(self.path, 'ab', buffering=0)
+        try:
+            if file.tell() == 0:
+                file.write(FILE_HEADER.pack(MAGIC_NANO, *VERSION, 0, 0,
+                                            SNAPLEN, LINKTYPE_USER0))
+            else:
+                with open(self.path, 'rb') as existing:
+                    header = existing.read(FILE_HEADER.size)
+                if len(header) < FILE_HEADER.size \
+                        or FILE_HEADER.unpack(header)[0] != MAGIC_NANO:
+                    raise ValueError(f'Can not append to {self.path}, it is '
+                                     'not a capture written by this tool.')
+        except Exception:
+            file.close()
+            raise
+        super().__init__(file, fsync=fsync)
+        self.packets = 0
+
+    def append_packet(self, data, timestamp):
+        """Add a packet to be written on the next flush.
+
+        Args:
+            data (bytes): The whole packet.
+            timestamp (int): Arrival time in nanoseconds since the epoch.
+        """
+        seconds, nanoseconds = divmod(timestamp, 1_000_000_000)
+        size = len(data)
+        self.append(RECORD_HEADER.pack(seconds, nanoseconds, size, size))
+        self.append(data)
+        self.packets += 1
+
+
+class CaptureReader:
+    """Capture file that iterates over its packets and arrival times."""
+    def __init__(self, path):
+        """Open the capture and check its header.
+
+        Args:
+            path (Path): A pcap file, usually written by `CaptureWriter`.
+        """
+        self.path = Path(path)
+        # Bytes of a record cut short at the end of the file
+        self.junk_bytes = 0
+        self._file = open(self.path, 'rb', buffering=1 << 16)
+        header = self._file.read(FILE_HEADER.size)
+        found = _byte_order(header[:4]) if len(header) == FILE_HEADER.size \
+            else None
+        if found is None:
+            self._file.close()
+            raise ValueError(f'{self.path} is not a pcap capture.')
+        order, self._units = found
+        self._record = struct.Struct(order + RECORD_HEADER.format[1:])
+        self.linktype = struct.unpack(order + FILE_HEADER.format[1:],
+                                      header)[6]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        """Yield the arrival time in nanoseconds and the bytes of each
+        packet."""
+        read = self._file.read
+        record = self._record
+        units = self._units
+        while True:
+            header = read(record.size)
+            if len(header) < record.size:
+                self.junk_bytes += len(header)
+                return
+            seconds, fraction, size, _ = record.unpack(header)
+            data = read(size)
+            if len(data) < size:
+                self.junk_bytes += len(header) + len(data)
+                return
+            yield seconds * 1_000_000_000 + fraction * units, data
+
+    def close(self):
+        """Close the capture file."""
+        self._file.close()
@@ -9,9 +9,10 @@ from pathlib import Path
 
 import click
 
-from .. import network
+from .. import network, recording, sequence, watchdog
 
 SERIAL_LOG_PATH = Path('.')/'computer_serial.log'
+INSTRUMENT_IDS = network.PacketLogger.IMAG_IDS | network.PacketLogger.SPEC_IDS
 
 
 class IPAddress(click.ParamType):
@@ -50,6 +51,54 @@ class PacketID(click.IntRange):
 PACKET_ID = PacketID()
 
 
+def simulator_default(name):
+    """A default from the simulator module, which is only imported when
+    the simulate subcommand is used since it needs numpy."""
+    def default():
+        from .. import simulator
+        return getattr(simulator, name)
+    return default
+
+
+def queue_options(f):
+    """Options for processors that handle packets from a bounded queue."""
+    return click.option('--queue_size', default=network.QUEUE_SIZE,
+                        type=click.IntRange(min=1),
+                        help='Packets that may wait to be processed.')(
+           click.option('--overflow', default='drop-oldest',
+                        type=click.Choice(network.OVERFLOW_POLICIES),
+                        help='What to do when the queue is full.')(f))
+
+
+def worker_option(f):
+    """Option to run a processor in a worker process."""
+    return click.option('--worker', is_flag=True,
+                        help='Run in a separate process fed from shared '
+                             'memory.')(f)
+
+
+def make_processor(worker, factory, *args, sysids=None, **kwargs):
+    """Create a processor, or a worker process running it.
+
+    Args:
+        worker (bool): Run the processor in a worker process.
+        factory (type): The `PacketProcessor` subclass.
+        *args: Positional arguments for factory.
+        sysids (set(int)): System IDs the processor subscribes to, so only
+            those are copied to the worker. None for all.
+        **kwargs: Keyword arguments for factory.
+    """
+    if worker:
+        from .. import workers
+
+        # A blocking queue in the worker should also hold back the ring.
+        overflow = ('block' if kwargs.get('overflow') == 'block'
+                    else 'drop-oldest')
+        return workers.WorkerProcessor(factory, args, kwargs, sysids=sysids,
+                                       overflow=overflow)
+    return factory(*args, **kwargs)
+
+
 @click.group(chain=True)
 @click.option('-a', '--address', default='0.0.0.0', type=IPAddress())
 @click.option('-p', '--port', default='20501', type=click.IntRange(1, 65535))
@@ -58,7 +107,27 @@ PACKET_ID = PacketID()
                               dir_okay=False,
                               path_type=Path))
 @click.option('-s', '--speed', default='1.0',
-              help='Playback speed.', type=click.FloatRange(min_open=0))
+              help='Playback speed. Use inf to replay as fast as possible.',
+              type=click.FloatRange(min_open=0))
+@click.option('--external_playback', is_flag=True,
+              help='Replay with the middleman playback binary over UDP.')
+@click.option('--batch_ingest', is_flag=True,
+              help='Read packets in a dedicated thread and process them in '
+                   'batches.')
+@click.option('--metrics', 'metrics_port', type=click.IntRange(1, 65535),
+              help='Serve Prometheus metrics on this localhost port.')
+@click.option('--reorder_window', default=sequence.REORDER_WINDOW,
+              type=click.IntRange(min=0),
+              help='Packets that may be held to restore sequence order. The '
+                   'default of 1 only counts lost packets and 0 turns '
+                   'tracking off.')
+@click.option('--reorder_timeout', default=sequence.REORDER_TIMEOUT,
+              type=click.FloatRange(min=0, min_open=True),
+              help='Longest time in seconds a packet is held for reordering.')
+@click.option('--lag_threshold', default=watchdog.LAG_THRESHOLD,
+              type=click.FloatRange(min=0, min_open=True),
+              help='Log what blocks the event loop for longer than this many '
+                   'seconds.')
 @click.option('--debug', is_flag=True)
 def gse(**kwargs):
     """Receive UDP datagrams and pass the packets to processing commands."""
@@ -66,30 +135,58 @@ def gse(**kwargs):
 
 
 @gse.result_callback()
-def process_pipeline(processors, address, port, from_file, speed, debug):
+def process_pipeline(processors, address, port, from_file, speed,
+                     external_playback, batch_ingest, metrics_port,
+                     reorder_window, reorder_timeout, lag_threshold, debug):
     """Start the run for the receiver and processing asyncio functions."""
+    processors = network.merge_forwarders(processors)
     asyncio.run(network.receive_packets(address, port, processors,
-                                        from_file, speed))
+                                        from_file, speed, external_playback,
+                                        batch_ingest, metrics_port,
+                                        reorder_window, reorder_timeout,
+                                        lag_threshold))
 
 
 @gse.command()
 @click.argument('target_address', default='127.0.0.1', type=IPAddress())
 @click.argument('target_port', default='20502', type=click.IntRange(0, 65535))
-def forward(target_address, target_port):
-    """Forward the UDP packets to a new IP and port."""
-    return network.PacketForwarder(target_address, target_port)
+@click.option('-i', '--sysid', 'sysids', multiple=True, type=PACKET_ID,
+              help='Only forward packets from this system ID. May be '
+                   'repeated.')
+@click.option('--valid_only', is_flag=True,
+              help='Only forward packets with a valid CRC.')
+def forward(target_address, target_port, sysids, valid_only):
+    """Forward the UDP packets to a new IP and port.
+
+    Chain forward several times to send to several destinations. The packets
+    are routed once and sent to every destination.
+    """
+    return network.PacketForwarder(target_address, target_port,
+                                   sysids=set(sysids) if sysids else None,
+                                   valid_only=valid_only)
 
 
 @gse.command()
 @click.argument('packet_id', type=PACKET_ID)
 @click.argument('target_serial', type=str)
-def serial(packet_id, target_serial):
+@queue_options
+@worker_option
+def serial(packet_id, target_serial, queue_size, overflow, worker):
     """Pass the data from a selected device to a serial port."""
-    return network.PacketSerial(packet_id, target_serial)
+    return make_processor(worker, network.PacketSerial, packet_id,
+                          target_serial, queue_size=queue_size,
+                          overflow=overflow, sysids={packet_id})
 
 
 @gse.command()
-def pseudoserial(address, port, from_file):
+@click.option('--pace', is_flag=True,
+              help='Write no faster than the instrument baud rates.')
+@click.option('--buffer_size', default=network.PTY_BUFFER_SIZE,
+              type=click.IntRange(min=1),
+              help='Bytes buffered for each port before data is dropped.')
+@queue_options
+@worker_option
+def pseudoserial(pace, buffer_size, queue_size, overflow, worker):
     """Pass networked BOOMS packets to pseudo-serial ports."""
     # log_file_handler = logging.FileHandler(SERIAL_LOG_PATH)
     # log_file_formatter = logging.Formatter(
@@ -101,7 +198,10 @@ def pseudoserial(address, port, from_file):
     #     logging.basicConfig(level=logging.DEBUG)
     #     network.logger.setLevel(logging.DEBUG)
 
-    return network.PacketPseudoSerial()
+    return make_processor(worker, network.PacketPseudoSerial, pace=pace,
+                          buffer_size=buffer_size, queue_size=queue_size,
+                          overflow=overflow,
+                          sysids=INSTRUMENT_IDS)
 
 
 @gse.command()
@@ -109,20 +209,140 @@ def pseudoserial(address, port, from_file):
                 type=click.Path(file_okay=False,
                                 writable=True,
                                 path_type=Path))
-def record(path):
+@click.option('--flush_interval', default=recording.FLUSH_INTERVAL,
+              type=click.FloatRange(min=0, min_open=True),
+              help='Longest time in seconds data is buffered before writing.')
+@click.option('--flush_size', default=recording.FLUSH_SIZE,
+              type=click.IntRange(min=1),
+              help='Write a file once this many bytes are buffered.')
+@click.option('--fsync', is_flag=True,
+              help='Commit every write to disk before continuing.')
+@click.option('--rotate_size', type=click.IntRange(min=1),
+              help='Start a new file once one would exceed this many bytes.')
+@click.option('--rotate_interval', type=click.FloatRange(min=0, min_open=True),
+              help='Start a new file every this many seconds.')
+@click.option('--drop_invalid', is_flag=True,
+              help='Do not record packets with a bad CRC. By default they '
+                   'are recorded and flagged in the index.')
+@click.option('--compress', type=click.Choice(tuple(recording.CODECS)),
+              help='Compress the files in independent chunks. They are '
+                   'named .bgz instead of .dat.')
+@queue_options
+@worker_option
+def record(path, flush_interval, flush_size, fsync, rotate_size,
+           rotate_interval, drop_invalid, compress, queue_size, overflow,
+           worker):
     """Write the data for imagers and spectrometers to a file."""
     # network.logger.addHandler(logging.StreamHandler())
     # if kwargs['debug']:
     #     network.logger.setLevel(logging.DEBUG)
-    return network.PacketLogger(path)
+    return make_processor(worker, network.PacketLogger, path,
+                          flush_size=flush_size,
+                          flush_interval=flush_interval, fsync=fsync,
+                          rotate_size=rotate_size,
+                          rotate_interval=rotate_interval,
+                          drop_invalid=drop_invalid, compress=compress,
+                          queue_size=queue_size, overflow=overflow,
+                          sysids=INSTRUMENT_IDS)
+
+
+@gse.command()
+@click.argument('path',
+                type=click.Path(dir_okay=False,
+                                writable=True,
+                                path_type=Path))
+@click.option('--flush_interval', default=recording.FLUSH_INTERVAL,
+              type=click.FloatRange(min=0, min_open=True),
+              help='Longest time in seconds data is buffered before writing.')
+@click.option('--flush_size', default=recording.FLUSH_SIZE,
+              type=click.IntRange(min=1),
+              help='Write the file once this many bytes are buffered.')
+@click.option('--fsync', is_flag=True,
+              help='Commit every write to disk before continuing.')
+@queue_options
+def capture(path, flush_interval, flush_size, fsync, queue_size, overflow):
+    """Write every datagram with its arrival time to a pcap file.
+
+    Replay the file with --from_file to run it through any processors with
+    its original timing.
+    """
+    return network.PacketCapture(path, flush_size=flush_size,
+                                 flush_interval=flush_interval, fsync=fsync,
+                                 queue_size=queue_size, overflow=overflow)
+
+
+@gse.command()
+@click.option('--target_address', default='127.0.0.1', type=IPAddress(),
+              help='Address to send telemetry to. IPv4 only.')
+@click.option('--target_port', type=click.IntRange(1, 65535),
+              help='Port to send telemetry to. The --port of this '
+                   'bgse-computer by default.')
+@click.option('--command_port', default=network.COMMAND_PORT,
+              type=click.IntRange(1, 65535),
+              help='Port to receive and acknowledge commands on.')
+@click.option('--imagers', default=len(network.PacketLogger.IMAG_IDS),
+              type=click.IntRange(0, len(network.PacketLogger.IMAG_IDS)),
+              help='Number of imagers to simulate.')
+@click.option('--spectrometers', default=len(network.PacketLogger.SPEC_IDS),
+              type=click.IntRange(0, len(network.PacketLogger.SPEC_IDS)),
+              help='Number of spectrometers to simulate.')
+@click.option('--event_rate', default=simulator_default('EVENT_RATE'),
+              type=click.FloatRange(min=0),
+              help='X-ray events per second from each imager.')
+@click.option('--spectrum_rate', default=simulator_default('SPECTRUM_RATE'),
+              type=click.FloatRange(min=0),
+              help='Frames per second from each spectrometer.')
+@click.option('--mag_rate', default=simulator_default('MAG_RATE'),
+              type=click.FloatRange(min=0),
+              help='Magnetometer readings per second.')
+@click.option('--imager_packet_rate',
+              default=simulator_default('IMAGER_PACKET_RATE'),
+              type=click.FloatRange(min=0, min_open=True),
+              help='Packets per second carrying each imager\'s data.')
+@click.option('--scale', default=1.0, type=click.FloatRange(min_open=0),
+              help='Multiply every rate, to test beyond flight rates.')
+@worker_option
+def simulate(target_address, target_port, command_port, imagers,
+             spectrometers, event_rate, spectrum_rate, mag_rate,
+             imager_packet_rate, scale, worker):
+    """Send simulated flight computer telemetry and acknowledge commands.
+
+    By default the telemetry is sent to this receiver. To load test a
+    separate bgse-computer, run this with a different --port.
+    """
+    from .. import simulator
+
+    if target_port is None:
+        target_port = click.get_current_context().parent.params['port']
+
+    return make_processor(worker, simulator.FlightComputerSimulator,
+                          target_address, target_port,
+                          command_port=command_port, imagers=imagers,
+                          spectrometers=spectrometers, event_rate=event_rate,
+                          spectrum_rate=spectrum_rate, mag_rate=mag_rate,
+                          imager_packet_rate=imager_packet_rate, scale=scale,
+                          sysids=set())
 
 
 @gse.command()
 @click.option('--show', is_flag=True, default=False, 
               help="Launch the gse in a new browser tab.")
-def mm_gse(show):
+@click.option('--refresh_rate', type=click.FloatRange(min=0, min_open=True),
+              help='Times a second the plots and readings are updated. '
+                   '4 by default.')
+@click.option('--store', type=click.Path(file_okay=False, writable=True,
+                                         path_type=Path),
+              help='Directory to keep the plotted history in. It is loaded '
+                   'from here when mm_gse starts, so a restart keeps it.')
+@click.option('--remote_ip',
+              help='Address commands are sent to at first. Use 127.0.0.1 '
+                   'with simulate. The flight computer by default.')
+@worker_option
+def mm_gse(show, refresh_rate, store, remote_ip, worker):
     """Start an mm_gse bokeh server and forward UDP packets to it."""
-    return network.MMGSEPacket(show=show)
+    return make_processor(worker, network.MMGSEPacket, show=show,
+                          refresh_rate=refresh_rate, store=store,
+                          remote_ip=remote_ip)
 
 
 if __name__ == '__main__':
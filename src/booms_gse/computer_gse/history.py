@@ -0,0 +1,369 @@
+"""Full resolution history of plotted telemetry, and downsampled views of it.
+
+A `History` keeps every row of one kind in a growing numpy array, with the
+values of each column together. Plots are not sent every row. A `View` of a
+history selects the rows in the plotted x range and keeps the first minimum
+and maximum of a line in each of a fixed number of buckets, about one per
+pixel. The plotted line then looks the same as with every row, and the
+number of points sent stays the same however long the history grows.
+
+Updates cost about the rows added, not the length of the history. The order
+of a column that has decreased is kept by the history, with new rows merged
+in. A view of the whole history keeps its buckets, adds new rows to them,
+and doubles their width when the rows run past the last. Only a new window
+is bucketed from the start.
+
+A history can also be kept in a `store.ColumnStore`, which it is loaded from
+when created.
+"""
+import numpy as np
+
+# Rows a history has room for before it grows.
+HISTORY_ROWS = 4096
+# Part of the window's width added to each side, so a short pan still has
+# points to show until the view is updated.
+WINDOW_MARGIN = 0.5
+
+
+def _resized(array, length, size, dtype):
+    """An array of the given size starting with the first length values of
+    another."""
+    resized = np.empty(size, dtype=dtype)
+    if length:
+        resized[:length] = array[:length]
+    return resized
+
+
+class History:
+    """Every row of one kind, by column."""
+    def __init__(self, columns, rows=HISTORY_ROWS, store=None):
+        """Initialize the history, with the rows in the store if given.
+
+        Args:
+            columns (tuple(str)): Names of the values in each row.
+            rows (int): Rows there is room for at first. The history doubles
+                in size when it is full.
+            store (store.ColumnStore): Also gets every row appended.
+        """
+        self.columns = columns
+        self.store = store
+        self._index = {column: i for i, column in enumerate(columns)}
+        saved = np.empty((len(columns), 0)) if store is None \
+            else store.read()
+        self._length = saved.shape[1]
+        self._array = np.empty((len(columns), max(rows, 2 * self._length)))
+        self._array[:, :self._length] = saved
+        # Columns whose values have never decreased.
+        self._ascending = np.all(saved[:, 1:] >= saved[:, :-1], axis=1)
+        # Rows sorted so far, their order and the sorted values, by column.
+        self._sorted = {}
+
+    def __len__(self):
+        return self._length
+
+    def append(self, row):
+        """Add a row of numbers, in the order of the columns."""
+        if self._length == self._array.shape[1]:
+            self._array = np.concatenate((self._array,
+                                          np.empty_like(self._array)), axis=1)
+        row = np.asarray(row, dtype=float)
+        if self._length:
+            self._ascending &= row >= self._array[:, self._length - 1]
+        self._array[:, self._length] = row
+        self._length += 1
+        if self.store is not None:
+            self.store.append(row)
+
+    def __getitem__(self, column):
+        """The values of a column, as a view that is not copied."""
+        return self._array[self._index[column], :self._length]
+
+    def ascending(self, column):
+        """Whether the values of a column have never decreased."""
+        return bool(self._ascending[self._index[column]])
+
+    def sorted(self, column):
+        """The rows in order of a column. The order is kept, and rows added
+        since are merged into it.
+
+        Returns:
+            tuple(np.ndarray, np.ndarray): The positions of the rows in order,
+                or None if the column has never decreased, and the values of
+                the column in order. Neither is copied.
+        """
+        values = self[column]
+        if self.ascending(column):
+            return None, values
+        done, order, ordered = self._sorted.get(column, (0, None, None))
+        if done < self._length:
+            rows = np.arange(done, self._length)
+            rows = rows[np.argsort(values[done:], kind='stable')]
+            added = values[rows]
+            if order is None or added[0] >= ordered[done - 1]:
+                # Later than every row so far, as when rows only arrive a
+                # little out of order.
+                if order is None or len(order) < self._length:
+                    size = max(self._array.shape[1], 2 * self._length)
+                    order = _resized(order, done, size, np.intp)
+                    ordered = _resized(ordered, done, size, float)
+                order[done:self._length] = rows
+                ordered[done:self._length] = added
+            else:
+                # Equal values keep the order they were added in.
+                at = np.searchsorted(ordered[:done], added, side='right')
+                order = np.insert(order[:done], at, rows)
+                ordered = np.insert(ordered[:done], at, added)
+            self._sorted[column] = (self._length, order, ordered)
+        return order[:self._length], ordered[:self._length]
+
+
+def _extremes(y, starts):
+    """Positions of the first minimum and of the first maximum of each
+    bucket. See envelope()."""
+    n = len(y)
+    lengths = np.diff(np.append(starts, n))
+    positions = np.arange(n)
+    found = []
+    for reduce in (np.fmin, np.fmax):
+        extreme = np.repeat(reduce.reduceat(y, starts), lengths)
+        first = np.minimum.reduceat(np.where(y == extreme, positions, n),
+                                    starts)
+        # Buckets of NaN have no extreme, so take their first value.
+        found.append(np.where(first < n, first, starts))
+    return found
+
+
+def envelope(y, starts):
+    """Positions of the first minimum and maximum of each bucket, in order.
+
+    Args:
+        y (np.ndarray): Values, with the buckets one after the other.
+        starts (np.ndarray): Position of the first value of each bucket, none
+            of them empty.
+
+    Returns:
+        np.ndarray: Two positions for each bucket, the same one twice if it
+            has a single value or only NaN.
+    """
+    low, high = _extremes(y, starts)
+    return np.column_stack((np.minimum(low, high),
+                            np.maximum(low, high))).ravel()
+
+
+def _replaces(rows, new, x, y, sign):
+    """Whether each new row is an earlier minimum of sign * y than the row
+    it is compared with. Rows of -1 are empty buckets."""
+    current, candidate = sign * y[rows], sign * y[new]
+    current_nan, candidate_nan = np.isnan(current), np.isnan(candidate)
+    same = (candidate == current) | (current_nan & candidate_nan)
+    return (rows < 0) | (current_nan & ~candidate_nan) \
+        | (candidate < current) | (same & (x[new] < x[rows]))
+
+
+class _Envelope:
+    """Rows of the first minimum and maximum of a line in equal buckets of
+    x, kept up to date as rows are added.
+
+    The buckets start at the lowest x. When a row is past the last bucket,
+    the buckets are merged in pairs to twice the width until it fits. Rows
+    are put in buckets by whole multiples of the first width, so merging
+    puts every row where adding it again would.
+    """
+    def __init__(self, buckets, start, width):
+        self.start = start
+        self.width = width
+        # Times the buckets have been merged.
+        self.merges = 0
+        # Row of the minimum and maximum of each bucket, -1 if empty.
+        self.low = np.full(buckets, -1, dtype=np.intp)
+        self.high = np.full(buckets, -1, dtype=np.intp)
+
+    def bucket(self, x):
+        """Buckets of x values, before merging."""
+        return ((x - self.start) / self.width).astype(np.intp)
+
+    def fits(self, x):
+        """Whether x values are not before the first bucket."""
+        return not len(x) or x.min() >= self.start
+
+    def add(self, rows, x, y):
+        """Add rows with finite x values, none of them before the first
+        bucket.
+
+        Args:
+            rows (np.ndarray): Positions of the rows in the history.
+            x (np.ndarray): The x column of the whole history.
+            y (np.ndarray): The y column of the whole history.
+        """
+        if not len(rows):
+            return
+        new_x = x[rows]
+        bucket = self.bucket(new_x)
+        while bucket.max() >> self.merges >= len(self.low):
+            self._merge(x, y)
+        bucket >>= self.merges
+        new_y = y[rows]
+        for extremes, sign in ((self.low, 1), (self.high, -1)):
+            # The first minimum of each bucket among the new rows.
+            first = np.lexsort((new_x, sign * new_y, bucket))
+            touched, at = np.unique(bucket[first], return_index=True)
+            candidates = rows[first[at]]
+            replace = _replaces(extremes[touched], candidates, x, y, sign)
+            extremes[touched[replace]] = candidates[replace]
+
+    def _merge(self, x, y):
+        """Merge the buckets in pairs, doubling their width."""
+        buckets = len(self.low)
+        for extremes, sign in ((self.low, 1), (self.high, -1)):
+            pairs = np.append(extremes, np.full(buckets % 2, -1, dtype=np.intp)
+                              ).reshape(-1, 2)
+            merged, later = pairs[:, 0], pairs[:, 1]
+            replace = (later >= 0) & _replaces(merged, later, x, y, sign)
+            merged = np.where(replace, later, merged)
+            extremes[:] = -1
+            extremes[:len(merged)] = merged
+        self.merges += 1
+
+    def rows(self, x):
+        """Rows of the minimum and maximum of each bucket, in order of x."""
+        used = self.low >= 0
+        low, high = self.low[used], self.high[used]
+        low_first = (x[low] < x[high]) | ((x[low] == x[high]) & (low <= high))
+        return np.column_stack((np.where(low_first, low, high),
+                                np.where(low_first, high, low))).ravel()
+
+
+class View:
+    """A line of a history downsampled to a window of its x values."""
+    def __init__(self, history, x, y, buckets):
+        """Initialize the view of the whole history.
+
+        Args:
+            history (History): The rows to plot.
+            x (str): The column on the x axis.
+            y (str): The column on the y axis.
+            buckets (int): Most buckets the window is split into, such as
+                the width of the plot in pixels.
+        """
+        self.history = history
+        self.x = x
+        self.y = y
+        self.buckets = buckets
+        self.window = None
+        # Range of the x values last returned.
+        self.extent = None
+        self._rows = None
+        # Buckets of the whole history, kept between updates.
+        self._envelope = None
+
+    def set_window(self, start, stop):
+        """Show x values from start to stop. A window holding all of the
+        points last returned shows the whole history from then on.
+
+        Returns:
+            bool: Whether the view needs to be updated.
+        """
+        window = (start, stop)
+        if self.extent is None or (start <= self.extent[0]
+                                   and stop >= self.extent[1]):
+            window = None
+        if window == self.window:
+            return False
+        self.window = window
+        self._rows = None
+        self._envelope = None
+        return True
+
+    def update(self):
+        """The points of the line, if there are new rows or a new window.
+
+        Returns:
+            dict: An 'x' and a 'y' array, or None if nothing has changed.
+        """
+        rows = len(self.history)
+        if self._rows == rows:
+            return None
+        done, self._rows = self._rows, rows
+        if self.window is None:
+            x, y = self._whole(done)
+        else:
+            points = self._windowed(done)
+            if points is None:
+                return None
+            x, y = points
+        if len(x):
+            self.extent = (x[0], x[-1])
+        return {'x': x, 'y': y}
+
+    def _whole(self, done):
+        """Points of the whole history, adding the rows from done on to the
+        buckets kept from the last update."""
+        order, sorted_x = self.history.sorted(self.x)
+        x, y = self.history[self.x], self.history[self.y]
+        if len(x) <= 2 * self.buckets:
+            self._envelope = None
+            return sorted_x, (y if order is None else y[order])
+
+        envelope = self._envelope
+        if envelope is not None:
+            rows = np.arange(done, len(x))
+            rows = rows[np.isfinite(x[rows])]
+            if envelope.fits(x[rows]):
+                envelope.add(rows, x, y)
+            else:
+                envelope = None
+        if envelope is None:
+            envelope = self._envelope = self._bucket(order, sorted_x, y)
+            if envelope is None:
+                return sorted_x[:0], y[:0]
+        pick = envelope.rows(x)
+        return x[pick], y[pick]
+
+    def _bucket(self, order, sorted_x, y):
+        """Buckets of the whole history, from its rows sorted by x, or None
+        if no x value is finite."""
+        # Non-finite x values are sorted to the ends and not plotted.
+        first = np.searchsorted(sorted_x, -np.inf, side='right')
+        last = np.searchsorted(sorted_x, np.inf, side='left')
+        if first == last:
+            return None
+        x = sorted_x[first:last]
+        positions = slice(first, last) if order is None \
+            else order[first:last]
+        rows = np.arange(len(sorted_x))[positions]
+        # One more bucket than asked for holds the highest x.
+        envelope = _Envelope(self.buckets + 1, x[0],
+                             (x[-1] - x[0]) / self.buckets or 1)
+        bucket = envelope.bucket(x)
+        starts = np.flatnonzero(np.diff(bucket, prepend=-1))
+        low, high = _extremes(y[positions], starts)
+        envelope.low[bucket[starts]] = rows[low]
+        envelope.high[bucket[starts]] = rows[high]
+        return envelope
+
+    def _windowed(self, done):
+        """Points in and around the window, or None if no row from done on
+        is among them."""
+        start, stop = self.window
+        margin = WINDOW_MARGIN * (stop - start)
+        start, stop = start - margin, stop + margin
+        if done is not None:
+            new = self.history[self.x][done:]
+            if not np.any((new >= start) & (new <= stop)):
+                return None
+        buckets = int(self.buckets * (1 + 2 * WINDOW_MARGIN))
+        order, sorted_x = self.history.sorted(self.x)
+        low = np.searchsorted(sorted_x, start, side='left')
+        high = np.searchsorted(sorted_x, stop, side='right')
+        x = sorted_x[low:high]
+        positions = slice(low, high) if order is None else order[low:high]
+        y = self.history[self.y][positions]
+
+        if len(x) > 2 * buckets:
+            width = (stop - start) / buckets or 1
+            bucket = np.clip(((x - start) / width).astype(np.intp), 0,
+                             buckets - 1)
+            starts = np.flatnonzero(np.diff(bucket, prepend=-1))
+            pick = envelope(y, starts)
+            x, y = x[pick], y[pick]
+        return x, y
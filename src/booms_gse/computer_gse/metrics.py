@@ -0,0 +1,253 @@
+"""Metrics for watching the packet pipeline during long runs.
+
+A `Registry` holds counters, gauges and histograms and renders them in the
+Prometheus text format. `serve_metrics()` answers HTTP requests on localhost
+with that text, so a run can be watched with Prometheus or just `curl`.
+
+Metrics are either updated as events happen, or given a function that is
+called when they are read, which costs nothing between requests.
+"""
+import asyncio
+import logging
+import math
+from bisect import bisect_left
+
+# Upper bounds in seconds for histograms of short durations.
+DEFAULT_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4,
+                   5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25,
+                   0.5, 1.0, 2.5)
+# Seconds over which rates are averaged.
+RATE_INTERVAL = 1.0
+# Bytes read from a metrics request before giving up on it.
+MAX_REQUEST_SIZE = 1 << 14
+
+logger = logging.getLogger(__name__)
+
+
+def _format_value(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', r'\\').replace('"', r'\"') \
+            .replace('\n', r'\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Metric:
+    """A named metric with a value for each combination of labels."""
+    type = 'untyped'
+
+    def __init__(self, name, help_text, labelnames=()):
+        """Initialize the metric.
+
+        Args:
+            name (str): Metric name, like `bgse_packets_total`.
+            help_text (str): One line description.
+            labelnames (tuple(str)): Names of the labels that split the
+                metric. Values are given as a tuple in the same order.
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.function = None
+
+    def set_function(self, function):
+        """Read the values from a function when the metric is rendered.
+
+        Args:
+            function (callable): Returns a number for a metric without
+                labels, or a dictionary of numbers by label values tuple.
+        """
+        self.function = function
+
+    def current(self):
+        """The values now, by label values tuple."""
+        if self.function is None:
+            return self.values
+        values = self.function()
+        if isinstance(values, dict):
+            return values
+        return {(): values}
+
+    def render(self):
+        """The metric in the Prometheus text format."""
+        lines = [f'# HELP {self.name} {self.help_text}',
+                 f'# TYPE {self.name} {self.type}']
+        for labels, value in sorted(self.current().items()):
+            lines.append(f'{self.name}'
+                         f'{_format_labels(self.labelnames, labels)} '
+                         f'{_format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    """A count that only goes up."""
+    type = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        """Add to the count for a set of label values."""
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that can go up and down."""
+    type = 'gauge'
+
+    def set(self, value, labels=()):
+        """Set the value for a set of label values."""
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    """Counts of observations in buckets, with their sum."""
+    type = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        """Initialize the histogram.
+
+        Args:
+            name (str): Metric name, like `bgse_process_seconds`.
+            help_text (str): One line description.
+            labelnames (tuple(str)): Names of the labels that split the
+                metric.
+            buckets (tuple(float)): Increasing upper bounds of the buckets.
+                A bucket for everything larger is added.
+        """
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        """Count an observation for a set of label values."""
+        counts = self.values.get(labels)
+        if counts is None:
+            # One count per bucket, the overflow bucket and then the sum.
+            counts = self.values[labels] = [0] * (len(self.buckets) + 1) \
+                + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}',
+                 f'# TYPE {self.name} {self.type}']
+        names = self.labelnames + ('le',)
+        for labels, counts in sorted(self.values.items()):
+            total = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                total += count
+                bucket = _format_labels(names,
+                                        labels + (_format_value(bound),))
+                lines.append(f'{self.name}_bucket{bucket} {total}')
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_text} '
+                         f'{_format_value(counts[-1])}')
+            lines.append(f'{self.name}_count{label_text} {total}')
+        return lines
+
+
+class Registry:
+    """The set of metrics served together."""
+    def __init__(self):
+        self.metrics = {}
+
+    def _add(self, cls, name, *args, **kwargs):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = cls(name, *args, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f'Metric {name} already has type '
+                             f'{metric.type}.')
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        """Get or create a `Counter`."""
+        return self._add(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        """Get or create a `Gauge`."""
+        return self._add(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(),
+                  buckets=DEFAULT_BUCKETS):
+        """Get or create a `Histogram`."""
+        return self._add(Histogram, name, help_text, labelnames,
+                         buckets=buckets)
+
+    def render(self):
+        """All metrics in the Prometheus text format."""
+        lines = []
+        for metric in self.metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                logger.exception('Could not read metric %s', metric.name)
+        return '\n'.join(lines) + '\n'
+
+
+async def serve_metrics(registry, port, host='127.0.0.1'):
+    """Start an HTTP server that answers every GET with the metrics.
+
+    Args:
+        registry (Registry): The metrics to serve.
+        port (int): TCP port to listen on.
+        host (str): Address to listen on. Local only by default.
+
+    Returns:
+        asyncio.Server: The running server. Close it when done.
+    """
+    async def handle(reader, writer):
+        try:
+            request = await reader.readuntil(b'\r\n\r\n')
+            if request.startswith(b'GET '):
+                body = registry.render().encode()
+                status = b'200 OK'
+            else:
+                body = b'Only GET is supported.\n'
+                status = b'405 Method Not Allowed'
+            writer.write(b'HTTP/1.1 ' + status + b'\r\n'
+                         b'Content-Type: text/plain; version=0.0.4\r\n'
+                         b'Content-Length: ' + str(len(body)).encode()
+                         + b'\r\nConnection: close\r\n\r\n' + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port,
+                                        limit=MAX_REQUEST_SIZE)
+    logger.info('Serving metrics at http://%s:%d/metrics', host, port)
+    return server
+
+
+async def monitor_rates(registry, counter, name, help_text,
+                        interval=RATE_INTERVAL):
+    """Keep a gauge of the per second rate of a counter, until cancelled.
+
+    Args:
+        registry (Registry): Gets the gauge.
+        counter (Counter): The counter to follow.
+        name (str): Name of the gauge.
+        help_text (str): One line description of the gauge.
+        interval (float): Seconds over which the rate is averaged.
+    """
+    gauge = registry.gauge(name, help_text, counter.labelnames)
+    loop = asyncio.get_running_loop()
+    last, last_time = dict(counter.current()), loop.time()
+    while True:
+        await asyncio.sleep(interval)
+        now, now_time = dict(counter.current()), loop.time()
+        elapsed = now_time - last_time
+        gauge.values = {labels: (value - last.get(labels, 0)) / elapsed
+                        for labels, value in now.items()}
+        last, last_time = now, now_time
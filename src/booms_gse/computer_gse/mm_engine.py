@@ -0,0 +1,140 @@
+"""The telemetry shared by every mm_gse session.
+
+Bokeh runs `mm_gse.py` again for each browser session, but this module is
+only imported once in a process. `get_engine()` returns its one
+`TelemetryEngine`, which binds the telemetry port, decodes each packet into
+the readings and histories, and sends commands. A session only keeps views
+of the histories and redraws what changed, so each added viewer costs
+rendering and not another decoder.
+
+Sessions find what changed by the version of each reading, which counts its
+changes, and by the length of each history.
+"""
+import asyncio
+import logging
+import socket
+from collections import Counter
+
+from . import history, store, telemetry
+from .packet import crc_valid, packet_crc
+
+CMD_PORT = 50501
+TM_PORT = 20502
+
+logger = logging.getLogger(__name__)
+
+_engine = None
+
+
+def get_engine(**kwargs):
+    """The engine of this process, created with kwargs the first time.
+
+    Args:
+        **kwargs: Passed to `TelemetryEngine` if there is no engine yet, and
+            otherwise ignored.
+    """
+    global _engine
+    if _engine is None:
+        _engine = TelemetryEngine(**kwargs)
+    return _engine
+
+
+class TelemetryProtocol(asyncio.DatagramProtocol):
+    """Pass received packets to the engine."""
+    def __init__(self, engine):
+        self.engine = engine
+
+    def datagram_received(self, data, addr):
+        self.engine.packet_received(data)
+
+
+class TelemetryEngine:
+    """Receive and decode mm_gse telemetry once for every session."""
+    def __init__(self, crc_checked=False, store_path=None, port=TM_PORT):
+        """Initialize the engine and load any stored history.
+
+        Args:
+            crc_checked (bool): Packets are sent by a forwarder that only
+                sends those with a valid CRC, so they are not checked again.
+            store_path (Path): Directory to keep the histories in, as
+                `store.ColumnStore`s. Only kept in memory if None.
+            port (int): UDP port the telemetry is sent to.
+        """
+        self.crc_checked = crc_checked
+        self.port = port
+        self.histories = {}
+        for name, columns in telemetry.COLUMNS.items():
+            column_store = None if store_path is None \
+                else store.ColumnStore(store_path / name, columns)
+            self.histories[name] = history.History(columns,
+                                                   store=column_store)
+        self.versions = Counter()
+        self.decoder = telemetry.TelemetryDecoder(
+            on_row=self._add_row, on_change=self._changed)
+        self.command_packet = bytearray()
+        self.command_sequence_number = -1
+        self.transport = None
+        self._task = None
+
+    def _add_row(self, name, row):
+        self.histories[name].append(row)
+
+    def _changed(self, name):
+        self.versions[name] += 1
+
+    def listen(self):
+        """Start receiving telemetry on the running loop, if not already."""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(
+                self._bind())
+
+    async def _bind(self):
+        loop = asyncio.get_running_loop()
+        try:
+            self.transport, _ = await loop.create_datagram_endpoint(
+                lambda: TelemetryProtocol(self),
+                local_addr=('0.0.0.0', self.port))
+        except OSError as exc:
+            logger.error('Could not listen for telemetry on port %d: %s',
+                         self.port, exc)
+
+    def packet_received(self, data):
+        """Decode a packet."""
+        if not self.crc_checked and not crc_valid(data):
+            print("Bad checksum")
+            return
+        self.decoder.decode(data)
+
+    def send_command(self, address, sysid, cmdtype, payload=()):
+        """Send a command to the flight computer.
+
+        Args:
+            address (str): The flight computer's IP address.
+            sysid (int): System ID the command is for.
+            cmdtype (int): Command type.
+            payload (iterable(int)): Command bytes.
+        """
+        self.command_sequence_number += 1
+        payload = bytearray(payload)
+        packet = (bytearray.fromhex('90eb0000') +
+                  bytearray([sysid, cmdtype,
+                             self.command_sequence_number & 0xFF,
+                             len(payload)]) +
+                  payload)
+        packet[2:4] = packet_crc(packet).to_bytes(2, 'little')
+        self.command_packet = packet
+
+        print(f"Sending {packet.hex()} to {address}")
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto(packet, (address, CMD_PORT))
+        self.versions['command'] += 1
+
+    def close(self):
+        """Stop receiving telemetry and close the stores."""
+        if self._task is not None:
+            self._task.cancel()
+        if self.transport is not None:
+            self.transport.close()
+        for kept in self.histories.values():
+            if kept.store is not None:
+                kept.store.close()
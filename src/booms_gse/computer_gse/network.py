@@ -6,55 +6,107 @@ processors, each instances of `PacketProcessor` or one of its subclasses.
 """
 import asyncio
 import logging
+import math
 import os
 import pty
+import select
+import socket
+import tty
+from collections import deque
+from functools import partial
 from itertools import chain
 from pathlib import Path
+from threading import Event, Thread
+from time import perf_counter, time_ns
 
-import serial
-from bokeh.application import Application
-from bokeh.application.handlers import ScriptHandler
-from bokeh.server.server import Server
+from . import capture, metrics, playback, recording, sequence, watchdog
+from .packet import HEADER_LENGTH, Packet
 
 BOOMS_SERIAL_DIR = Path(
     os.environ.get('BOOMS_SERIAL_DIR', default='/dev/booms'))
 
 PLAYBACK_PATH = Path(os.environ.get('BOOMS_PLAYBACK', default='playback'))
+# Speed passed to the playback binary to replay as quickly as possible.
+EXTERNAL_MAX_SPEED = 99999.
 COMMAND_PACKET = b'\x90\xeb\xe3\x56\xa0\xa1\x00\x04\xc0\xa8\x02\x01'
 COMPUTER_IP = '192.168.2.101'
 COMMAND_PORT = 50501
 
+# Batched ingest buffer. Packets are packed into it until less than one
+# maximum sized datagram of space remains.
+INGEST_BUFFER_SIZE = 1 << 20
+MAX_DATAGRAM_SIZE = 65535
+INGEST_BATCH_SIZE = 1024
+# Kernel receive buffer requested for the batched ingest socket.
+INGEST_SOCKET_BUFFER = 1 << 23
+# Seconds the ingest thread waits before checking if it should stop.
+INGEST_POLL_INTERVAL = 0.2
+
+# Bytes a file descriptor writer buffers before its producer waits, and the
+# largest single write it makes.
+WRITE_BUFFER_SIZE = 1 << 16
+WRITE_CHUNK_SIZE = 1 << 12
+# Bytes buffered for each pseudo serial port, so a slow reader loses nothing
+# until it is this far behind.
+PTY_BUFFER_SIZE = 1 << 20
+# Longest burst, in seconds of data, written to a paced file descriptor.
+PACE_INTERVAL = 0.02
+# Bits sent on a serial line for each byte, with a start and a stop bit.
+BITS_PER_BYTE = 10
+
+# Default limit and overflow policy for the queues in front of processors.
+QUEUE_SIZE = 10000
+OVERFLOW_POLICIES = ('drop-oldest', 'drop-newest', 'block')
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
-async def write_with_lock(file, data, lock):
-    """Acquire an async lock before writting and flushing data.
-
-    Args:
-        file: A file like object that has a method write(data).
-        data (bytes): A bytes object to be written.
-        lock (asyncio.Lock): Lock to prevent simultaneous writes.
-    """
-    async with lock:
-        file.write(data)
-        file.flush()
-
-
 class FlightComputerReceiver(asyncio.DatagramProtocol):
     """Endpoint for flight computer UDP packets that runs a set of processors
     on each packet received."""
-    def __init__(self, processors=None):
+    def __init__(self, processors=None, registry=None, sequences=None):
         """Initialize the instance with a set of processors.
 
         Args:
             processors (tuple(PacketProcessor)): Each processor should will
-                have received() called for each UDP packet.
+                have received() called for each UDP packet it subscribes to.
+            registry (metrics.Registry): Gets metrics for the receiver and
+                processors if given. Processors are then timed.
+            sequences (sequence.SequenceTracker): Counts lost and reordered
+                packets, and puts packets back in order before the
+                processors get them. None to pass packets as they arrive.
         """
         if processors is None:
             processors = tuple()
         self.processors = tuple(processors)
         self.transport = None
+        self.sequences = sequences
+        self._expire_handle = None
+        # Processors given every datagram before it is checked or ordered.
+        self.capturing = tuple(p for p in self.processors
+                               if p.every_datagram)
+        self.routes = build_routes(
+            [p for p in self.processors if not p.every_datagram])
+        for p in self.processors:
+            p.receiver = self
+        # Packets received with a CRC that does not match.
+        self.bad_crc = 0
+        self.socket_errors = 0
+        # Packets and bytes received for each system ID.
+        self.sysid_packets = [0] * 256
+        self.sysid_bytes = [0] * 256
+        self.process_seconds = None
+        if registry is not None:
+            self.register_metrics(registry)
+
+        # Cleared while a processor has paused reading. The event is for
+        # in process playback and the threading event for the batch reader.
+        self.reading = asyncio.Event()
+        self.reading.set()
+        self.reading_threadsafe = Event()
+        self.reading_threadsafe.set()
+        self._paused_by = set()
 
     def connection_made(self, transport):
         """Setup the prcessors when a connection is made."""
@@ -63,31 +115,325 @@ class FlightComputerReceiver(asyncio.DatagramProtocol):
         for p in self.processors:
             p.setup(transport)
 
+        if self.sequences is not None:
+            self._expire_handle = asyncio.get_running_loop().call_later(
+                self.sequences.timeout / 2, self._expire_sequences)
+
     def connection_lost(self, exc):
         """Close the processors when the connection is lost."""
         logger.info('Lost UDP connection')
         if exc is not None:
             logger.warning('UDP closed with exception.', exc_info=exc)
 
+        if self.sequences is not None:
+            self._expire_handle.cancel()
+            self._route_batch(self.sequences.flush())
+
         for p in self.processors:
             p.close()
 
+        if self.bad_crc:
+            logger.warning('%d packets had a bad CRC.', self.bad_crc)
+        if self.sequences is not None:
+            logger.info('Sequence numbers: %s', self.sequences.stats())
+        for name, stats in self.stats().items():
+            logger.info('%s: %s', name, stats)
+
+    def pause_reading(self, processor):
+        """Stop taking in packets until the processor calls
+        resume_reading(). Used for backpressure from full queues."""
+        if not self._paused_by:
+            logger.debug('Reading paused by %s', processor.name)
+            self.reading.clear()
+            self.reading_threadsafe.clear()
+            if self.transport is not None \
+                    and hasattr(self.transport, 'pause_reading'):
+                self.transport.pause_reading()
+        self._paused_by.add(processor)
+
+    def resume_reading(self, processor):
+        """Start taking in packets again once no processor is paused."""
+        self._paused_by.discard(processor)
+        if not self._paused_by and not self.reading.is_set():
+            logger.debug('Reading resumed by %s', processor.name)
+            self.reading.set()
+            self.reading_threadsafe.set()
+            if self.transport is not None \
+                    and hasattr(self.transport, 'resume_reading'):
+                self.transport.resume_reading()
+
+    def stats(self):
+        """Statistics from each processor that keeps them, by name."""
+        stats = {}
+        for p in self.processors:
+            processor_stats = p.stats()
+            if processor_stats is not None:
+                stats[p.name] = processor_stats
+        return stats
+
+    def register_metrics(self, registry):
+        """Add metrics for the receiver and processors to a registry.
+
+        Args:
+            registry (metrics.Registry): The registry to add to.
+        """
+        def by_sysid(counts):
+            return {(f'{sysid:#04x}',): count
+                    for sysid, count in enumerate(counts) if count}
+
+        registry.counter(
+            'bgse_packets_total', 'Packets received by system ID.',
+            ('sysid',)).set_function(lambda: by_sysid(self.sysid_packets))
+        registry.counter(
+            'bgse_bytes_total', 'Bytes received by system ID.',
+            ('sysid',)).set_function(lambda: by_sysid(self.sysid_bytes))
+        if self.sequences is not None:
+            for key, help_text in (
+                    ('gaps', 'Sequence numbers never received.'),
+                    ('duplicates', 'Packets received more than once.'),
+                    ('late', 'Packets received after their place was given '
+                             'up.'),
+                    ('reordered', 'Packets received out of order and put '
+                                  'back in order.'),
+                    ('resets', 'Times the sequence numbers restarted.')):
+                registry.counter(
+                    f'bgse_sequence_{key}_total', help_text, ('sysid',)
+                    ).set_function(partial(self._sequence_stats, key))
+            registry.gauge(
+                'bgse_sequence_held', 'Packets held waiting for missing ones.'
+                ).set_function(lambda: self.sequences.held)
+        registry.counter(
+            'bgse_bad_crc_total', 'Packets received with a bad CRC.'
+            ).set_function(lambda: self.bad_crc)
+        registry.counter(
+            'bgse_socket_errors_total', 'Errors reported by the UDP socket.'
+            ).set_function(lambda: self.socket_errors)
+        registry.gauge(
+            'bgse_queue_depth', 'Packets waiting in a processor queue.',
+            ('processor',)).set_function(self._queue_depths)
+        registry.gauge(
+            'bgse_processor_stat', 'Statistics kept by a processor.',
+            ('processor', 'key', 'stat')).set_function(self._processor_stats)
+        self.process_seconds = registry.histogram(
+            'bgse_process_seconds',
+            'Time a processor takes to handle packets. Queued processors '
+            'are timed in their own task, including waits on their sink.',
+            ('processor',))
+        # Queued processors only add packets to their queue when called
+        # here, so they time themselves.
+        self._timed = {}
+        for p in self.processors:
+            if isinstance(p, QueuedProcessor):
+                p.process_seconds = self.process_seconds
+            else:
+                self._timed[p] = (p.name,)
+
+    def _sequence_stats(self, key):
+        return {(f'{sysid:#04x}',): stats[key] for sysid, stats
+                in self.sequences.sysid_stats().items()}
+
+    def _expire_sequences(self):
+        self._route_batch(self.sequences.expire())
+        self._expire_handle = asyncio.get_running_loop().call_later(
+            self.sequences.timeout / 2, self._expire_sequences)
+
+    def _queue_depths(self):
+        return {(name,): stats['depth'] for name, stats in self.stats().items()
+                if 'depth' in stats}
+
+    def _processor_stats(self):
+        values = {}
+        for name, stats in self.stats().items():
+            for key, value in stats.items():
+                if isinstance(value, dict):
+                    # Nested statistics, like those of each destination.
+                    for stat, inner in value.items():
+                        values[(name, key, stat)] = inner
+                else:
+                    values[(name, '', key)] = value
+        return {labels: value for labels, value in values.items()
+                if isinstance(value, (int, float))}
+
     def datagram_received(self, data, addr):
-        """Run the processors for each packet received."""
+        """Run the subscribed processors for each packet received."""
         logger.debug('Datagram received from %s', addr)
+        arrival = time_ns()
+        for p in self.capturing:
+            p.receive_datagram(data, arrival)
 
-        for p in self.processors:
-            p.receive(data)
+        if len(data) < HEADER_LENGTH:
+            logger.warning('Packet is too short for header (<16 bytes).')
+            return
+
+        self._packet(Packet(data, arrival=arrival))
+
+    def packet_received(self, packet):
+        """Run the subscribed processors on a parsed packet.
+
+        Args:
+            packet (Packet): The packet with its CRC checked. Given the
+                current time on arrival if it has none.
+        """
+        if packet.arrival is None:
+            packet.arrival = time_ns()
+        for p in self.capturing:
+            p.receive_datagram(packet.data, packet.arrival)
+        self._packet(packet)
+
+    def _packet(self, packet):
+        sysid = packet.sysid
+        self.sysid_packets[sysid] += 1
+        self.sysid_bytes[sysid] += len(packet.data)
+        if not packet.valid:
+            self.bad_crc += 1
+
+        if self.sequences is None:
+            self._route(packet)
+        else:
+            for released in self.sequences.push(packet):
+                self._route(released)
+
+    def _route(self, packet):
+        tmtype = packet.tmtype
+        histogram = self.process_seconds
+        for p, tmtypes in self.routes[packet.sysid]:
+            if tmtypes is None or tmtype in tmtypes:
+                labels = None if histogram is None else self._timed.get(p)
+                if labels is None:
+                    p.receive(packet)
+                else:
+                    start = perf_counter()
+                    p.receive(packet)
+                    histogram.observe(perf_counter() - start, labels)
+
+    def batch_received(self, packets, arrivals):
+        """Run the processors on a batch of packets read together. Each
+        processor is called once with the packets it subscribes to.
+
+        Args:
+            packets (list(bytes)): UDP packets in the order received.
+            arrivals (list(int)): time.time_ns() when each packet arrived.
+        """
+        logger.debug('Batch of %d datagrams received', len(packets))
+        if self.capturing:
+            datagrams = list(zip(arrivals, packets))
+            for p in self.capturing:
+                p.receive_datagrams(datagrams)
+
+        parsed = []
+        for data, arrival in zip(packets, arrivals):
+            if len(data) < HEADER_LENGTH:
+                logger.warning('Packet is too short for header (<16 bytes).')
+                continue
+            parsed.append(Packet(data, arrival=arrival))
+        self._packets(parsed)
+
+    def packets_received(self, packets):
+        """Run the processors on a batch of parsed packets.
+
+        Args:
+            packets (list(Packet)): Packets with their CRC checked. Those
+                with no arrival time are given the current time.
+        """
+        now = None
+        for packet in packets:
+            if packet.arrival is None:
+                if now is None:
+                    now = time_ns()
+                packet.arrival = now
+        if self.capturing:
+            datagrams = [(packet.arrival, packet.data) for packet in packets]
+            for p in self.capturing:
+                p.receive_datagrams(datagrams)
+        self._packets(packets)
+
+    def _packets(self, packets):
+        sysid_packets = self.sysid_packets
+        sysid_bytes = self.sysid_bytes
+        for packet in packets:
+            sysid = packet.sysid
+            sysid_packets[sysid] += 1
+            sysid_bytes[sysid] += len(packet.data)
+            if not packet.valid:
+                self.bad_crc += 1
+
+        if self.sequences is not None:
+            packets = self.sequences.push_batch(packets)
+        self._route_batch(packets)
+
+    def _route_batch(self, packets):
+        if not packets:
+            return
+        batches = {p: [] for p in self.processors}
+        for packet in packets:
+            tmtype = packet.tmtype
+            for p, tmtypes in self.routes[packet.sysid]:
+                if tmtypes is None or tmtype in tmtypes:
+                    batches[p].append(packet)
+
+        histogram = self.process_seconds
+        for p, batch in batches.items():
+            if not batch:
+                continue
+            labels = None if histogram is None else self._timed.get(p)
+            if labels is None:
+                p.receive_batch(batch)
+            else:
+                start = perf_counter()
+                p.receive_batch(batch)
+                histogram.observe(perf_counter() - start, labels)
 
     def error_received(self, exc):
         """Log any errors that occur."""
+        self.socket_errors += 1
         logger.warning('Flight Computer UDP error received', exc_info=exc)
 
 
+def build_routes(processors):
+    """Build the table of processors subscribed to each system ID.
+
+    Args:
+        processors (tuple(PacketProcessor)): Processors with their
+            subscriptions set.
+
+    Returns:
+        list: 256 tuples, one for each system ID, of (processor, tmtypes)
+            pairs. tmtypes is None when the processor takes every type.
+    """
+    routes = []
+    for sysid in range(256):
+        routes.append(tuple(
+            (p, None if p.tmtypes is None else frozenset(p.tmtypes))
+            for p in processors
+            if p.sysids is None or sysid in p.sysids))
+    return routes
+
+
 class PacketProcessor:
-    """Contain an operation to be run on packets as they're received."""
+    """Contain an operation to be run on packets as they're received.
+
+    Attributes:
+        sysids (set(int)): System IDs of the packets passed to receive().
+            None for all packets.
+        tmtypes (set(int)): Telemetry types of the packets passed to
+            receive(). None for all types.
+        every_datagram (bool): Class attribute, True for processors that
+            get every datagram as it arrives from receive_datagram(),
+            before it is checked, put in order or routed, instead of
+            receive().
+    """
+    every_datagram = False
+
     def __init__(self):
         self.transport = None
+        self.receiver = None
+        self.sysids = None
+        self.tmtypes = None
+
+    @property
+    def name(self):
+        """Name used for the processor in logs and statistics."""
+        return type(self).__name__
 
     def setup(self, transport):
         """Initialize anything needed for packet processing.
@@ -99,13 +445,49 @@ class PacketProcessor:
         self.transport = transport
 
     def receive(self, packet):
-        """The function run on each packet.
+        """The function run on each packet subscribed to.
 
         Args:
-        packet (bytes): The entire UDP packet received. Should be overloaded by
+        packet (Packet): The UDP packet received, with its CRC checked. It is
+            at least as long as the header. Should be overloaded by
             subclasses.
         """
 
+    def receive_batch(self, packets):
+        """The function run on a batch of packets received together.
+
+        Calls receive() for each packet. Subclasses may overload this when
+        handling the packets together is faster.
+
+        Args:
+            packets (list(Packet)): UDP packets in the order received.
+        """
+        for packet in packets:
+            self.receive(packet)
+
+    def receive_datagram(self, data, arrival):
+        """The function run on each datagram when every_datagram is set.
+
+        Args:
+            data (bytes): The datagram as received, of any length.
+            arrival (int): time.time_ns() when it arrived.
+        """
+
+    def receive_datagrams(self, datagrams):
+        """The function run on datagrams read together when every_datagram
+        is set. Calls receive_datagram() for each.
+
+        Args:
+            datagrams (list(tuple)): Arrival time in nanoseconds and bytes of
+                each datagram in the order received.
+        """
+        for arrival, data in datagrams:
+            self.receive_datagram(data, arrival)
+
+    def stats(self):
+        """Statistics kept by the processor as a dictionary, or None."""
+        return None
+
     def close(self):
         """Clear the transport variable. Should be overloaded with cleanup
         when needed by a subclass.
@@ -114,13 +496,172 @@ class PacketProcessor:
         self.transport = None
 
 
-class PacketSerial(PacketProcessor):
+class PacketQueue:
+    """Bounded queue of packets waiting for a processor."""
+    def __init__(self, maxsize=QUEUE_SIZE, overflow='drop-oldest'):
+        """Initialize an empty queue.
+
+        Args:
+            maxsize (int): Number of packets the queue may hold.
+            overflow (str): What to do with a packet when the queue is full.
+                'drop-oldest' discards the oldest queued packet,
+                'drop-newest' discards the new packet and 'block' keeps it but
+                asks the receiver to pause until the queue is taken.
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown overflow policy {overflow!r}.')
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.packets = deque(maxlen=maxsize if overflow == 'drop-oldest'
+                             else None)
+        self.high_water = 0
+        self.dropped = 0
+        self.ready = None
+
+    def __len__(self):
+        return len(self.packets)
+
+    def start(self):
+        """Create the ready event on the running event loop."""
+        self.ready = asyncio.Event()
+
+    @property
+    def full(self):
+        """True if the queue holds maxsize or more packets."""
+        return len(self.packets) >= self.maxsize
+
+    def put(self, packet):
+        """Add a packet following the overflow policy.
+
+        Returns:
+            bool: False if the packet was dropped.
+        """
+        if self.full:
+            if self.overflow == 'drop-newest':
+                self.dropped += 1
+                return False
+            if self.overflow == 'drop-oldest':
+                # The deque's maxlen discards the oldest packet.
+                self.dropped += 1
+
+        self.packets.append(packet)
+        if len(self.packets) > self.high_water:
+            self.high_water = len(self.packets)
+        self.ready.set()
+        return True
+
+    def take(self):
+        """Remove and return every queued packet."""
+        packets = list(self.packets)
+        self.packets.clear()
+        self.ready.clear()
+        return packets
+
+    def stats(self):
+        """Current depth, high-water mark and drops as a dictionary."""
+        return {'depth': len(self.packets),
+                'high_water': self.high_water,
+                'dropped': self.dropped,
+                'maxsize': self.maxsize}
+
+
+class QueuedProcessor(PacketProcessor):
+    """A processor that handles packets from a bounded queue in its own
+    task, so a slow sink does not hold up the receiver or other processors.
+    Subclasses overload process()."""
+    # Seconds to wait for packets before calling process() with none.
+    # None to only call process() when there are packets.
+    idle_interval = None
+
+    def __init__(self, queue_size=QUEUE_SIZE, overflow='drop-oldest'):
+        """Initialize the processor's queue.
+
+        Args:
+            queue_size (int): Number of packets that may wait for processing.
+            overflow (str): Policy when the queue is full. See `PacketQueue`.
+        """
+        super().__init__()
+        self.queue = PacketQueue(queue_size, overflow)
+        # Histogram of the time taken by process(), set by the receiver.
+        self.process_seconds = None
+        self._task = None
+        self._blocking = False
+
+    def setup(self, transport):
+        """Start the task processing the queue."""
+        super().setup(transport)
+        self.queue.start()
+        self._task = asyncio.create_task(self._run())
+
+    def receive(self, packet):
+        """Add the packet to the queue."""
+        self.queue.put(packet)
+        if self.queue.overflow == 'block' and self.queue.full:
+            self._block()
+
+    def receive_batch(self, packets):
+        """Add the packets to the queue."""
+        for packet in packets:
+            self.queue.put(packet)
+        if self.queue.overflow == 'block' and self.queue.full:
+            self._block()
+
+    def _block(self):
+        if not self._blocking and self.receiver is not None:
+            self._blocking = True
+            self.receiver.pause_reading(self)
+
+    async def _run(self):
+        while True:
+            if self.idle_interval is None:
+                await self.queue.ready.wait()
+            else:
+                try:
+                    await asyncio.wait_for(self.queue.ready.wait(),
+                                           self.idle_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            packets = self.queue.take()
+            if self._blocking:
+                self._blocking = False
+                self.receiver.resume_reading(self)
+            if self.process_seconds is None:
+                await self.process(packets)
+            else:
+                start = perf_counter()
+                await self.process(packets)
+                self.process_seconds.observe(perf_counter() - start,
+                                             (self.name,))
+
+    async def process(self, packets):
+        """Handle packets taken from the queue.
+
+        Args:
+            packets (list(Packet)): The packets in the order received. May be
+                empty if idle_interval is set.
+        """
+
+    def stats(self):
+        """Statistics of the queue."""
+        return self.queue.stats()
+
+    def close(self):
+        """Stop processing the queue."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        super().close()
+
+
+class PacketSerial(QueuedProcessor):
     """Forward the contents of the frame for a selected imager or spectrometer
     to a serial port."""
     SERIAL_CONFIGS = {'imag': {'baudrate': 230400},
                       'spec': {'baudrate': 38400}}
 
-    def __init__(self, device_id, serial_port):
+    def __init__(self, device_id, serial_port, queue_size=QUEUE_SIZE,
+                 overflow='drop-oldest'):
         """Initialize the serial packet processor
 
         Args:
@@ -128,13 +669,21 @@ class PacketSerial(PacketProcessor):
                 should be one byte (0 <= device_id < 256). Imagers will start
                 with the first four bits following the pattern 0xC* and
                 spectrometers 0xD*.
+            serial_port (str): The serial port to write to.
+            queue_size (int): Number of packets that may wait to be written.
+            overflow (str): Policy when the queue is full. See `PacketQueue`.
         """
-        super().__init__()
+        super().__init__(queue_size, overflow)
 
-        self.serial_lock = asyncio.Lock()
         self.device_id = int(device_id)
+        self.sysids = {self.device_id}
         self.serial_port = serial_port
         self.serial = None
+        self.writer = None
+
+    @property
+    def name(self):
+        return f'{type(self).__name__}({self.device_id:#04x})'
 
     def setup(self, transport):
         """Setup the serial port target for packets."""
@@ -150,62 +699,393 @@ class PacketSerial(PacketProcessor):
                                'device. Must be imager (0xC*) or spectrometer '
                                '(0xD*).')
 
+        # Imported here so subcommands without a serial port start quickly.
+        import serial
+
         self.serial = serial.Serial(port=self.serial_port, **serial_kwargs)
 
         if self.serial is None:
             # Triggered if there was an error setting up the serial connection.
             raise RuntimeError('Serial not initialized.')
 
-    def receive(self, packet):
-        """Write the packet to the serial port."""
-        if len(packet) < 16:
-            logger.warning('Packet is too short for header (<16 bytes).')
+        # pyserial only configures the port. Writes go straight to its file
+        # descriptor from the event loop.
+        self.writer = FdWriter(self.serial.fileno())
+        self.writer.start()
+        super().setup(transport)
+
+    async def process(self, packets):
+        """Add the payloads to the serial output buffer, waiting while it is
+        full so the queue's overflow policy applies."""
+        if self.serial is None:
+            # Triggered if self.setup() was skipped or self.close()
+            #    has been called.
+            raise RuntimeError('Serial not initialized.')
 
-        if packet[4] == self.device_id:
-            if self.serial is None:
-                # Triggered if self.setup() was skipped or self.close()
-                #    has been called.
-                raise RuntimeError('Serial not initialized.')
+        await self.writer.wait_for_space()
+        self.writer.write(b''.join(packet.payload for packet in packets),
+                          force=True)
 
-            asyncio.create_task(
-                write_with_lock(self.serial, packet[16:], self.serial_lock)
-            )
+    def stats(self):
+        """Statistics of the queue and the serial output buffer."""
+        stats = super().stats()
+        if self.writer is not None:
+            stats.update(self.writer.stats())
+        return stats
 
     def close(self):
-        """Close the serial connection."""
+        """Write any queued packets and close the serial connection."""
+        super().close()
         if self.serial is not None:
+            self.writer.write(
+                b''.join(packet.payload for packet in self.queue.take()),
+                force=True)
+            self.writer.close()
             self.serial.close()
-        super().close()
+            self.serial = None
+
+
+class FdWriter:
+    """Write to a non-blocking file descriptor when the event loop reports it
+    is writable.
+
+    Data is collected in an output buffer, so small payloads are coalesced
+    into writes of up to chunk_size bytes. With a rate, writes are spaced so
+    the data leaves no faster than a serial line would send it.
+    """
+    def __init__(self, fd, buffer_size=WRITE_BUFFER_SIZE,
+                 chunk_size=WRITE_CHUNK_SIZE, rate=None):
+        """Initialize the writer. Call start() from the event loop to begin.
+
+        Args:
+            fd (int): The file descriptor to write to. It is made
+                non-blocking.
+            buffer_size (int): Bytes that may be pending. Reaching it counts
+                as an overrun, and data that would go beyond it is dropped
+                unless forced.
+            chunk_size (int): Largest number of bytes in one write.
+            rate (float): Most bytes per second to write. None for as fast as
+                the file descriptor accepts them.
+        """
+        self.fd = fd
+        self.buffer_size = buffer_size
+        self.chunk_size = chunk_size
+        self.rate = rate
+        if rate is not None:
+            self.chunk_size = max(1, min(chunk_size,
+                                         int(rate * PACE_INTERVAL)))
+        # Bytes the rate allows to be written, and when it was last updated.
+        self._credit = 0.
+        self._credit_time = None
+        self._timer = None
+        self.buffer = bytearray()
+        self.bytes_written = 0
+        self.high_water = 0
+        self.underruns = 0
+        self.overruns = 0
+        self.dropped_bytes = 0
+        self.loop = None
+        self._space = None
+        self._writing = False
+
+    @property
+    def pending(self):
+        """Number of bytes waiting to be written."""
+        return len(self.buffer)
+
+    @property
+    def occupancy(self):
+        """Fraction of the buffer in use."""
+        return self.pending / self.buffer_size
+
+    def start(self):
+        """Make the file descriptor non-blocking on the running loop."""
+        self.loop = asyncio.get_running_loop()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._credit_time = self.loop.time()
+        os.set_blocking(self.fd, False)
+
+    def write(self, data, force=False):
+        """Add data to the output buffer.
+
+        Args:
+            data (bytes): The data to write.
+            force (bool): Accept the data even if the buffer is full.
+
+        Returns:
+            bool: False if the data was dropped because the buffer was full.
+        """
+        if not data:
+            return True
+        if not force and self.pending + len(data) > self.buffer_size:
+            self.dropped_bytes += len(data)
+            if self._space.is_set():
+                self.overruns += 1
+                self._space.clear()
+            return False
+
+        self.buffer += data
+        if self.pending > self.high_water:
+            self.high_water = self.pending
+        if self.pending >= self.buffer_size and self._space.is_set():
+            self.overruns += 1
+            self._space.clear()
+        if not self._writing:
+            self._writing = True
+            self.loop.add_writer(self.fd, self._on_writable)
+        return True
+
+    async def wait_for_space(self):
+        """Wait until the buffer is below its size."""
+        await self._space.wait()
+
+    def _on_writable(self):
+        size = self.chunk_size
+        if self.rate is not None:
+            now = self.loop.time()
+            # An idle line does not save up more than one chunk.
+            self._credit = min(self.chunk_size, self._credit
+                               + (now - self._credit_time) * self.rate)
+            self._credit_time = now
+            needed = min(self.pending, self.chunk_size)
+            if self._credit < needed:
+                # Wait for the line to send what was already written.
+                self.loop.remove_writer(self.fd)
+                self._timer = self.loop.call_later(
+                    (needed - self._credit) / self.rate, self._resume)
+                return
+            size = int(self._credit)
+        try:
+            written = os.write(self.fd, self.buffer[:size])
+        except BlockingIOError:
+            return
+        except OSError as exc:
+            logger.warning('Write to fd %d failed, dropping %d bytes.',
+                           self.fd, self.pending, exc_info=exc)
+            written = self.pending
+
+        del self.buffer[:written]
+        self.bytes_written += written
+        self._credit -= written
+        if self.pending < self.buffer_size:
+            self._space.set()
+        if not self.buffer:
+            # The output ran dry, so the line will idle until more data.
+            self.underruns += 1
+            self._writing = False
+            self.loop.remove_writer(self.fd)
+
+    def _resume(self):
+        self._timer = None
+        self.loop.add_writer(self.fd, self._on_writable)
+
+    def stats(self):
+        """Pending, written and dropped bytes, underruns and overruns."""
+        return {'bytes_pending': self.pending,
+                'bytes_written': self.bytes_written,
+                'dropped_bytes': self.dropped_bytes,
+                'buffer_high_water': self.high_water,
+                'underruns': self.underruns,
+                'overruns': self.overruns}
+
+    def close(self, wait=True):
+        """Stop watching the file descriptor and write the rest of the
+        buffer. Does not close the file descriptor.
+
+        Args:
+            wait (bool): Block until the rest is written. Otherwise write
+                what the file descriptor accepts now and drop the rest.
+        """
+        if self._writing:
+            self._writing = False
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            else:
+                self.loop.remove_writer(self.fd)
+        if self.buffer:
+            view = memoryview(bytes(self.buffer))
+            self.buffer.clear()
+            os.set_blocking(self.fd, wait)
+            try:
+                while view:
+                    written = os.write(self.fd, view)
+                    self.bytes_written += written
+                    view = view[written:]
+            except BlockingIOError:
+                self.dropped_bytes += len(view)
+            except OSError as exc:
+                self.dropped_bytes += len(view)
+                logger.warning('Write to fd %d failed on close.', self.fd,
+                               exc_info=exc)
+
+
+class ForwardDestination:
+    """An address packets are forwarded to, with its send counters."""
+    def __init__(self, target_ip, target_port, sysids=None, valid_only=False):
+        """Resolve the address once so sends do not parse it again.
+
+        Args:
+            target_ip (str): Host or IPv4 or IPv6 address to receive the
+                packets.
+            target_port (int): UDP port, 0 < target_port <= 65535.
+            sysids (set(int)): System IDs to forward. None for all.
+            valid_only (bool): Only forward packets with a valid CRC, so the
+                receiver does not need to check them.
+        """
+        self.target_ip = target_ip
+        self.target_port = target_port
+        self.sysids = None if sysids is None else frozenset(sysids)
+        self.valid_only = valid_only
+        info = socket.getaddrinfo(target_ip, target_port,
+                                  type=socket.SOCK_DGRAM)
+        self.family, _, _, _, self.address = info[0]
+        # The sendto() of the forwarder's socket, set by its setup().
+        self.sendto = None
+        self.packets = 0
+        self.bytes = 0
+        self.errors = 0
+        self.invalid = 0
+
+    @property
+    def name(self):
+        """The address as host:port."""
+        if self.family == socket.AF_INET6:
+            return f'[{self.target_ip}]:{self.target_port}'
+        return f'{self.target_ip}:{self.target_port}'
+
+    def stats(self):
+        """Packets and bytes sent, send errors and invalid packets not
+        sent."""
+        return {'packets': self.packets, 'bytes': self.bytes,
+                'errors': self.errors, 'invalid': self.invalid}
 
 
 class PacketForwarder(PacketProcessor):
-    """Forward all UPD packets to a new IP and port."""
-    def __init__(self, target_ip, target_port):
-        """Initialize to forward UDP packets to the set IP and port.
+    """Forward UPD packets to one or more IPs and ports."""
+    def __init__(self, target_ip=None, target_port=None, sysids=None,
+                 valid_only=False, destinations=None):
+        """Initialize to forward UDP packets to the set IPs and ports.
 
         Args:
             target_ip (ip_address): Valid IPv4 or IPv6 address to receive
                 the packets.
             target_port (int): Valid UDP port, 0 < target_port <= 65535)
+            sysids (set(int)): System IDs forwarded to target_ip. None for
+                all.
+            valid_only (bool): Only forward packets with a valid CRC to
+                target_ip.
+            destinations (iterable(ForwardDestination)): More destinations
+                to forward to, each with their own filter.
         """
         super().__init__()
 
-        self.target_ip = target_ip
-        self.target_port = target_port
+        self.destinations = []
+        if target_ip is not None:
+            self.destinations.append(
+                ForwardDestination(target_ip, target_port, sysids,
+                                   valid_only))
+        if destinations is not None:
+            self.destinations.extend(destinations)
+        if not self.destinations:
+            raise ValueError('No destination to forward to.')
+
+        if all(d.sysids is not None for d in self.destinations):
+            self.sysids = set().union(*(d.sysids for d in self.destinations))
+        # Destinations for each system ID, like FlightComputerReceiver.routes
+        self.routes = [tuple(d for d in self.destinations
+                             if d.sysids is None or sysid in d.sysids)
+                       for sysid in range(256)]
+        self.sockets = {}
+
+    def setup(self, transport):
+        """Open a non-blocking socket for each address family."""
+        super().setup(transport)
+        for d in self.destinations:
+            if d.family not in self.sockets:
+                sock = socket.socket(d.family, socket.SOCK_DGRAM)
+                sock.setblocking(False)
+                self.sockets[d.family] = sock
+            d.sendto = self.sockets[d.family].sendto
 
     def receive(self, packet):
-        """Forward the packet to the configured IP and port"""
-        self.transport.sendto(packet, (self.target_ip, self.target_port))
+        """Forward the packet to each destination subscribed to it."""
+        for d in self.routes[packet.sysid]:
+            self._send(d, packet)
+
+    def receive_batch(self, packets):
+        """Forward the packets to their destinations in one pass."""
+        routes = self.routes
+        send = self._send
+        for packet in packets:
+            for d in routes[packet.sysid]:
+                send(d, packet)
+
+    @staticmethod
+    def _send(destination, packet):
+        if destination.valid_only and not packet.valid:
+            destination.invalid += 1
+            return
+        try:
+            destination.sendto(packet.data, destination.address)
+        except OSError as exc:
+            # Includes BlockingIOError when the send buffer is full.
+            if not destination.errors:
+                logger.warning('Forwarding to %s failed: %s',
+                               destination.name, exc)
+            destination.errors += 1
+        else:
+            destination.packets += 1
+            destination.bytes += len(packet)
 
+    def stats(self):
+        """Send counters for each destination."""
+        return {d.name: d.stats() for d in self.destinations}
 
-class PacketLogger(PacketProcessor):
+    def close(self):
+        """Close the forwarding sockets."""
+        for sock in self.sockets.values():
+            sock.close()
+        self.sockets = {}
+        super().close()
+
+
+def merge_forwarders(processors):
+    """Replace plain `PacketForwarder` instances with one forwarding to all
+    of their destinations, so each packet is routed once.
+
+    Args:
+        processors (tuple(PacketProcessor)): The processors to run.
+
+    Returns:
+        tuple(PacketProcessor): The processors with the forwarders merged.
+    """
+    forwarders = [p for p in processors if type(p) is PacketForwarder]
+    if len(forwarders) < 2:
+        return tuple(processors)
+    merged = PacketForwarder(destinations=chain.from_iterable(
+        f.destinations for f in forwarders))
+    return tuple(p for p in processors
+                 if type(p) is not PacketForwarder) + (merged,)
+
+
+class PacketLogger(QueuedProcessor):
     """Write the packet contents for each imager and spectrometer to files."""
     IMAG_IDS = set([0xC0 + i for i in range(7)])
     SPEC_IDS = set([0xD0 + i for i in range(3)])
 
-    def __init__(self, path_root=None, path_dict=None, fd_dict=None):
+    def __init__(self, path_root=None, path_dict=None, fd_dict=None,
+                 flush_size=recording.FLUSH_SIZE,
+                 flush_interval=recording.FLUSH_INTERVAL, fsync=False,
+                 rotate_size=None, rotate_interval=None, drop_invalid=False,
+                 compress=None, queue_size=QUEUE_SIZE,
+                 overflow='drop-oldest'):
         """Initialize the file writter.
 
+        Files given by path are appended to if they exist, and each has an
+        index of the packets written next to it. See `recording`.
+
         Args:
             path_root (Path): Parent directory to contain imager and
                 spectrometer log files. If it doesn't exist, it will be
@@ -216,8 +1096,25 @@ class PacketLogger(PacketProcessor):
             fd_dict (dict): Dictionary with keys of instrument IDs as int
                 matched to a file descriptor where that instrument's data
                 will be recorded.
+            flush_size (int): Write a file's buffered data once this many
+                bytes are waiting.
+            flush_interval (float): Longest time in seconds data is held in
+                memory before it is written.
+            fsync (bool): Commit each write to disk before continuing.
+            rotate_size (int): Start a new file for a device once its current
+                one would exceed this many bytes. Only for paths.
+            rotate_interval (float): Start a new file for a device once its
+                current one is this many seconds old. Only for paths.
+            drop_invalid (bool): Do not write packets with a bad CRC. By
+                default they are written and flagged in the index.
+            compress (str): Compress the files with 'zlib' or 'lzma'. Only
+                for paths. Files under path_root are then named `.bgz`
+                instead of `.dat`.
+            queue_size (int): Number of packets that may wait while files are
+                written.
+            overflow (str): Policy when the queue is full. See `PacketQueue`.
         """
-        super().__init__()
+        super().__init__(queue_size, overflow)
 
         if path_root is not None:
             # Set the paths for each instrument in the path_root directory
@@ -226,101 +1123,299 @@ class PacketLogger(PacketProcessor):
                 raise ValueError('Only one output file option may be selected')
 
             path_dict = dict()
+            suffix = ('.dat' if compress is None
+                      else recording.COMPRESSED_SUFFIX)
             # Imagers:
             for spec_id in self.SPEC_IDS:
                 path_dict[spec_id] = \
-                    Path(path_root) / f'spec_{spec_id & 0x0F:}.dat'
+                    Path(path_root) / f'spec_{spec_id & 0x0F:}{suffix}'
             # Spectrometers:
             for imag_id in self.IMAG_IDS:
                 path_dict[imag_id] = \
-                    Path(path_root) / f'imag_{imag_id & 0x0F:}.dat'
+                    Path(path_root) / f'imag_{imag_id & 0x0F:}{suffix}'
         logger.debug('Paths: %s', path_dict)
 
-        if path_dict is not None:
-            # Get file descriptors for each instrument log path.
-            if fd_dict is not None:
-                raise ValueError('Only one output file option may be selected')
-            fd_dict = dict()
-            for device_id, path in path_dict.items():
-                logger.debug('Creating %s', hex(device_id))
-                # Get the fd
-                fd_dict[device_id] = \
-                    os.open(path, os.O_CREAT | os.O_WRONLY | os.O_NONBLOCK)
+        if path_dict is not None and fd_dict is not None:
+            raise ValueError('Only one output file option may be selected')
 
         # Make sure only imagers and spectrometer ids are provided. Not all
         # are needed, but no other id may be added.
-        if set(fd_dict.keys()) > self.SPEC_IDS.union(self.IMAG_IDS):
+        device_ids = set(path_dict if path_dict is not None else fd_dict)
+        if device_ids - self.SPEC_IDS.union(self.IMAG_IDS):
             raise ValueError('Invalid device id provided.')
-        self.fds = fd_dict.copy()
-        self.f_lock = asyncio.Lock()
+
+        writers = dict()
+        if path_dict is not None:
+            for device_id, path in path_dict.items():
+                logger.debug('Creating %s', hex(device_id))
+                writers[device_id] = recording.RecordingWriter(
+                    path, rotate_size=rotate_size,
+                    rotate_interval=rotate_interval, fsync=fsync,
+                    compress=compress)
+            self.fds = dict()
+        else:
+            for device_id, fd in fd_dict.items():
+                writers[device_id] = recording.BufferedWriter(
+                    os.fdopen(fd, "wb", buffering=0), fsync=fsync)
+            self.fds = fd_dict.copy()
         logger.debug('File Descriptors: %s', self.fds)
-        # Dictionary to hold file objects once opened with self.setup()
-        self.open_files = {k: None for k in self.fds.keys()}
+
+        self.writers = recording.WriterGroup(writers, flush_size,
+                                             flush_interval)
+        self.idle_interval = flush_interval
+        self.drop_invalid = drop_invalid
+        self.invalid = 0
+        self.sysids = set(writers)
+        # Dictionary to hold file writers once opened with self.setup()
+        self.open_files = {k: None for k in writers.keys()}
 
     def setup(self, transport):
-        """Open all of the instrument log files."""
+        """Start writing to all of the instrument log files."""
+        self.open_files.update(self.writers.writers)
         super().setup(transport)
 
-        self.open_files.update(
-            {device_id: os.fdopen(fd, "wb")
-             for device_id, fd in self.fds.items()})
-
     def close(self):
-        """Close all of the open instrument log files."""
-        for device_id, file in self.open_files.items():
-            if file is not None:
-                file.close()
+        """Write the remaining data and close the instrument log files."""
+        super().close()
+        self._append(self.queue.take())
+        self.writers.close()
+        for device_id in self.open_files:
             self.open_files[device_id] = None
 
-    def receive(self, packet):
-        """Write the packet to it's appropriate instrument log file."""
-        if len(packet) < 16:
-            logger.warning('Packet is too short for header (<16 bytes).')
+    async def process(self, packets):
+        """Buffer the packets for their instrument log files, writing the
+        files when they are due."""
+        self._append(packets)
+        if self.writers.flush_due():
+            await self.writers.flush()
+
+    def stats(self):
+        """Statistics of the queue and packets with a bad CRC."""
+        return dict(super().stats(), invalid=self.invalid)
+
+    def _append(self, packets):
+        for packet in packets:
+            flags = 0
+            if not packet.valid:
+                self.invalid += 1
+                if self.drop_invalid:
+                    continue
+                flags = recording.FLAG_BAD_CRC
+            id_byte = packet.sysid
+            if (writer := self.open_files.get(id_byte, None)):
+                writer.append(packet.payload, (packet.gondola_ticks,
+                                               packet.sequence, flags))
+            else:
+                pass
+                # logger.warning('File for %s is closed', hex(id_byte))
+
+
+class PacketCapture(QueuedProcessor):
+    """Write every datagram with its arrival time to a capture file, before
+    it is checked or put in order."""
+    every_datagram = True
+
+    def __init__(self, path, flush_size=recording.FLUSH_SIZE,
+                 flush_interval=recording.FLUSH_INTERVAL, fsync=False,
+                 queue_size=QUEUE_SIZE, overflow='drop-oldest'):
+        """Open the capture file, appending if it exists. See `capture`.
 
-        id_byte = packet[4]
-        logger.debug('ID Byte: %s', hex(id_byte))
+        Args:
+            path (Path): Path of the capture file.
+            flush_size (int): Write the buffered packets once this many
+                bytes are waiting.
+            flush_interval (float): Longest time in seconds packets are held
+                in memory before they are written.
+            fsync (bool): Commit each write to disk before continuing.
+            queue_size (int): Number of packets that may wait while the file
+                is written.
+            overflow (str): Policy when the queue is full. See `PacketQueue`.
+        """
+        super().__init__(queue_size, overflow)
+        self.writer = capture.CaptureWriter(path, fsync=fsync)
+        self.writers = recording.WriterGroup({None: self.writer}, flush_size,
+                                             flush_interval)
+        self.idle_interval = flush_interval
 
-        if (file := self.open_files.get(id_byte, None)):
-            asyncio.create_task(
-                write_with_lock(file, packet[16:], self.f_lock))
-        else:
-            pass
-            # logger.warning('File for %s is closed', hex(id_byte))
+    def receive_datagram(self, data, arrival):
+        """Queue the datagram with its arrival time."""
+        super().receive((arrival, data))
 
+    def receive_datagrams(self, datagrams):
+        """Queue the datagrams with their arrival times."""
+        super().receive_batch(datagrams)
 
-class PacketPseudoSerial(PacketLogger):
-    """Process instruments with log file recorder, but the log files are
-        connected to a pseudo serial port."""
-    def __init__(self):
-        """Initialize the processor and pick the pseudo serial ports."""
+    async def process(self, packets):
+        """Buffer the datagrams for the capture file, writing it when due.
+
+        Args:
+            packets (list(tuple)): Arrival time in nanoseconds and bytes of
+                each datagram.
+        """
+        self._append(packets)
+        if self.writers.flush_due():
+            await self.writers.flush()
+
+    def stats(self):
+        """Statistics of the queue and packets captured."""
+        return dict(super().stats(), captured=self.writer.packets)
+
+    def close(self):
+        """Write the remaining packets and close the capture file."""
+        super().close()
+        self._append(self.queue.take())
+        self.writers.close()
+
+    def _append(self, packets):
+        append_packet = self.writer.append_packet
+        for timestamp, data in packets:
+            append_packet(data, timestamp)
+
+
+class PacketPseudoSerial(QueuedProcessor):
+    """Pass the data of each imager and spectrometer to its own pseudo serial
+    port.
+
+    Each port has an output buffer written without blocking as the reader
+    takes the data, so a slow or absent instrument GSE does not hold up the
+    others. Data is only lost once a port's buffer is full, unless the
+    queue's overflow policy is 'block', which waits for space instead.
+    """
+    def __init__(self, pace=False, buffer_size=PTY_BUFFER_SIZE,
+                 queue_size=QUEUE_SIZE, overflow='drop-oldest'):
+        """Initialize the processor and pick the pseudo serial ports.
+
+        Args:
+            pace (bool): Write no faster than the instrument's serial line,
+                at the baud rate used by `PacketSerial`.
+            buffer_size (int): Bytes buffered for each port.
+            queue_size (int): Number of packets that may wait to be written.
+            overflow (str): Policy when the queue is full. See `PacketQueue`.
+        """
+        super().__init__(queue_size, overflow)
+        self.pace = pace
+        self.buffer_size = buffer_size
         self.serial = dict()
+        self.fds = dict()
+        # Keep the secondary side open, so the port survives its reader
+        # closing and reopening it.
+        self._secondary_fds = []
+        for device_id in chain(PacketLogger.IMAG_IDS, PacketLogger.SPEC_IDS):
+            primary_fd, secondary_fd = pty.openpty()
+            # Pass the bytes through unchanged, without line editing.
+            tty.setraw(secondary_fd)
+            self.fds[device_id] = primary_fd
+            self._secondary_fds.append(secondary_fd)
+            self.serial[device_id] = Path(os.ttyname(secondary_fd))
+        self.sysids = set(self.fds)
+        self.writers = dict()
+        self.dropped_packets = dict.fromkeys(self.fds, 0)
 
-        fd_dict = dict()
-        for device_id in chain(self.IMAG_IDS, self.SPEC_IDS):
-            primary_fd, secondary_df = pty.openpty()
-            fd_dict[device_id] = primary_fd
-            self.serial[device_id] = Path(os.ttyname(secondary_df))
+    def setup(self, transport):
+        """Start writing to the pseudo serial ports."""
+        for device_id, fd in self.fds.items():
+            rate = None
+            if self.pace:
+                kind = 'imag' if device_id in PacketLogger.IMAG_IDS else 'spec'
+                rate = (PacketSerial.SERIAL_CONFIGS[kind]['baudrate']
+                        / BITS_PER_BYTE)
+            self.writers[device_id] = FdWriter(fd, self.buffer_size,
+                                               rate=rate)
+            self.writers[device_id].start()
+            logger.info('Pseudo serial port for %#04x: %s', device_id,
+                        self.serial[device_id])
+        super().setup(transport)
 
-        super().__init__(fd_dict=fd_dict)
+    async def process(self, packets):
+        """Add the payloads to the output buffer of their ports."""
+        if self.queue.overflow == 'block':
+            for packet in packets:
+                writer = self.writers[packet.sysid]
+                await writer.wait_for_space()
+                writer.write(packet.payload, force=True)
+            return
+
+        for packet in packets:
+            if not self.writers[packet.sysid].write(packet.payload):
+                self.dropped_packets[packet.sysid] += 1
+
+    def stats(self):
+        """Statistics of the queue and the output buffer of each port."""
+        stats = super().stats()
+        for device_id, writer in self.writers.items():
+            stats[f'{device_id:#04x}'] = dict(
+                writer.stats(), occupancy=writer.occupancy,
+                dropped_packets=self.dropped_packets[device_id])
+        return stats
+
+    def close(self):
+        """Write what the ports accept now and close them."""
+        super().close()
+        for packet in self.queue.take():
+            if packet.sysid in self.writers:
+                self.writers[packet.sysid].write(packet.payload, force=True)
+        for writer in self.writers.values():
+            # A port nobody reads would never take the rest.
+            writer.close(wait=False)
+        for fd in chain(self.fds.values(), self._secondary_fds):
+            os.close(fd)
+        self.fds.clear()
+        self._secondary_fds.clear()
 
 
 class MMGSEPacket(PacketForwarder):
     """Process the packets by forwarding them to a loopback address, and start
-    an mm_gse bokeh server listening to that port."""
-    def __init__(self, show=False):
+    an mm_gse bokeh server listening to that port. The port is received by
+    one `mm_engine.TelemetryEngine` shared by every browser session."""
+    def __init__(self, show=False, refresh_rate=None, store=None,
+                 remote_ip=None):
         """Initialize the processor and set up a forwarding processor to
-            the mm_gse server."""
-        super().__init__('127.0.0.1', 20502)
+            the mm_gse server. Only packets with a valid CRC are forwarded,
+            so mm_gse is told not to check them again.
+
+        Args:
+            show (bool): Open mm_gse in a browser tab.
+            refresh_rate (float): Times a second mm_gse updates its plots
+                and readings. Its own default if None.
+            store (Path): Directory mm_gse keeps its plotted history in, so
+                it is not lost on a restart. Only kept in memory if None.
+            remote_ip (str): Address mm_gse sends commands to at first. Its
+                own default, the flight computer, if None.
+        """
+        super().__init__('127.0.0.1', 20502, valid_only=True)
         self.server = None
         self.show = show
+        self.refresh_rate = refresh_rate
+        self.store = store
+        self.remote_ip = remote_ip
+        self.engine = None
 
     def setup(self, transport):
         """Start the packer forwarder and start the bokeh server for mm_gse."""
         super().setup(transport)
+        # Bokeh takes most of a second to import, so only load it here.
+        from bokeh.application import Application
+        from bokeh.application.handlers import ScriptHandler
+        from bokeh.server.server import Server
+
+        from . import mm_engine
+
+        # Telemetry is decoded from now on, before any session is opened.
+        self.engine = mm_engine.get_engine(crc_checked=True,
+                                           store_path=self.store)
+        self.engine.listen()
 
         mm_gse_path = Path(__file__).parent / 'mm_gse.py'
         print(mm_gse_path)
-        apps = {'/': Application(ScriptHandler(filename=mm_gse_path))}
+        argv = ['--crc-checked']
+        if self.refresh_rate is not None:
+            argv += ['--refresh-rate', str(self.refresh_rate)]
+        if self.store is not None:
+            argv += ['--store', str(self.store)]
+        if self.remote_ip is not None:
+            argv += ['--remote-ip', self.remote_ip]
+        apps = {'/': Application(ScriptHandler(filename=mm_gse_path,
+                                               argv=argv))}
         self.server = Server(apps)
         self.server.start()
         url = f"http://localhost:{self.server.port}{self.server.prefix}/"
@@ -329,34 +1424,194 @@ class MMGSEPacket(PacketForwarder):
             self.server.show('/')
 
     def close(self):
-        """Close the packet forwarder and the bokeh server."""
+        """Close the packet forwarder, the bokeh server and the engine."""
         super().close()
         self.server.stop()
+        if self.engine is not None:
+            self.engine.close()
+
+
+class BatchReader(Thread):
+    """Drain a UDP socket in a dedicated thread and hand the packets to a
+    receiver on the event loop in batches."""
+    def __init__(self, sock, receiver, loop):
+        """Initialize the reader thread.
+
+        Args:
+            sock (socket.socket): A bound UDP socket to read from.
+            receiver (FlightComputerReceiver): Has batch_received() called
+                on the event loop for each batch of packets.
+            loop (asyncio.AbstractEventLoop): The loop running the receiver.
+        """
+        super().__init__(daemon=True)
+        self.sock = sock
+        self.receiver = receiver
+        self.loop = loop
+        self.active = True
+
+    def run(self):
+        """Wait for packets and then read all that are queued."""
+        self.sock.setblocking(False)
+        view = memoryview(bytearray(INGEST_BUFFER_SIZE))
+        last_start = INGEST_BUFFER_SIZE - MAX_DATAGRAM_SIZE
+
+        while self.active:
+            # Leave packets in the socket while a processor has paused.
+            if not self.receiver.reading_threadsafe.wait(
+                    INGEST_POLL_INTERVAL):
+                continue
+
+            ready, _, _ = select.select([self.sock], [], [],
+                                        INGEST_POLL_INTERVAL)
+            if not ready:
+                continue
+
+            sizes = []
+            arrivals = []
+            offset = 0
+            try:
+                while offset <= last_start and len(sizes) < INGEST_BATCH_SIZE:
+                    size = self.sock.recv_into(view[offset:])
+                    arrivals.append(time_ns())
+                    sizes.append(size)
+                    offset += size
+            except BlockingIOError:
+                pass
+            except OSError as exc:
+                if not self.active:
+                    break
+                self.loop.call_soon_threadsafe(self.receiver.error_received,
+                                               exc)
+
+            if sizes:
+                # Copy out of the buffer so it can be reused immediately.
+                packets = []
+                offset = 0
+                for size in sizes:
+                    packets.append(bytes(view[offset:offset + size]))
+                    offset += size
+                self.loop.call_soon_threadsafe(self.receiver.batch_received,
+                                               packets, arrivals)
+
+    def stop(self):
+        """Stop reading and wait for the thread to finish."""
+        self.active = False
+        self.join()
+
+
+def open_ingest_socket(ip_addr, port):
+    """Open a UDP socket for the batch reader with a large receive buffer."""
+    family, sock_type, proto, _, addr = socket.getaddrinfo(
+        ip_addr, port, type=socket.SOCK_DGRAM)[0]
+    sock = socket.socket(family, sock_type, proto)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                        INGEST_SOCKET_BUFFER)
+    except OSError:
+        logger.warning('Could not increase the UDP receive buffer.')
+    sock.bind(addr)
+    return sock
 
 
 async def receive_packets(ip_addr, port, processors=None,
-                          from_file=None, speed=1.0):
+                          from_file=None, speed=1.0, external_playback=False,
+                          batch_ingest=False, metrics_port=None,
+                          reorder_window=sequence.REORDER_WINDOW,
+                          reorder_timeout=sequence.REORDER_TIMEOUT,
+                          lag_threshold=watchdog.LAG_THRESHOLD):
     """Start an async loop to receive all incoming UDP packers and run
-        the processors provided on each of them."""
+        the processors provided on each of them.
+
+    Args:
+        ip_addr (str): Local address to receive packets on.
+        port (int): Local UDP port to receive packets on.
+        processors (tuple(PacketProcessor)): Run on each packet.
+        from_file (Path): A flight computer `.bin` file, or a capture made
+            by `PacketCapture`, to replay instead of receiving packets from
+            the network.
+        speed (float): Replay speed relative to real time. Use `math.inf` to
+            replay as quickly as possible.
+        external_playback (bool): Replay the file with the middleman
+            `playback` binary over UDP instead of in process.
+        batch_ingest (bool): Read network packets in a dedicated thread and
+            pass them to the processors in batches.
+        metrics_port (int): Serve metrics for the receiver and processors
+            over HTTP on this localhost port.
+        reorder_window (int): Sequence numbers a packet can be held ahead of
+            a missing one to put packets back in order. 1, the default, only
+            counts lost and reordered packets, and 0 does not track sequence
+            numbers.
+        reorder_timeout (float): Longest time in seconds a packet is held
+            waiting for missing ones.
+        lag_threshold (float): Seconds the event loop can be blocked before
+            the stack blocking it is logged. See `watchdog`.
+    """
+    if from_file is not None and external_playback \
+            and capture.is_capture(from_file):
+        raise ValueError('The playback binary can not replay captures.')
+
     loop = asyncio.get_running_loop()
     on_con_lost = loop.create_future()
+    registry = None if metrics_port is None else metrics.Registry()
 
     def create_endpoint(processors=processors):
-        return FlightComputerReceiver(processors)
-
-    transport, _ = await loop.create_datagram_endpoint(create_endpoint,
-                                                       local_addr=(ip_addr,
-                                                                   port))
+        sequences = None
+        if reorder_window:
+            sequences = sequence.SequenceTracker(reorder_window,
+                                                 reorder_timeout)
+        return FlightComputerReceiver(processors, registry, sequences)
+
+    ingest_socket = reader = None
+    local_port = port
+    if from_file is not None and not external_playback:
+        # Packets are read directly from the file. The socket is only used
+        # by processors sending packets, so any free port will do.
+        local_port = 0
+    elif batch_ingest:
+        # The reader thread owns the receiving socket.
+        ingest_socket = open_ingest_socket(ip_addr, port)
+        local_port = 0
+
+    transport, protocol = await loop.create_datagram_endpoint(
+        create_endpoint, local_addr=(ip_addr, local_port))
+
+    if ingest_socket is not None:
+        reader = BatchReader(ingest_socket, protocol, loop)
+        reader.start()
+
+    metrics_server = None
+    loop_watchdog = watchdog.LoopWatchdog(processors or (), registry,
+                                          threshold=lag_threshold)
+    monitors = [loop.create_task(loop_watchdog.run())]
+    if registry is not None:
+        metrics_server = await metrics.serve_metrics(registry, metrics_port)
+        for name in ('packets', 'bytes'):
+            monitors.append(loop.create_task(metrics.monitor_rates(
+                registry, registry.metrics[f'bgse_{name}_total'],
+                f'bgse_{name}_per_second',
+                f'{name.capitalize()} received per second by system ID.')))
 
     try:
-        if from_file is not None:
+        if from_file is None:
+            await on_con_lost
+        elif external_playback:
+            if math.isinf(speed):
+                speed = EXTERNAL_MAX_SPEED
             await start_playback(from_file, speed=speed, port=port)
             await asyncio.sleep(1.0)  # Wait for buffers to process.
         else:
-            await on_con_lost
+            await playback.play_file(from_file, protocol, speed=speed)
+            await asyncio.sleep(1.0)  # Wait for buffers to process.
     except asyncio.exceptions.CancelledError:
         logger.debug('Cancelled', stack_info=True, exc_info=True)
     finally:
+        for task in monitors:
+            task.cancel()
+        if metrics_server is not None:
+            metrics_server.close()
+        if reader is not None:
+            reader.stop()
+            ingest_socket.close()
         transport.close()
 
 
@@ -0,0 +1,138 @@
+"""Layout of the telemetry packets sent by the BOOMS flight computer.
+
+Every packet starts with a 16 byte header followed by the payload. Only the
+header fields used by this package are named here.
+
+    0-1   Sync word, 0x90 0xEB
+    2-3   CRC16 (modbus) of the packet with these two bytes zeroed, little
+          endian
+    4     System ID (instrument or subsystem)
+    5     Telemetry type
+    7-8   Sequence number, big endian
+    10-15 Gondola time in 100 ns ticks, little endian
+
+The sequence number is big endian, as mm_gse has always shown it on the
+housekeeping display. The other fields are little endian.
+"""
+import crcmod.predefined
+
+HEADER_LENGTH = 16
+SYNC = b'\x90\xeb'
+SYSID_INDEX = 4
+TMTYPE_INDEX = 5
+SEQUENCE_SLICE = slice(7, 9)
+GONDOLA_TIME_SLICE = slice(10, 16)
+GONDOLA_TICKS_PER_S = 1e7
+
+crc16 = crcmod.predefined.mkPredefinedCrcFun('modbus')
+
+
+def packet_crc(packet):
+    """Calculate the CRC of a packet as if the CRC bytes were zeroed.
+
+    Args:
+        packet (bytes): The full packet, including the header.
+
+    Returns:
+        int: The CRC16 in the byte order it is stored in the header.
+    """
+    # A memoryview avoids copying the payload to skip the CRC bytes.
+    with memoryview(packet) as view:
+        crc = crc16(view[:2])
+        crc = crc16(b'\x00\x00', crc)
+        crc = crc16(view[4:], crc)
+    return crc
+
+
+def crc_valid(packet):
+    """Check the CRC stored in the header against the packet contents."""
+    if len(packet) < HEADER_LENGTH:
+        return False
+    return packet_crc(packet) == int.from_bytes(packet[2:4], 'little')
+
+
+def gondola_ticks(packet):
+    """Gondola time from the packet header in 100 ns ticks."""
+    return int.from_bytes(packet[GONDOLA_TIME_SLICE], 'little')
+
+
+def gondola_time(packet):
+    """Gondola time from the packet header in seconds."""
+    return gondola_ticks(packet) / GONDOLA_TICKS_PER_S
+
+
+def sequence(packet):
+    """Sequence number from the packet header."""
+    return int.from_bytes(packet[SEQUENCE_SLICE], 'big')
+
+
+def build_packet(sysid, tmtype, payload=b'', sequence=0, ticks=0):
+    """Assemble a packet with a valid CRC, as the flight computer sends them.
+
+    Args:
+        sysid (int): System ID.
+        tmtype (int): Telemetry type.
+        payload (bytes): Data after the header.
+        sequence (int): Sequence number, kept to 16 bits.
+        ticks (int): Gondola time in 100 ns ticks, kept to 48 bits.
+
+    Returns:
+        bytes: The whole packet.
+    """
+    packet = bytearray(HEADER_LENGTH)
+    packet[0:2] = SYNC
+    packet[SYSID_INDEX] = sysid
+    packet[TMTYPE_INDEX] = tmtype
+    packet[SEQUENCE_SLICE] = (sequence & 0xFFFF).to_bytes(2, 'big')
+    packet[GONDOLA_TIME_SLICE] = (ticks & (1 << 48) - 1).to_bytes(6, 'little')
+    packet += payload
+    packet[2:4] = packet_crc(packet).to_bytes(2, 'little')
+    return bytes(packet)
+
+
+class Packet:
+    """A received packet with its header parsed and CRC checked once, shared
+    by every processor it is routed to.
+
+    Attributes:
+        data (bytes): The entire packet, including the header.
+        sysid (int): System ID from the header.
+        tmtype (int): Telemetry type from the header.
+        valid (bool): True if the CRC matches the packet contents.
+        arrival (int): time.time_ns() when the datagram arrived, or None if
+            not known.
+    """
+    __slots__ = ('data', 'sysid', 'tmtype', 'valid', 'arrival')
+
+    def __init__(self, data, valid=None, arrival=None):
+        """Parse the header and check the CRC.
+
+        Args:
+            data (bytes): The packet. Must be at least HEADER_LENGTH long.
+            valid (bool): CRC result if it is already known, for example
+                from a file that was framed by CRC. Checked if None.
+            arrival (int): time.time_ns() when the datagram arrived.
+        """
+        self.data = data
+        self.sysid = data[SYSID_INDEX]
+        self.tmtype = data[TMTYPE_INDEX]
+        self.valid = crc_valid(data) if valid is None else valid
+        self.arrival = arrival
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def payload(self):
+        """The packet after the header."""
+        return self.data[HEADER_LENGTH:]
+
+    @property
+    def gondola_ticks(self):
+        """Gondola time from the header in 100 ns ticks."""
+        return gondola_ticks(self.data)
+
+    @property
+    def sequence(self):
+        """Sequence number from the header."""
+        return sequence(self.data)
@@ -0,0 +1,218 @@
+"""Replay flight computer logged `.bin` files and captures in process.
+
+The log, compressed or not, is split into packets at each sync word that
+starts a packet with a valid CRC. Captures made by `PacketCapture` already
+hold whole packets with their arrival times, see `capture`. Each packet is
+handed straight to a protocol's `datagram_received`, so no UDP socket or
+`playback` binary from `middleman` is needed.
+"""
+import asyncio
+import logging
+import math
+import mmap
+from pathlib import Path
+
+from . import capture, recording
+from .packet import HEADER_LENGTH, SYNC, Packet, crc_valid, gondola_time
+
+# Largest packet to search for before treating a sync word as junk.
+MAX_PACKET_LENGTH = 65535
+# Packets sent between yields to the event loop when not waiting.
+YIELD_INTERVAL = 256
+# Seconds behind schedule before the playback clock is reset.
+MAX_LAG = 1.0
+# Longest wait in seconds between packets. A longer jump forward in time,
+# from a reboot or a corrupt timestamp, resets the playback clock instead.
+MAX_GAP = 5.0
+
+logger = logging.getLogger(__name__)
+
+
+class BinFile:
+    """Flight computer log that iterates over its packets.
+
+    Uncompressed logs are memory-mapped. Compressed logs, see `recording`,
+    are decompressed a chunk at a time while iterating.
+    """
+    def __init__(self, path):
+        """Open the log file.
+
+        Args:
+            path (Path): A `.bin` file logged by the flight computer.
+        """
+        self.path = Path(path)
+        self.junk_bytes = 0
+        self._map = None
+        # Bytes of the current block framed by _frame()
+        self._consumed = 0
+        if recording.is_compressed(self.path):
+            self._file = recording.ChunkedReader(self.path)
+            return
+
+        self._file = open(self.path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can not be mapped.
+            self._map = b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        """Yield each packet in the file as bytes."""
+        if self._map is not None:
+            yield from self._frame(self._map, final=True)
+            return
+
+        data = b''
+        for block in self._file.read_chunks():
+            data = data[self._consumed:] + block
+            yield from self._frame(data, final=False)
+        yield from self._frame(data[self._consumed:], final=True)
+
+    def _frame(self, data, final):
+        """Yield the packets in data. Unless final, stop where more data is
+        needed to decide, and leave the position in self._consumed."""
+        size = len(data)
+        # Keep a last byte that could start a sync word.
+        keep = 0 if final else 1
+        self._consumed = 0
+        start = data.find(SYNC)
+        if start < 0:
+            self._consumed = max(size - keep, 0)
+            self.junk_bytes += self._consumed
+            return
+        self.junk_bytes += start
+
+        while start >= 0:
+            self._consumed = start
+            end = data.find(SYNC, start + HEADER_LENGTH)
+            while True:
+                if end < 0 and not final:
+                    # The packet may continue in the next block.
+                    return
+                # The sync word can appear in a payload, so extend the packet
+                # to later sync words until the CRC matches.
+                stop = size if end < 0 else end
+                packet = data[start:stop]
+                if crc_valid(packet):
+                    yield packet
+                    start = end
+                    break
+
+                if end < 0 or (end - start) > MAX_PACKET_LENGTH:
+                    # No valid packet starts here.
+                    next_start = data.find(SYNC, start + 1)
+                    self._consumed = (max(size - keep, start)
+                                      if next_start < 0 else next_start)
+                    self.junk_bytes += self._consumed - start
+                    start = next_start
+                    break
+
+                end = data.find(SYNC, end + 1)
+        if final:
+            self._consumed = size
+
+    def timed_packets(self):
+        """Yield the gondola time in seconds, bytes and CRC validity of each
+        packet."""
+        for packet in self:
+            yield gondola_time(packet), packet, True
+
+    def close(self):
+        """Unmap and close the log file."""
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+
+def open_log(path):
+    """Open a flight computer log or a capture for replay.
+
+    Args:
+        path (Path): A `.bin` file, compressed or not, or a capture.
+
+    Returns:
+        `BinFile` or `CaptureLog`: Has timed_packets() to iterate over the
+            packets.
+    """
+    if capture.is_capture(path):
+        return CaptureLog(path)
+    return BinFile(path)
+
+
+class CaptureLog(capture.CaptureReader):
+    """Capture replayed by the arrival times of its packets."""
+    def timed_packets(self):
+        """Yield the arrival time in seconds, bytes and CRC validity of each
+        packet. The CRC is not known until checked, so it is None."""
+        for timestamp, packet in self:
+            yield timestamp / 1e9, packet, None
+
+
+async def play_file(path, protocol, speed=1.0):
+    """Replay a flight computer log or a capture into a datagram protocol.
+
+    Packets in a log are paced by the gondola time in their headers, and
+    packets in a capture by the time they arrived. If the replay falls
+    behind, or the time jumps backwards, the playback clock restarts from
+    the current packet. It also restarts after waiting `MAX_GAP` seconds
+    for a packet far ahead in time.
+
+    Args:
+        path (Path): The `.bin` file or capture to replay.
+        protocol (asyncio.DatagramProtocol): Has datagram_received() called
+            for each packet, usually a `FlightComputerReceiver`. If it has
+            packet_received(), that is called instead with a `Packet`, so a
+            CRC checked to find the packet is not checked again. If it has a
+            `reading` event, playback waits while it is cleared.
+        speed (float): Playback speed relative to real time. Use `math.inf`
+            to replay as quickly as possible.
+    """
+    loop = asyncio.get_running_loop()
+    addr = (str(path), 0)
+    reading = getattr(protocol, 'reading', None)
+    packet_received = getattr(protocol, 'packet_received', None)
+    paced = math.isfinite(speed)
+    start_time = start_loop = None
+    sent = 0
+
+    with open_log(path) as log:
+        for packet_time, packet, valid in log.timed_packets():
+            if paced:
+                if start_time is None:
+                    start_time, start_loop = packet_time, loop.time()
+                delay = (start_loop + (packet_time - start_time) / speed
+                         - loop.time())
+                if delay > MAX_GAP:
+                    await asyncio.sleep(MAX_GAP)
+                    start_time, start_loop = packet_time, loop.time()
+                    sent = 0
+                elif delay > 0:
+                    await asyncio.sleep(delay)
+                    sent = 0
+                elif delay < -MAX_LAG:
+                    start_time, start_loop = packet_time, loop.time()
+
+            if reading is not None and not reading.is_set():
+                await reading.wait()
+                sent = 0
+            if packet_received is None or len(packet) < HEADER_LENGTH:
+                protocol.datagram_received(packet, addr)
+            else:
+                packet_received(Packet(packet, valid=valid))
+
+            sent += 1
+            if sent >= YIELD_INTERVAL:
+                # Let the processors' tasks run.
+                await asyncio.sleep(0)
+                sent = 0
+
+        if log.junk_bytes:
+            logger.warning('Skipped %d bytes not in a valid packet.',
+                           log.junk_bytes)
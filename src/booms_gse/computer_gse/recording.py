@@ -0,0 +1,698 @@
+"""Buffered writers for the instrument recordings made by `PacketLogger`.
+
+Payloads are collected in memory and written in large blocks, so a busy
+instrument costs one write per flush instead of one per packet.
+
+Recordings written to a path can be split into several files, rotating on
+size or age. Next to each file is an index, `<file>.idx`, with one record per
+packet giving the gondola time, sequence number, flags and the byte offset
+where the packet's payload starts. Use `RecordingIndex` to seek to a time
+without scanning the recording.
+
+Recordings can also be compressed. The file is then a series of chunks, each
+compressed on its own with zlib or lzma behind a header giving its offset and
+length in the uncompressed data and a CRC. A damaged or unfinished chunk only
+loses its own data, and a reader can skip whole chunks to seek. Use
+`open_recording()` to read a recording whether it is compressed or not.
+Offsets in the index are always in the uncompressed data.
+"""
+import asyncio
+import lzma
+import mmap
+import os
+import stat
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple
+from pathlib import Path
+
+from .packet import GONDOLA_TICKS_PER_S
+
+# Default durability policy for recordings.
+FLUSH_SIZE = 1 << 16  # bytes
+FLUSH_INTERVAL = 0.5  # seconds
+
+INDEX_SUFFIX = '.idx'
+# Gondola time (100 ns ticks), byte offset, sequence number, flags
+INDEX_RECORD = struct.Struct('<qQHB')
+# Index flags
+FLAG_BAD_CRC = 0x01  # The packet's CRC did not match
+
+IndexEntry = namedtuple('IndexEntry',
+                        ['gondola_time', 'offset', 'sequence', 'flags'])
+
+# Compressed recordings
+COMPRESSED_SUFFIX = '.bgz'
+CHUNK_MAGIC = b'BGZC'
+# Magic, codec, uncompressed offset, uncompressed length, compressed length,
+# CRC32 of the compressed data
+CHUNK_HEADER = struct.Struct('<4sB3xQIII')
+CHUNK_SIZE = 1 << 18  # Largest uncompressed chunk in bytes
+CODECS = {'zlib': 1, 'lzma': 2}
+CODEC_NAMES = {number: name for name, number in CODECS.items()}
+ZLIB_LEVEL = 6
+LZMA_PRESET = 6
+# Bytes read at a time when searching for the next chunk after damage.
+RESYNC_BLOCK = 1 << 16
+
+
+def _write_all(file, data):
+    """Write all of data to an unbuffered file."""
+    view = memoryview(data)
+    while view:
+        view = view[file.write(view):]
+
+
+class BufferedWriter:
+    """Collect data for one file and write it out in blocks."""
+    def __init__(self, file, fsync=False):
+        """Initialize the writer.
+
+        Args:
+            file: An unbuffered binary file object to write to.
+            fsync (bool): Ask the OS to commit each block to disk. Ignored for
+                files that are not regular files, like pseudo terminals.
+        """
+        self.file = file
+        self.fsync = fsync and stat.S_ISREG(os.fstat(file.fileno()).st_mode)
+        self.pending = []
+        self.pending_bytes = 0
+        self.bytes_written = 0
+        self.closed = False
+        # Held while writing so the file is not closed during a write.
+        self.lock = threading.Lock()
+
+    def append(self, data, key=None):
+        """Add data to be written on the next flush.
+
+        Args:
+            data (bytes): The data to write.
+            key (tuple): Gondola time in ticks, sequence number and flags for
+                the packet the data came from. Used by writers with an index.
+        """
+        self.pending.append((data, key))
+        self.pending_bytes += len(data)
+
+    def take(self):
+        """Remove and return all pending data."""
+        items = self.pending
+        self.pending = []
+        self.pending_bytes = 0
+        return items
+
+    def write(self, items):
+        """Write items returned by take(). This blocks, so run it in a thread
+        when called from the event loop."""
+        with self.lock:
+            if self.closed:
+                return
+            self._write_items(items)
+
+    def _write_items(self, items):
+        block = b''.join(data for data, _ in items)
+        _write_all(self.file, block)
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.bytes_written += len(block)
+
+    def flush(self):
+        """Write all pending data now."""
+        if self.pending_bytes:
+            self.write(self.take())
+
+    def close(self):
+        """Write any pending data and close the file."""
+        self.flush()
+        with self.lock:
+            self.closed = True
+            self._close_files()
+
+    def _close_files(self):
+        self.file.close()
+
+
+class RecordingWriter(BufferedWriter):
+    """Write a recording to one or more files, each with an index."""
+    def __init__(self, path, rotate_size=None, rotate_interval=None,
+                 fsync=False, compress=None):
+        """Open the first file of the recording.
+
+        Existing files are never overwritten. Without rotation, data is
+        appended to the file at path. With rotation, the files are numbered
+        `<stem>_<n><suffix>` starting after the last existing file.
+
+        Args:
+            path (Path): Path of the recording.
+            rotate_size (int): Start a new file before one would grow
+                beyond this many bytes of uncompressed data.
+            rotate_interval (float): Start a new file once one has been
+                written to for this many seconds.
+            fsync (bool): Ask the OS to commit each block to disk.
+            compress (str): Codec to compress the files with, 'zlib' or
+                'lzma'. None to write them uncompressed. Each block written
+                becomes at least one chunk.
+        """
+        if compress is not None and compress not in CODECS:
+            raise ValueError(f'Unknown codec {compress!r}.')
+        self.compress = compress
+        self.path = Path(path)
+        self.rotate_size = rotate_size
+        self.rotate_interval = rotate_interval
+        self.rotating = rotate_size is not None or rotate_interval is not None
+
+        self.segment = None
+        if self.rotating:
+            existing = recording_files(self.path)
+            self.segment = (segment_number(existing[-1]) + 1
+                            if existing else 0)
+        self.index_file = None
+        super().__init__(self._open_segment(), fsync=fsync)
+
+    def segment_path(self, number=None):
+        """Path of a numbered file, by default the current one."""
+        if not self.rotating:
+            return self.path
+        if number is None:
+            number = self.segment
+        return self.path.with_name(
+            f'{self.path.stem}_{number:03}{self.path.suffix}')
+
+    def _open_segment(self):
+        path = self.segment_path()
+        file = open(path, 'ab', buffering=0)
+        self.size = file.tell()
+        if self.size and is_compressed(path) != (self.compress is not None):
+            file.close()
+            raise ValueError(f'Can not append to {path}, it is '
+                             f'{"" if self.compress is None else "not "}'
+                             'compressed.')
+        if self.compress is not None:
+            self.size = recording_size(path)
+            file = ChunkedWriter(file, self.compress, offset=self.size)
+        self.index_file = open(index_path(path), 'ab', buffering=0)
+        self.opened = time.monotonic()
+        return file
+
+    def _rotate_needed(self, size):
+        if self.size == 0:
+            return False
+        if self.rotate_size is not None \
+                and self.size + size > self.rotate_size:
+            return True
+        return self.rotate_interval is not None \
+            and time.monotonic() - self.opened >= self.rotate_interval
+
+    def _write_items(self, items):
+        data = []
+        index = []
+        for payload, key in items:
+            if self.rotating and self._rotate_needed(len(payload)):
+                self._write_segment(data, index)
+                data, index = [], []
+                self._close_files()
+                self.segment += 1
+                self.file = self._open_segment()
+
+            if key is not None:
+                index.append(INDEX_RECORD.pack(key[0], self.size,
+                                               key[1], key[2]))
+            data.append(payload)
+            self.size += len(payload)
+
+        self._write_segment(data, index)
+
+    def _write_segment(self, data, index):
+        if not data:
+            return
+        block = b''.join(data)
+        _write_all(self.file, block)
+        # Ends a chunk in a compressed recording.
+        self.file.flush()
+        # Written after the data so every entry points at data on disk.
+        _write_all(self.index_file, b''.join(index))
+        if self.fsync:
+            os.fsync(self.file.fileno())
+            os.fsync(self.index_file.fileno())
+        self.bytes_written += len(block)
+
+    def _close_files(self):
+        self.file.close()
+        self.index_file.close()
+
+
+class WriterGroup:
+    """Flush a set of buffered writers together in an executor thread."""
+    def __init__(self, writers, flush_size=FLUSH_SIZE,
+                 flush_interval=FLUSH_INTERVAL):
+        """Initialize the group.
+
+        Args:
+            writers (dict): BufferedWriter instances by any key.
+            flush_size (int): Write a file's data once this many bytes are
+                pending.
+            flush_interval (float): Longest time in seconds data is held in
+                memory before it is written.
+        """
+        self.writers = dict(writers)
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        self._in_flight = None
+        # Held while a batch of blocks is written in the executor.
+        self._lock = threading.Lock()
+
+    def flush_due(self):
+        """True if a buffer is full or the flush interval has passed."""
+        if any(writer.pending_bytes >= self.flush_size
+               for writer in self.writers.values()):
+            return True
+        return time.monotonic() - self.last_flush >= self.flush_interval
+
+    async def flush(self):
+        """Write all pending data in an executor thread."""
+        self.last_flush = time.monotonic()
+        blocks = [(writer, writer.take())
+                  for writer in self.writers.values()
+                  if writer.pending_bytes]
+        if blocks:
+            self._in_flight = blocks
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._write_blocks, blocks)
+
+    def _write_blocks(self, blocks):
+        with self._lock:
+            # close() writes the blocks itself if it runs first.
+            if blocks is self._in_flight:
+                for writer, items in blocks:
+                    writer.write(items)
+                self._in_flight = None
+
+    def close(self):
+        """Write everything still pending and close the files."""
+        with self._lock:
+            if self._in_flight is not None:
+                for writer, items in self._in_flight:
+                    writer.write(items)
+                self._in_flight = None
+
+        for writer in self.writers.values():
+            writer.close()
+
+
+def index_path(path):
+    """Path of the index for a recording file."""
+    path = Path(path)
+    return path.with_name(path.name + INDEX_SUFFIX)
+
+
+def segment_number(path):
+    """Number of a rotated recording file."""
+    return int(Path(path).stem.rsplit('_', 1)[-1])
+
+
+def recording_files(path):
+    """All files of a rotated recording in order.
+
+    Args:
+        path (Path): The path the recording was started with, for example
+            `imag_0.dat` for files `imag_0_000.dat`, `imag_0_001.dat`...
+    """
+    path = Path(path)
+    files = [p for p in path.parent.glob(f'{path.stem}_*{path.suffix}')
+             if p.stem.rsplit('_', 1)[-1].isdigit()]
+    return sorted(files, key=segment_number)
+
+
+class RecordingIndex:
+    """Random access to the index of a recording file."""
+    def __init__(self, path):
+        """Map the index of a recording.
+
+        Args:
+            path (Path): The recording file, or its index.
+        """
+        path = Path(path)
+        if path.suffix != INDEX_SUFFIX:
+            path = index_path(path)
+        self.path = path
+        with open(path, 'rb') as file:
+            try:
+                self._map = mmap.mmap(file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can not be mapped.
+                self._map = b''
+
+    def __len__(self):
+        return len(self._map) // INDEX_RECORD.size
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('index entry out of range')
+        ticks, offset, sequence, flags = \
+            INDEX_RECORD.unpack_from(self._map, i * INDEX_RECORD.size)
+        return IndexEntry(ticks / GONDOLA_TICKS_PER_S, offset, sequence,
+                          flags)
+
+    def find(self, gondola_time):
+        """Offset of the first packet at or after a gondola time.
+
+        Assumes gondola time increases through the file.
+
+        Args:
+            gondola_time (float): Time in seconds.
+
+        Returns:
+            int: Byte offset in the recording, or its size if every packet
+                is earlier.
+        """
+        ticks = round(gondola_time * GONDOLA_TICKS_PER_S)
+        low, high = 0, len(self)
+        while low < high:
+            mid = (low + high) // 2
+            if INDEX_RECORD.unpack_from(
+                    self._map, mid * INDEX_RECORD.size)[0] < ticks:
+                low = mid + 1
+            else:
+                high = mid
+
+        if low < len(self):
+            return self[low].offset
+        # Every packet is earlier, so start at the end of the recording.
+        recording = self.path.with_name(self.path.name[:-len(INDEX_SUFFIX)])
+        return recording_size(recording) if recording.exists() else 0
+
+    def close(self):
+        """Unmap the index."""
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+
+
+def _compress(codec, data):
+    if codec == CODECS['zlib']:
+        return zlib.compress(data, ZLIB_LEVEL)
+    return lzma.compress(data, preset=LZMA_PRESET)
+
+
+def _decompress(codec, data, length):
+    """Decompress a chunk, or return None if it is damaged."""
+    try:
+        if codec == CODECS['zlib']:
+            data = zlib.decompress(data)
+        else:
+            data = lzma.decompress(data)
+    except (zlib.error, lzma.LZMAError):
+        return None
+    return data if len(data) == length else None
+
+
+class ChunkedWriter:
+    """File-like object that writes data as independently compressed
+    chunks."""
+    def __init__(self, file, codec='zlib', chunk_size=CHUNK_SIZE, offset=0):
+        """Initialize the writer.
+
+        Args:
+            file: A binary file object opened for writing or appending.
+            codec (str): 'zlib' or 'lzma'.
+            chunk_size (int): Largest amount of uncompressed data in a chunk.
+                Data is held until a chunk is full or flush() is called.
+            offset (int): Uncompressed bytes already in the file.
+        """
+        self.file = file
+        self.codec = CODECS[codec]
+        self.chunk_size = chunk_size
+        self.offset = offset
+        self.pending = bytearray()
+
+    def write(self, data):
+        """Add data, writing every full chunk."""
+        self.pending += data
+        while len(self.pending) >= self.chunk_size:
+            self._write_chunk(self.pending[:self.chunk_size])
+            del self.pending[:self.chunk_size]
+        return len(data)
+
+    def _write_chunk(self, data):
+        body = _compress(self.codec, bytes(data))
+        _write_all(self.file, CHUNK_HEADER.pack(
+            CHUNK_MAGIC, self.codec, self.offset, len(data), len(body),
+            zlib.crc32(body)) + body)
+        self.offset += len(data)
+
+    def flush(self):
+        """Write any held data as a chunk."""
+        if self.pending:
+            self._write_chunk(self.pending)
+            self.pending.clear()
+        self.file.flush()
+
+    def tell(self):
+        """Uncompressed bytes written, including those held."""
+        return self.offset + len(self.pending)
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        """Write any held data and close the file."""
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ChunkedReader:
+    """File-like object reading the uncompressed data of a compressed
+    recording.
+
+    Damaged chunks are skipped. Reading at the end of a recording that is
+    still being written returns what is available, so it can be polled like
+    a growing uncompressed file.
+    """
+    def __init__(self, path):
+        """Open the recording.
+
+        Args:
+            path (Path): A recording written with compression.
+        """
+        self.path = Path(path)
+        self.file = open(self.path, 'rb')
+        # Bytes skipped to find the next chunk after damage.
+        self.junk_bytes = 0
+        self._file_pos = 0
+        # File position of the chunk last returned by _next_chunk()
+        self._chunk_pos = 0
+        self._block = b''
+        self._block_offset = 0
+        self._block_pos = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _chunk_at(self, pos):
+        self.file.seek(pos)
+        magic = self.file.read(len(CHUNK_MAGIC))
+        return not magic or magic == CHUNK_MAGIC
+
+    def _resync(self, start):
+        """Move to the next chunk header after start. Returns False if there
+        is none yet."""
+        self.file.seek(start)
+        data = b''
+        while True:
+            block = self.file.read(RESYNC_BLOCK)
+            if not block:
+                # Keep bytes that could be the start of a magic number.
+                end = start + max(len(data) - len(CHUNK_MAGIC) + 1, 0)
+                self.junk_bytes += end - self._file_pos
+                self._file_pos = end
+                return False
+            data = data[-(len(CHUNK_MAGIC) - 1):] + block
+            found = data.find(CHUNK_MAGIC)
+            if found >= 0:
+                pos = self.file.tell() - len(data) + found
+                self.junk_bytes += pos - self._file_pos
+                self._file_pos = pos
+                return True
+            start = self.file.tell() - len(data)
+
+    def _next_chunk(self, decompress=True):
+        """Read the next chunk, skipping damaged data.
+
+        Args:
+            decompress (bool): Decompress the data. If False, the chunk is
+                only checked if the next chunk does not directly follow it.
+
+        Returns:
+            tuple: Uncompressed offset, length and data (None if not
+                decompressed) of the chunk, or None if no complete chunk
+                follows yet.
+        """
+        while True:
+            pos = self._file_pos
+            self.file.seek(pos)
+            header = self.file.read(CHUNK_HEADER.size)
+            if len(header) < CHUNK_HEADER.size:
+                return None
+            magic, codec, offset, length, size, crc = \
+                CHUNK_HEADER.unpack(header)
+            end = pos + CHUNK_HEADER.size + size
+
+            if magic == CHUNK_MAGIC and codec in CODEC_NAMES:
+                if not decompress and self._chunk_at(end):
+                    # Another chunk or the end of the file follows, so the
+                    # header is trusted without reading the data.
+                    self._chunk_pos = pos
+                    self._file_pos = end
+                    return offset, length, None
+
+                self.file.seek(pos + CHUNK_HEADER.size)
+                body = self.file.read(size)
+                if len(body) < size:
+                    # Still being written, or cut off.
+                    return None
+                if zlib.crc32(body) == crc:
+                    data = _decompress(codec, body, length) \
+                        if decompress else b''
+                    if data is not None:
+                        self._chunk_pos = pos
+                        self._file_pos = end
+                        return offset, length, (data if decompress else None)
+
+            if not self._resync(pos + 1):
+                return None
+
+    def read(self, size=-1):
+        """Read up to size bytes of uncompressed data, or all that is
+        available if size is negative."""
+        out = []
+        while size:
+            if self._block_pos >= len(self._block):
+                chunk = self._next_chunk()
+                if chunk is None:
+                    break
+                self._block_offset, _, self._block = chunk
+                self._block_pos = 0
+                continue
+
+            end = len(self._block)
+            if size > 0:
+                end = min(end, self._block_pos + size)
+                size -= end - self._block_pos
+            out.append(self._block[self._block_pos:end])
+            self._block_pos = end
+        return b''.join(out)
+
+    def read_chunks(self):
+        """Yield the uncompressed data from the current position a chunk at
+        a time until no more is available."""
+        if self._block_pos < len(self._block):
+            yield self.read(len(self._block) - self._block_pos)
+        while (chunk := self._next_chunk()) is not None:
+            self._block_offset, _, self._block = chunk
+            self._block_pos = len(self._block)
+            yield self._block
+
+    def tell(self):
+        """Position in the uncompressed data."""
+        return self._block_offset + self._block_pos
+
+    def size(self):
+        """Length of the uncompressed data."""
+        position = self.tell()
+        self.seek(0, os.SEEK_END)
+        size = self.tell()
+        self.seek(position)
+        return size
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """Move to a position in the uncompressed data.
+
+        Whole chunks before the position are skipped without being
+        decompressed.
+        """
+        if whence == os.SEEK_CUR:
+            offset += self.tell()
+        self._file_pos = 0
+        self._block, self._block_offset, self._block_pos = b'', 0, 0
+
+        last = 0
+        while True:
+            chunk = self._next_chunk(decompress=False)
+            if chunk is None:
+                break
+            start, length, _ = chunk
+            if whence != os.SEEK_END and start + length > offset:
+                self._file_pos = self._chunk_pos
+                break
+            last = start + length
+            self._block_offset = last
+
+        if whence == os.SEEK_END:
+            return self.seek(max(last + offset, 0))
+        if (chunk := self._next_chunk()) is not None:
+            self._block_offset, _, self._block = chunk
+            self._block_pos = min(max(offset - self._block_offset, 0),
+                                  len(self._block))
+        return self.tell()
+
+    def close(self):
+        """Close the file."""
+        self.file.close()
+
+
+def is_compressed(path):
+    """True if a recording is compressed, by its suffix or first bytes."""
+    path = Path(path)
+    if path.suffix == COMPRESSED_SUFFIX:
+        return True
+    try:
+        with open(path, 'rb') as file:
+            return file.read(len(CHUNK_MAGIC)) == CHUNK_MAGIC
+    except FileNotFoundError:
+        return False
+
+
+def open_recording(path):
+    """Open a recording for reading, decompressing it if needed.
+
+    Returns:
+        A binary file object, or a `ChunkedReader` for compressed files.
+    """
+    if is_compressed(path):
+        return ChunkedReader(path)
+    return open(path, 'rb')
+
+
+def recording_size(path):
+    """Length of a recording's uncompressed data."""
+    if is_compressed(path):
+        with ChunkedReader(path) as reader:
+            return reader.size()
+    return Path(path).stat().st_size
+
+
+def open_capture(path, compress=None):
+    """Open a new file to save raw data to, like instrument serial captures.
+
+    Args:
+        path (Path): The file to create.
+        compress (str): Codec to compress the file with, 'zlib' or 'lzma'.
+            None to write it uncompressed.
+    """
+    if compress is None:
+        return open(path, 'wb')
+    return ChunkedWriter(open(path, 'wb', buffering=0), compress)
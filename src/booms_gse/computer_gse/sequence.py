@@ -0,0 +1,304 @@
+"""Track packet sequence numbers to measure loss and restore order.
+
+Each system ID numbers its packets with the 16 bit sequence number in the
+header. A `SequenceTracker` follows the numbers for every system ID, holding
+packets that arrive ahead of a missing one for a short time in case it
+arrives late. Packets are released in order, so processors see them in the
+order they were sent.
+
+A packet is held until the missing packets before it arrive, until it is
+`window` packets ahead of the first missing one, or until it has been held
+for `timeout` seconds. The missing numbers then count as gaps. Packets that
+arrive after their place was given up are still released, and counted as
+late. Packets already released are dropped and counted as duplicates.
+
+With a window of 1, the default, nothing is held or dropped, and packets
+are only counted.
+
+A flight computer that restarts counts again from 0, repeating numbers it
+already sent. A jump back further than the window (or 32, if more), or a
+jump from beyond that to a number below it, is taken as a restart. The
+count then follows the new numbers and nothing is dropped.
+
+Acknowledgements (telemetry type 0x01) and packets with a bad CRC do not
+have a usable sequence number, and are released as they arrive.
+"""
+import time
+from collections import deque
+
+# Default number of sequence numbers a packet can be ahead of the first
+# missing one before the missing ones are given up. 1 only counts.
+REORDER_WINDOW = 1
+# Default seconds a packet is held waiting for missing ones.
+REORDER_TIMEOUT = 0.2
+# Fewest sequence numbers back that are taken as duplicates or late
+# packets rather than a restarted count.
+RESTART_DISTANCE = 32
+ACK_TYPE = 0x01
+SEQUENCE_MODULUS = 1 << 16
+
+
+def _distance(sequence, expected):
+    """Signed distance from expected to sequence, allowing for wrap."""
+    distance = (sequence - expected) % SEQUENCE_MODULUS
+    if distance >= SEQUENCE_MODULUS // 2:
+        distance -= SEQUENCE_MODULUS
+    return distance
+
+
+class _SysidSequence:
+    """Sequence state of one system ID."""
+    __slots__ = ('expected', 'last', 'held', 'recent', 'missed', 'gaps',
+                 'duplicates', 'late', 'reordered', 'resets')
+
+    def __init__(self, history):
+        self.expected = None
+        # Furthest ahead sequence number received.
+        self.last = None
+        # Packets ahead of expected and when each arrived, by sequence.
+        self.held = {}
+        # Sequence numbers released recently, to find duplicates.
+        self.recent = _Recent(history)
+        # Sequence numbers given up recently, to find late packets.
+        self.missed = _Recent(history)
+        self.gaps = 0
+        self.duplicates = 0
+        self.late = 0
+        self.reordered = 0
+        self.resets = 0
+
+
+class _Recent:
+    """The last few sequence numbers added, for quick lookup."""
+    __slots__ = ('order', 'numbers')
+
+    def __init__(self, size):
+        self.order = deque(maxlen=size)
+        self.numbers = set()
+
+    def __contains__(self, sequence):
+        return sequence in self.numbers
+
+    def add(self, sequence):
+        order = self.order
+        if len(order) == order.maxlen:
+            self.numbers.discard(order[0])
+        order.append(sequence)
+        self.numbers.add(sequence)
+
+    def discard(self, sequence):
+        # Left in the order, where it is skipped when it falls out.
+        self.numbers.discard(sequence)
+
+    def clear(self):
+        self.order.clear()
+        self.numbers.clear()
+
+
+class SequenceTracker:
+    """Per system ID sequence tracking with a bounded reorder buffer."""
+    def __init__(self, window=REORDER_WINDOW, timeout=REORDER_TIMEOUT):
+        """Initialize the tracker.
+
+        Args:
+            window (int): How far ahead, in sequence numbers, a packet can be
+                held waiting for missing ones. 1 releases every packet as it
+                arrives, duplicates included, and only counts.
+            timeout (float): Longest time in seconds a packet is held.
+        """
+        if window < 1:
+            raise ValueError('The reorder window must be at least 1.')
+        self.window = window
+        self.timeout = timeout
+        # Jumps further than this, or to below it, are restarted counts.
+        self.reach = max(window, RESTART_DISTANCE)
+        # Far enough back to catch duplicates and late packets.
+        self.history = 4 * self.reach
+        self.sysids = [None] * 256
+        self.held = 0
+
+    def push(self, packet, now=None):
+        """Add a received packet.
+
+        Args:
+            packet (Packet): The packet.
+            now (float): time.monotonic() when it arrived, if known.
+
+        Returns:
+            list(Packet): Packets released in order. May be empty.
+        """
+        if packet.tmtype == ACK_TYPE or not packet.valid:
+            return [packet]
+
+        state = self.sysids[packet.sysid]
+        if state is None:
+            state = self.sysids[packet.sysid] = _SysidSequence(self.history)
+        sequence = packet.sequence
+        if state.expected is None:
+            state.expected = state.last = sequence
+
+        distance = _distance(sequence, state.expected)
+        if distance == 0 and not state.held:
+            # The usual case, in order with nothing held.
+            state.expected = (sequence + 1) % SEQUENCE_MODULUS
+            state.last = sequence
+            state.recent.add(sequence)
+            return [packet]
+
+        released = []
+        if distance < 0 and sequence in state.missed:
+            # Given up on, but only just.
+            state.late += 1
+            state.missed.discard(sequence)
+            state.recent.add(sequence)
+            return [packet]
+        reach = self.reach
+        if distance < 0:
+            restarted = -distance > reach or sequence < reach <= state.last
+        else:
+            restarted = sequence < reach <= distance
+        if restarted:
+            # The count restarted.
+            state.resets += 1
+            released = self._release_through(state, None)
+            state.recent.clear()
+            state.missed.clear()
+            state.expected = state.last = sequence
+            distance = 0
+        elif distance < 0:
+            if sequence in state.recent:
+                state.duplicates += 1
+                return [] if self.window > 1 else [packet]
+            # From before the count was followed.
+            state.late += 1
+            state.recent.add(sequence)
+            return [packet]
+
+        if sequence in state.held:
+            state.duplicates += 1
+            return released
+        if _distance(sequence, state.last) < 0:
+            # Arrived after a later packet, but in time to be put in order.
+            state.reordered += 1
+        else:
+            state.last = sequence
+        state.held[sequence] = (packet, time.monotonic() if now is None
+                                else now)
+        self.held += 1
+        if distance >= self.window:
+            # Give up the missing packets too far behind this one.
+            released += self._release_through(
+                state, (sequence - self.window + 1) % SEQUENCE_MODULUS)
+        released += self._release_ready(state)
+        return released
+
+    def push_batch(self, packets):
+        """Add packets received together.
+
+        Args:
+            packets (list(Packet)): The packets in the order received.
+
+        Returns:
+            list(Packet): Packets released in order.
+        """
+        now = time.monotonic()
+        released = []
+        for packet in packets:
+            released += self.push(packet, now)
+        return released
+
+    def expire(self, now=None):
+        """Give up missing packets that held ones have waited too long for.
+
+        Args:
+            now (float): time.monotonic() now, if known.
+
+        Returns:
+            list(Packet): Packets released in order.
+        """
+        if not self.held:
+            return []
+        if now is None:
+            now = time.monotonic()
+        deadline = now - self.timeout
+        released = []
+        for state in self.sysids:
+            if state is None or not state.held:
+                continue
+            while state.held:
+                oldest = min(arrived for _, arrived in state.held.values())
+                if oldest > deadline:
+                    break
+                first = min(state.held,
+                            key=lambda s: _distance(s, state.expected))
+                released += self._release_through(state, first)
+                released += self._release_ready(state)
+        return released
+
+    def flush(self):
+        """Release every held packet, giving up the missing ones.
+
+        Returns:
+            list(Packet): Packets released in order.
+        """
+        released = []
+        for state in self.sysids:
+            if state is not None and state.held:
+                released += self._release_through(state, None)
+        return released
+
+    def _release_ready(self, state):
+        """Release held packets that continue from expected."""
+        released = []
+        held = state.held
+        expected = state.expected
+        while expected in held:
+            released.append(held.pop(expected)[0])
+            state.recent.add(expected)
+            expected = (expected + 1) % SEQUENCE_MODULUS
+        state.expected = expected
+        self.held -= len(released)
+        return released
+
+    def _release_through(self, state, stop):
+        """Give up missing packets before stop, releasing held ones in
+        order. With stop None, release everything held."""
+        held = state.held
+        expected = state.expected
+        if stop is None:
+            if not held:
+                return []
+            stop = max(held, key=lambda s: _distance(s, expected))
+            stop = (stop + 1) % SEQUENCE_MODULUS
+        released = []
+        for _ in range(_distance(stop, expected)):
+            entry = held.pop(expected, None)
+            if entry is None:
+                state.gaps += 1
+                state.missed.add(expected)
+            else:
+                released.append(entry[0])
+                state.recent.add(expected)
+            expected = (expected + 1) % SEQUENCE_MODULUS
+        state.expected = expected
+        self.held -= len(released)
+        return released
+
+    def stats(self):
+        """Totals of gaps, duplicates, late and reordered packets, restarted
+        counts and packets held now."""
+        totals = dict.fromkeys(('gaps', 'duplicates', 'late', 'reordered',
+                                'resets'), 0)
+        for counts in self.sysid_stats().values():
+            for key in totals:
+                totals[key] += counts[key]
+        totals['held'] = self.held
+        return totals
+
+    def sysid_stats(self):
+        """The counts for each system ID seen, by system ID."""
+        return {sysid: {'gaps': state.gaps, 'duplicates': state.duplicates,
+                        'late': state.late, 'reordered': state.reordered,
+                        'resets': state.resets, 'held': len(state.held)}
+                for sysid, state in enumerate(self.sysids)
+                if state is not None}
@@ -0,0 +1,381 @@
+"""Simulate the BOOMS flight computer for testing without hardware.
+
+`FlightComputerSimulator` sends CRC-valid telemetry of every type `mm_gse`
+parses: PPS and GPS from the GPS receiver, housekeeping and statistics from
+the computer, the magnetometer, and the serial streams of the imagers and
+spectrometers, framed as the instrument GSEs expect. It also acknowledges
+commands sent to the command port, and follows the route telemetry command.
+
+Rates are per second of real time and can all be multiplied by a scale, to
+test the GSE well beyond flight rates. The values are random but plausible,
+and are not meant to look like real data.
+"""
+import asyncio
+import logging
+import socket
+import time
+from datetime import datetime, timezone
+from functools import partial
+from ipaddress import IPv4Address
+
+import numpy as np
+
+from .network import COMMAND_PORT, PacketProcessor
+from .packet import SYNC, build_packet, packet_crc
+
+# Default rates, per instrument, per second.
+EVENT_RATE = 500.0  # imager X-ray events
+SPECTRUM_RATE = 10.0  # spectrometer frames, 2120 bytes per second
+MAG_RATE = 10.0  # magnetometer readings
+IMAGER_PACKET_RATE = 10.0  # packets the imager serial data is split into
+# Seconds between checks for packets that are due.
+TICK = 0.01
+# Largest number of packets sent from one source each tick when behind.
+MAX_BURST = 1000
+
+IMAGER_IDS = tuple(0xC0 + i for i in range(7))
+SPECTROMETER_IDS = tuple(0xD0 + i for i in range(3))
+GPS_ID = 0x60
+COMPUTER_ID = 0xA0
+MAG_ID = 0xB0
+PPS_TYPE = 0x60
+GPS_TYPE = 0x61
+HOUSE_TYPE = 0x02
+STATISTICS_TYPE = 0x0C
+MAG_TYPE = 0xB0
+IMAGER_TYPE = 0xC0
+SPECTROMETER_TYPE = 0xD0
+ACK_TYPE = 0x01
+ROUTE_TELEMETRY = (COMPUTER_ID, 0xA1)
+
+# Commands are sync word, CRC, system ID, command type, sequence number and
+# payload length, followed by the payload. Acknowledgements echo the command
+# as their payload.
+COMMAND_HEADER_LENGTH = 8
+# The flight computer puts the number of the command acknowledged in these
+# header bytes, where mm_gse reads it.
+ACK_NUMBER_SLICE = slice(8, 10)
+
+# Imager serial packet lengths by type. See `instrument_gse.imager`.
+IMAGER_LENGTHS = {0: 7, 1: 11, 2: 11, 3: 11, 4: 11, 5: 8, 6: 18}
+SPECTROMETER_FRAME_LENGTH = 212
+SOFTWARE_VERSION = 1
+
+# Launch site the GPS position wanders around.
+LATITUDE = 34.47
+LONGITUDE = -104.24
+ALTITUDE = 35000  # meters
+# Center of the magnetometer's 24 bit readings.
+MAG_ZERO = 8388608
+
+logger = logging.getLogger(__name__)
+
+
+def _pack10(values):
+    """Pack 10 bit values four to five bytes, most significant first.
+
+    Args:
+        values (np.ndarray): Integers below 1024. The last axis is a multiple
+            of 4 long.
+
+    Returns:
+        np.ndarray: uint8 bytes, with the last axis 5/4 as long.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    values = values.reshape(values.shape[:-1] + (-1, 4))
+    words = ((values[..., 0] << 30) | (values[..., 1] << 20)
+             | (values[..., 2] << 10) | values[..., 3])
+    shifts = np.array([32, 24, 16, 8, 0], dtype=np.uint64)
+    packed = (words[..., None] >> shifts) & 0xFF
+    return packed.astype(np.uint8).reshape(values.shape[:-2] + (-1,))
+
+
+def _imager_header(packet_type):
+    """First two bytes of an imager serial packet of a type."""
+    return bytes([0xAC | (packet_type >> 1), (packet_type & 1) << 7])
+
+
+def spectrometer_checksum(frame):
+    """Sum of the big endian 16 bit words before the checksum."""
+    words = np.frombuffer(frame[:SPECTROMETER_FRAME_LENGTH - 2], dtype='>u2')
+    return int(words.sum()) & 0xFFFF
+
+
+class _Source:
+    """Packets due at a steady rate."""
+    def __init__(self, rate, make):
+        self.rate = rate
+        self.make = make
+        self.sent = 0
+
+
+class _CommandProtocol(asyncio.DatagramProtocol):
+    def __init__(self, simulator):
+        self.simulator = simulator
+
+    def datagram_received(self, data, addr):
+        self.simulator.command_received(data, addr)
+
+
+class FlightComputerSimulator(PacketProcessor):
+    """Send simulated flight computer telemetry and acknowledge commands.
+
+    It is run like a processor, but subscribes to no packets.
+    """
+    def __init__(self, target_ip='127.0.0.1', target_port=20501,
+                 command_port=COMMAND_PORT, imagers=len(IMAGER_IDS),
+                 spectrometers=len(SPECTROMETER_IDS), event_rate=EVENT_RATE,
+                 spectrum_rate=SPECTRUM_RATE, mag_rate=MAG_RATE,
+                 imager_packet_rate=IMAGER_PACKET_RATE, scale=1.0,
+                 seed=None):
+        """Initialize the simulator. Sending starts with setup().
+
+        Args:
+            target_ip (str): IPv4 address telemetry is sent to. Changed by
+                the route telemetry command.
+            target_port (int): UDP port telemetry is sent to.
+            command_port (int): UDP port to receive commands on. None to not
+                receive commands.
+            imagers (int): Number of imagers sending data, up to 7.
+            spectrometers (int): Number of spectrometers, up to 3.
+            event_rate (float): X-ray events per second from each imager.
+            spectrum_rate (float): Frames per second from each spectrometer.
+            mag_rate (float): Magnetometer readings per second.
+            imager_packet_rate (float): Packets per second for each imager.
+            scale (float): Multiplies every rate.
+            seed (int): Seed for the random values.
+        """
+        super().__init__()
+        self.sysids = set()
+        self.target = (target_ip, target_port)
+        self.command_port = command_port
+        self.imagers = IMAGER_IDS[:imagers]
+        self.spectrometers = SPECTROMETER_IDS[:spectrometers]
+        self.events_per_packet = event_rate / imager_packet_rate
+        self.imager_packets_per_frame = max(1, round(imager_packet_rate))
+        self.scale = scale
+        self.rng = np.random.default_rng(seed)
+
+        self.sources = [_Source(1.0, self._pps), _Source(1.0, self._gps),
+                        _Source(1.0, self._house),
+                        _Source(1.0, self._statistics),
+                        _Source(mag_rate, self._mag)]
+        self.sources.extend(
+            _Source(imager_packet_rate, partial(self._imager, sysid))
+            for sysid in self.imagers)
+        self.sources.extend(
+            _Source(spectrum_rate, partial(self._spectrometer, sysid))
+            for sysid in self.spectrometers)
+
+        self.sequences = [0] * 256
+        # Acknowledgements are numbered apart from the housekeeping packets,
+        # so they leave no gaps in those.
+        self.ack_sequence = 0
+        # Imager events and telemetry bytes since the last statistics and
+        # housekeeping packets.
+        self.events = [0] * 8
+        self.interval_bytes = [0] * 256
+        self.last_command = 0
+        self.started = None
+        self.sock = None
+        self.command_transport = None
+        self._task = None
+        self.packets = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.commands = 0
+        self.bad_commands = 0
+
+    def setup(self, transport):
+        """Start sending telemetry and receiving commands."""
+        super().setup(transport)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.started = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        if self.command_port is not None:
+            try:
+                self.command_transport, _ = \
+                    await loop.create_datagram_endpoint(
+                        lambda: _CommandProtocol(self),
+                        local_addr=('0.0.0.0', self.command_port))
+            except OSError as exc:
+                logger.warning('Not receiving commands on port %d: %s',
+                               self.command_port, exc)
+
+        start = loop.time()
+        while True:
+            await asyncio.sleep(TICK)
+            elapsed = (loop.time() - start) * self.scale
+            for source in self.sources:
+                due = min(int(elapsed * source.rate) - source.sent, MAX_BURST)
+                for _ in range(due):
+                    self._send(*source.make())
+                if due > 0:
+                    source.sent += due
+
+    @property
+    def ticks(self):
+        """Gondola time in 100 ns ticks, counted from the start."""
+        return int((time.monotonic() - self.started) * 1e7)
+
+    def _send(self, sysid, tmtype, payload):
+        packet = build_packet(sysid, tmtype, payload,
+                              self.sequences[sysid], self.ticks)
+        self.sequences[sysid] += 1
+        self._transmit(sysid, packet)
+
+    def _transmit(self, sysid, packet):
+        self.interval_bytes[sysid] += len(packet)
+        try:
+            self.sock.sendto(packet, self.target)
+        except (BlockingIOError, OSError):
+            self.dropped += 1
+            return
+        self.packets += 1
+        self.bytes += len(packet)
+
+    def _pps(self):
+        now = datetime.now(timezone.utc)
+        payload = bytes([0, now.hour, now.minute, now.second]) \
+            + int(self.rng.normal(0, 20)).to_bytes(4, 'little', signed=True) \
+            + (1).to_bytes(4, 'little')
+        return GPS_ID, PPS_TYPE, payload
+
+    def _gps(self):
+        now = datetime.now(timezone.utc)
+        latitude, longitude = \
+            self.rng.normal((LATITUDE, LONGITUDE), 0.001)
+        payload = (bytes([now.hour, now.minute, now.second, 0])
+                   + np.array([latitude, longitude], '<f8').tobytes()
+                   + bytes([1, 9])
+                   + np.array(0.9, '<f4').tobytes()
+                   + ALTITUDE.to_bytes(2, 'little')
+                   + (-20).to_bytes(2, 'little', signed=True))
+        return GPS_ID, GPS_TYPE, payload
+
+    def _house(self):
+        counts = self.interval_bytes
+        imager_bytes = sum(counts[sysid] for sysid in IMAGER_IDS)
+        spectrometer_bytes = sum(counts[sysid] for sysid in SPECTROMETER_IDS)
+        uptime = int(time.monotonic() - self.started)
+        payload = (bytes([0b00100011, self.last_command & 0xFF])
+                   + int(self.rng.uniform(500, 3000)).to_bytes(2, 'little')
+                   + (4200).to_bytes(2, 'little')
+                   + uptime.to_bytes(4, 'little')
+                   + bytes([min(counts[COMPUTER_ID], 255),
+                            min(counts[GPS_ID], 255)])
+                   + min(imager_bytes, 0xFFFFFFFF).to_bytes(4, 'little')
+                   + min(spectrometer_bytes, 0xFFFF).to_bytes(2, 'little')
+                   + bytes([min(counts[MAG_ID], 255), 45, 50, 50, 52]))
+        self.interval_bytes = [0] * 256
+        return COMPUTER_ID, HOUSE_TYPE, payload
+
+    def _statistics(self):
+        payload = b''.join(min(events, 0xFFFF).to_bytes(2, 'little')
+                           + bytes(4) for events in self.events)
+        self.events = [0] * 8
+        return COMPUTER_ID, STATISTICS_TYPE, payload
+
+    def _mag(self):
+        bx, by, bz = self.rng.normal((20.0, -5.0, 45.0), 0.05)
+        readings = (bx, by, bz, 300.0 / 29.8, 1.0)
+        payload = b'\xbf\xaa' + b''.join(
+            int(MAG_ZERO + value / 100.0 * (MAG_ZERO - 1)).to_bytes(3, 'big')
+            for value in readings) + b'\x55'
+        return MAG_ID, MAG_TYPE, payload
+
+    def _imager(self, sysid):
+        """The imager serial data sent in one packet: X-ray events, plus the
+        frame header, counters and housekeeping once per imager frame."""
+        index = sysid & 0x0F
+        count = self.rng.poisson(self.events_per_packet)
+        self.events[index] += count
+
+        events = np.empty((count, IMAGER_LENGTHS[0]), dtype=np.uint8)
+        events[:, :2] = np.frombuffer(_imager_header(0), dtype=np.uint8)
+        channels = np.clip(self.rng.exponential(150, (count, 4)), 0, 1023)
+        events[:, 2:] = _pack10(channels)
+        data = events.tobytes()
+
+        number = self.sequences[sysid]
+        if number % self.imager_packets_per_frame == 0:
+            frame = number // self.imager_packets_per_frame
+            header = bytearray(_imager_header(5))
+            header[1] |= (index << 4) & 0x70 | SOFTWARE_VERSION
+            header += (frame & 0xFFFF).to_bytes(2, 'big')
+            header += (frame & 0xFFFFFFFF).to_bytes(4, 'big')
+            counters = b''.join(
+                _imager_header(t) + self.rng.poisson(1000, 3).astype('>u2')
+                .tobytes() + bytes(3) for t in range(1, 5))
+            housekeeping = _imager_header(6) + self.rng.integers(
+                1000, 3000, 8).astype('>u2').tobytes()
+            data = bytes(header) + counters + housekeeping + data
+        return sysid, IMAGER_TYPE, data
+
+    def _spectrometer(self, sysid):
+        """One 212 byte spectrometer frame."""
+        frame_count = self.sequences[sysid] & 0xFFFFFF
+        frame = bytearray(SPECTROMETER_FRAME_LENGTH)
+        frame[0:2] = SYNC[::-1]
+        frame[2] = (SOFTWARE_VERSION << 4) | (sysid & 0x0F)
+        frame[3:6] = frame_count.to_bytes(3, 'big')
+        counts = np.clip(self.rng.poisson(20, (10, 16)), 0, 1023)
+        frame[6:206] = _pack10(counts).tobytes()
+        frame[206:210] = self.rng.integers(0, 4096, 2).astype('>u2').tobytes()
+        frame[210:212] = spectrometer_checksum(frame).to_bytes(2, 'big')
+        return sysid, SPECTROMETER_TYPE, bytes(frame)
+
+    def command_received(self, data, addr):
+        """Check a command, follow it if it is understood and acknowledge
+        it.
+
+        Args:
+            data (bytes): The command packet.
+            addr (tuple): Address it came from.
+        """
+        if len(data) < COMMAND_HEADER_LENGTH or data[:2] != SYNC \
+                or len(data) != COMMAND_HEADER_LENGTH + data[7] \
+                or packet_crc(data) != int.from_bytes(data[2:4], 'little'):
+            self.bad_commands += 1
+            logger.warning('Bad command from %s: %s', addr[0], data.hex())
+            return
+
+        self.commands += 1
+        sysid, command_type, number = data[4], data[5], data[6]
+        self.last_command = command_type
+        payload = data[COMMAND_HEADER_LENGTH:]
+        logger.info('Command %d from %s: 0x%02x/0x%02x %s', number, addr[0],
+                    sysid, command_type, payload.hex())
+        if (sysid, command_type) == ROUTE_TELEMETRY and len(payload) == 4:
+            self.target = (str(IPv4Address(bytes(payload))), self.target[1])
+            logger.info('Routing telemetry to %s:%d', *self.target)
+
+        ack = bytearray(build_packet(COMPUTER_ID, ACK_TYPE, bytes(data),
+                                     self.ack_sequence, self.ticks))
+        self.ack_sequence += 1
+        ack[ACK_NUMBER_SLICE] = number.to_bytes(2, 'little')
+        ack[2:4] = packet_crc(ack).to_bytes(2, 'little')
+        self._transmit(COMPUTER_ID, bytes(ack))
+
+    def stats(self):
+        """Telemetry sent and commands received."""
+        return {'packets': self.packets, 'bytes': self.bytes,
+                'dropped': self.dropped, 'commands': self.commands,
+                'bad_commands': self.bad_commands}
+
+    def close(self):
+        """Stop sending telemetry and receiving commands."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.command_transport is not None:
+            self.command_transport.close()
+            self.command_transport = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        super().close()
@@ -0,0 +1,188 @@
+"""Plotted telemetry kept on disk, so mm_gse can be restarted without losing
+the flight so far.
+
+A store is a directory with a subdirectory for each kind of row. Rows are
+written in chunks, a new one for each run and for each `CHUNK_SECONDS` of
+it, named by the UTC time they were started so they sort in order:
+
+    store/mag_data/20260101T120000/rows
+    store/mag_data/20260101T120000/date.f8
+    store/mag_data/20260101T120000/bx.f8
+    ...
+
+Each column is a file of little endian float64 values, and `rows` is a
+single little endian uint64 with how many of them are written. The files
+are memory-mapped while they are written, and grow by doubling, so they can
+be longer than `rows`. To read a column with numpy:
+
+    rows = np.fromfile(chunk / 'rows', dtype='<u8')[0]
+    bx = np.memmap(chunk / 'bx.f8', dtype='<f8', mode='r')[:rows]
+
+or use `read_store()` for every chunk of every kind at once.
+"""
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Seconds of rows in each chunk.
+CHUNK_SECONDS = 3600
+# Rows a new chunk has room for before it grows.
+CHUNK_ROWS = 4096
+DTYPE = np.dtype('<f8')
+COUNT_DTYPE = np.dtype('<u8')
+COUNT_FILE = 'rows'
+COLUMN_SUFFIX = '.f8'
+CHUNK_FORMAT = '%Y%m%dT%H%M%S'
+
+
+def _map(path, capacity, dtype=DTYPE):
+    """Map a file of capacity values for writing, creating or growing it."""
+    with open(path, 'ab') as file:
+        if file.tell() < capacity * dtype.itemsize:
+            file.truncate(capacity * dtype.itemsize)
+    return np.memmap(path, dtype=dtype, mode='r+', shape=(capacity,))
+
+
+def read_chunk(path, columns=None):
+    """Read the rows of a chunk.
+
+    Args:
+        path (Path): The chunk's directory.
+        columns (iterable(str)): Columns to read. All the chunk has by
+            default. Columns the chunk does not have are NaN.
+
+    Returns:
+        dict: Array of each column, by name, mapped and not copied.
+    """
+    path = Path(path)
+    count = path / COUNT_FILE
+    rows = int(np.fromfile(count, dtype=COUNT_DTYPE)[0]) \
+        if count.stat().st_size >= COUNT_DTYPE.itemsize else 0
+    if columns is None:
+        columns = sorted(file.stem for file in path.glob('*' + COLUMN_SUFFIX))
+    data = {}
+    for column in columns:
+        file = path / (column + COLUMN_SUFFIX)
+        if rows and file.exists():
+            data[column] = np.memmap(file, dtype=DTYPE, mode='r')[:rows]
+        else:
+            data[column] = np.full(rows, np.nan)
+    return data
+
+
+def chunks(path):
+    """The chunk directories of a kind of row, in the order written."""
+    path = Path(path)
+    if not path.is_dir():
+        return []
+    return sorted(chunk for chunk in path.iterdir()
+                  if (chunk / COUNT_FILE).exists())
+
+
+def read_store(directory):
+    """Read everything in a store.
+
+    Args:
+        directory (Path): The store's directory.
+
+    Returns:
+        dict: For each kind of row, a dict with the array of each of its
+            columns, by name.
+    """
+    store = {}
+    for path in sorted(Path(directory).iterdir()):
+        paths = chunks(path)
+        if not paths:
+            continue
+        columns = sorted({file.stem for chunk in paths
+                          for file in chunk.glob('*' + COLUMN_SUFFIX)})
+        parts = [read_chunk(chunk, columns) for chunk in paths]
+        store[path.name] = {column: np.concatenate([part[column]
+                                                    for part in parts])
+                            for column in columns}
+    return store
+
+
+class ColumnStore:
+    """Rows of one kind in a directory of chunks."""
+    def __init__(self, path, columns, chunk_seconds=CHUNK_SECONDS):
+        """Initialize the store. Nothing is written until the first row.
+
+        Args:
+            path (Path): Directory of this kind of row, created if needed.
+            columns (tuple(str)): Names of the values in each row.
+            chunk_seconds (float): Seconds of rows written to each chunk.
+        """
+        self.path = Path(path)
+        self.columns = columns
+        self.chunk_seconds = chunk_seconds
+        self._maps = None
+        self._count = None
+        self._length = 0
+        self._chunk_end = 0
+
+    def read(self):
+        """Every row written before, by column.
+
+        Returns:
+            np.ndarray: Array of shape (columns, rows).
+        """
+        parts = [read_chunk(chunk, self.columns) for chunk in chunks(self.path)]
+        if not parts:
+            return np.empty((len(self.columns), 0))
+        return np.array([np.concatenate([part[column] for part in parts])
+                         for column in self.columns])
+
+    def append(self, row):
+        """Write a row of numbers, in the order of the columns."""
+        now = time.time()
+        if now >= self._chunk_end:
+            self._open_chunk(now)
+        elif self._length == len(self._maps[0]):
+            self._grow()
+        for values, value in zip(self._maps, row):
+            values[self._length] = value
+        self._length += 1
+        # Only count the row once it is written.
+        self._count[0] = self._length
+
+    def _open_chunk(self, now):
+        """Start a new chunk named by the time now."""
+        self.close()
+        name = time.strftime(CHUNK_FORMAT, time.gmtime(now))
+        path = self.path / name
+        suffix = 1
+        while path.exists():
+            # Restarted within a second.
+            path = self.path / f'{name}.{suffix}'
+            suffix += 1
+        path.mkdir(parents=True)
+        self._maps = [_map(path / (column + COLUMN_SUFFIX), CHUNK_ROWS)
+                      for column in self.columns]
+        self._count = _map(path / COUNT_FILE, 1, COUNT_DTYPE)
+        self._count[0] = 0
+        self._length = 0
+        self._chunk_end = now + self.chunk_seconds
+
+    def _grow(self):
+        """Double the room in the current chunk."""
+        capacity = 2 * len(self._maps[0])
+        paths = [values.filename for values in self._maps]
+        for values in self._maps:
+            values.flush()
+        self._maps = [_map(path, capacity) for path in paths]
+
+    def flush(self):
+        """Write the mapped rows to disk."""
+        if self._maps is not None:
+            for values in self._maps:
+                values.flush()
+            self._count.flush()
+
+    def close(self):
+        """Flush and unmap the current chunk."""
+        self.flush()
+        self._maps = None
+        self._count = None
+        self._chunk_end = 0
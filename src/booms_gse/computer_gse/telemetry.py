@@ -0,0 +1,274 @@
+"""Decode the flight computer telemetry shown by mm_gse.
+
+A `TelemetryDecoder` keeps the latest GPS, PPS, housekeeping and magnetometer
+readings, and the bytes received of each packet type. Packets are decoded
+synchronously by a handler looked up from a table keyed by system ID and
+telemetry type, which update the readings in place.
+
+Readings that are plotted are passed on as rows, a tuple of values in the
+order of `COLUMNS[name]`. Other changes are passed on by the name of what
+changed, so the display can be refreshed.
+"""
+import datetime
+import struct
+from time import perf_counter
+
+import astropy.units as u
+import numpy as np
+from astropy.coordinates import Angle
+
+from .packet import SYSID_INDEX, TMTYPE_INDEX, gondola_time
+from .packet import sequence as packet_sequence
+
+# Columns of each kind of plotted row. date is the GPS time of the last PPS
+# in milliseconds since the Unix epoch, as bokeh plots datetimes, and dateG
+# the gondola time in seconds.
+COLUMNS = {
+    'data_rates': ('date', 'dateG', 'total', 'interface', 'imager_hk',
+                   'imager_event', 'gps', 'mag', 'spec'),
+    'statistics': ('date', 'dateG') + tuple(
+        f'{name}_{i}' for i in range(8)
+        for name in ('events', 'remain', 'bad')),
+    'timing': ('date', 'dateG', 'gps_to_pps', 'pps_to_sbc'),
+    'mag_data': ('date', 'dateG', 'bx', 'by', 'bz', 'total'),
+}
+
+ACK_TYPE = 0x01
+PPS_KEY = (0x60, 0x60)
+GPS_KEY = (0x60, 0x61)
+GPS_OTHER_KEY = (0x60, 0x62)
+STATISTICS_KEY = (0xa0, 0x0c)
+HOUSE_KEY = (0xa0, 0x02)
+MAG_KEY = (0xb0, 0xb0)
+# System IDs, by their high nibble, with packets mm_gse does not decode.
+INSTRUMENT_GROUPS = (0xc0, 0xd0)
+
+QUALITY_STRINGS = ['invalid fix', 'GPS fix', 'SBAS-corrected fix', '', '', '',
+                   '', 'cached']
+GPS_STRINGS = ['NO GPS fix', 'GPS fix']
+PPS_STRINGS = ['NO PPS from GPS device', 'Using PPS from GPS device']
+SBD_STRINGS = ['NOT in middle of sending SBD packets', 'Sending SBD packets']
+GND_STRINGS = ['Telemetry NOT sent to ground port',
+               'Telemetry being sent to ground port']
+EVTM_STRINGS = ['Telemetry NOT sent via LOS EVTM link',
+                'Telementry being sent via LOS EVTM link']
+RATE_STRINGS = ['EVTM NOT rate limited', 'EVTM being rate limited']
+
+STATISTICS = struct.Struct('<24H')
+GPS_POSITION = struct.Struct('<dd')
+MAG_ZERO = 8388608
+MAG_SCALE = 8388607
+
+# Times the display is refreshed each second.
+REFRESH_RATE = 4.0
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _mag_value(data, start, scale):
+    """A 24 bit big endian magnetometer reading in physical units."""
+    return scale * (int.from_bytes(data[start:start + 3], 'big') - MAG_ZERO) \
+        / MAG_SCALE
+
+
+def datetime_ms(date):
+    """Milliseconds since the Unix epoch of a UTC datetime."""
+    return (date - EPOCH) / datetime.timedelta(milliseconds=1)
+
+
+class TelemetryDecoder:
+    """Decode telemetry packets into the latest readings and plotted
+    rows."""
+    def __init__(self, on_row=None, on_change=None):
+        """Initialize the readings.
+
+        Args:
+            on_row (callable): Called with the name of a row in `COLUMNS`
+                and a tuple of its values for each new row.
+            on_change (callable): Called with 'gps', 'pps', 'house', 'mag' or
+                'command' when those readings change.
+        """
+        self.on_row = on_row or (lambda name, row: None)
+        self.on_change = on_change or (lambda name: None)
+
+        # Bytes received by system ID and telemetry type since the last PPS.
+        self.telemetry_info = np.zeros((256, 256))
+        self.acknowledged_sequence = -1
+        self.gps_info = {'hour': 0, 'minute': 0, 'second': 0,
+                         'latitude': Angle(0 * u.deg),
+                         'longitude': Angle(0 * u.deg),
+                         'altitude': 0 * u.m, 'quality': '', 'num_sat': 0,
+                         'hdop': 0, 'geoidal': 0 * u.m, 'gondola': 0}
+        self.pps_info = {'day_offset': 0, 'hour': 0, 'minute': 0,
+                         'second': 0, 'clock_difference': 0 * u.s,
+                         'second_offset': 0 * u.s, 'gondola': 0,
+                         'datetime': datetime.datetime(2000, 1, 1),
+                         'date': datetime_ms(datetime.datetime(2000, 1, 1))}
+        self.house_info = {'seq': 0, 'gon_t': 0, 'gps': '', 'pps': '',
+                           'sbd': '', 'gnd': '', 'evtm': '', 'rate': '',
+                           'cmd': 0, 'cpu': 0, 'disk': 0, 'up': 0,
+                           'comp_byte': 0, 'gps_byte': 0, 'imag_byte': 0,
+                           'spec_byte': 0, 'mag_byte': 0, 'temp_acpitz': 0,
+                           'temp_soc_dts0': 0, 'temp_soc_dts1': 0,
+                           'temp_cpu_max': 0}
+        self.mag_info = {'bx': 0, 'by': 0, 'bz': 0, 'total': 0, 'temp': 0,
+                         'adc': 0}
+
+        self.handlers = {PPS_KEY: self.decode_pps,
+                         GPS_KEY: self.decode_gps_position,
+                         GPS_OTHER_KEY: None,
+                         STATISTICS_KEY: self.decode_statistics,
+                         HOUSE_KEY: self.decode_house,
+                         MAG_KEY: self.decode_mag}
+        # Packets decoded, seconds spent and the longest, by key.
+        self.timings = {}
+
+    def decode(self, data):
+        """Decode one packet and count its bytes.
+
+        Args:
+            data (bytes): The whole packet, with a valid CRC.
+        """
+        key = (data[SYSID_INDEX], data[TMTYPE_INDEX])
+        try:
+            handler = self.handlers[key]
+        except KeyError:
+            handler = self.handlers[key] = self._resolve(key)
+        if handler is not None:
+            start = perf_counter()
+            handler(data)
+            elapsed = perf_counter() - start
+            timing = self.timings.get(key)
+            if timing is None:
+                self.timings[key] = [1, elapsed, elapsed]
+            else:
+                timing[0] += 1
+                timing[1] += elapsed
+                if elapsed > timing[2]:
+                    timing[2] = elapsed
+        self.telemetry_info[key] += len(data)
+
+    def _resolve(self, key):
+        """Handler for a key not in the table yet, or None to skip it."""
+        sysid, tmtype = key
+        if tmtype == ACK_TYPE:
+            return self.decode_ack
+        if sysid & 0xf0 in INSTRUMENT_GROUPS:
+            return None
+        print(f'Unhandled telemetry packet (0x{sysid:02x}/0x{tmtype:02x})')
+        return None
+
+    def timing_stats(self):
+        """Packets decoded and the mean and longest decode times in seconds,
+        by (sysid, tmtype)."""
+        return {key: {'count': count, 'mean': total / count, 'max': longest}
+                for key, (count, total, longest) in self.timings.items()}
+
+    def decode_ack(self, data):
+        """Command acknowledgement."""
+        self.acknowledged_sequence = int.from_bytes(data[8:10], 'little')
+        self.on_change('command')
+
+    def decode_statistics(self, data):
+        """Imager event statistics."""
+        values = STATISTICS.unpack_from(data, 16)
+        self.on_row('statistics', (self.pps_info['date'],
+                                   self.pps_info['gondola']) + values)
+        for i in range(8):
+            if values[3 * i + 2] > 0:
+                print(f'Gondola time: {data[10:16].hex()}, Imager: {i}, '
+                      f'Number of bad bytes: {values[3 * i + 2]}')
+
+    def decode_gps_position(self, data):
+        """GPS position."""
+        info = self.gps_info
+        info['hour'] = data[16]
+        info['minute'] = data[17]
+        info['second'] = data[18]
+        latitude, longitude = GPS_POSITION.unpack_from(data, 20)
+        info['latitude'] = Angle(latitude * u.deg)
+        info['longitude'] = Angle(longitude * u.deg)
+        info['altitude'] = struct.unpack_from('<H', data, 42)[0] * u.m
+        info['quality'] = QUALITY_STRINGS[data[36] & 0x07]
+        info['num_sat'] = data[37]
+        info['hdop'] = struct.unpack_from('<f', data, 38)[0]
+        info['geoidal'] = struct.unpack_from('<h', data, 44)[0] * u.m
+        info['gondola'] = gondola_time(data)
+        self.on_change('gps')
+
+    def decode_pps(self, data):
+        """PPS time, which also closes the data rates for the last
+        second."""
+        info = self.pps_info
+        info['day_offset'] = data[16]
+        info['hour'] = data[17]
+        info['minute'] = data[18]
+        info['second'] = data[19]
+        info['clock_difference'] = \
+            struct.unpack_from('<l', data, 20)[0] * u.us
+        info['second_offset'] = struct.unpack_from('<L', data, 24)[0] * u.s
+        info['gondola'] = gondola_time(data)
+        info['datetime'] = datetime.datetime(
+            2000, 1, 1 + info['day_offset'], info['hour'], info['minute'],
+            info['second'])
+        if not (info['day_offset'] or info['hour'] or info['minute']
+                or info['second']):
+            info['datetime'] += datetime.timedelta(
+                0, info['second_offset'].to_value('s'))
+        info['date'] = datetime_ms(info['datetime'])
+
+        date, date_gondola = info['date'], info['gondola']
+        if self.gps_info['gondola'] > 0:
+            # At least one GPS position packet has been received.
+            self.on_row('timing', (
+                date, date_gondola, date_gondola - self.gps_info['gondola'],
+                info['clock_difference'].to_value('s')))
+
+        rates = self.telemetry_info
+        self.on_row('data_rates', (
+            date, date_gondola, rates.sum(), rates[0xa0, :].sum(),
+            rates[0xc0:0xc8, 0x09:0x10].sum(), rates[0xc0:0xc8, 0xc0].sum(),
+            rates[0x60, 0x60:0x63].sum(), rates[0xb0, :].sum(),
+            rates[0xd0:0xd4, 0xd0].sum()))
+        rates.fill(0)
+        self.on_change('pps')
+
+    def decode_house(self, data):
+        """Flight computer housekeeping."""
+        info = self.house_info
+        bits = data[16]
+        info['seq'] = packet_sequence(data)
+        info['gon_t'] = int.from_bytes(data[9:16], 'little')
+        info['gps'] = GPS_STRINGS[bits & 1]
+        info['pps'] = PPS_STRINGS[bits >> 1 & 1]
+        info['sbd'] = SBD_STRINGS[bits >> 4 & 1]
+        info['gnd'] = GND_STRINGS[bits >> 5 & 1]
+        info['evtm'] = EVTM_STRINGS[bits >> 6 & 1]
+        info['rate'] = RATE_STRINGS[bits >> 7 & 1]
+        info['cmd'] = hex(data[17])
+        info['cpu'] = int.from_bytes(data[18:20], 'little') / 100.
+        info['disk'] = int.from_bytes(data[20:22], 'little') / 100.
+        info['up'] = int.from_bytes(data[22:26], 'little')
+        info['comp_byte'] = data[26]
+        info['gps_byte'] = data[27]
+        info['imag_byte'] = int.from_bytes(data[28:32], 'little')
+        info['spec_byte'] = int.from_bytes(data[32:34], 'little')
+        info['mag_byte'] = data[34]
+        info['temp_acpitz'] = data[35]
+        info['temp_soc_dts0'] = data[36]
+        info['temp_soc_dts1'] = data[37]
+        info['temp_cpu_max'] = data[38]
+        self.on_change('house')
+
+    def decode_mag(self, data):
+        """Magnetometer reading."""
+        info = self.mag_info
+        bx = _mag_value(data, 18, 100.)
+        by = _mag_value(data, 21, 100.)
+        bz = _mag_value(data, 24, 100.)
+        total = (bx ** 2 + by ** 2 + bz ** 2) ** 0.5
+        info['bx'], info['by'], info['bz'], info['total'] = bx, by, bz, total
+        info['temp'] = _mag_value(data, 27, 2980.)
+        info['adc'] = _mag_value(data, 30, 100.)
+        self.on_row('mag_data', (self.pps_info['date'],
+                                 self.pps_info['gondola'], bx, by, bz, total))
+        self.on_change('mag')
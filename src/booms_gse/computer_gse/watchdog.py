@@ -0,0 +1,217 @@
+"""Watch the event loop for work that blocks it.
+
+A task on the loop sleeps for a short interval over and over, and the delay
+in waking it is the loop's lag. While the loop is blocked that task can not
+run, so a thread watches its deadline instead. Once the loop is more than
+a threshold late, the thread takes the stack the loop thread is running
+with `sys._current_frames()`, and blames the innermost processor in it. The
+stall is logged with its stack right away. It is counted, and logged again
+with its length, once the loop runs and the lag it measures is over the
+threshold. A stack taken after the loop had already woken is dropped.
+
+The stack belongs to a running thread, so only the code objects and line
+numbers of its frames are read. A processor is found in it by the code of
+its class's methods.
+"""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+import types
+from collections import Counter, deque
+from pathlib import Path
+
+from . import metrics
+
+# Seconds between event loop lag measurements.
+LAG_INTERVAL = 0.1
+# Seconds of lag that count as the loop being blocked.
+LAG_THRESHOLD = 0.05
+# Stalls kept with their stacks.
+MAX_STALLS = 32
+# Frames kept from the innermost of a stack.
+STACK_LIMIT = 40
+
+# Directory of the booms_gse package.
+PACKAGE_DIR = Path(__file__).resolve().parents[1]
+
+logger = logging.getLogger(__name__)
+
+
+def _code_objects(cls):
+    """Code of the methods a class defines or inherits, with the functions
+    nested in them."""
+    pending = []
+    for klass in cls.__mro__:
+        for value in vars(klass).values():
+            if isinstance(value, (staticmethod, classmethod)):
+                value = value.__func__
+            elif isinstance(value, property):
+                value = value.fget
+            code = getattr(value, '__code__', None)
+            if code is not None:
+                pending.append(code)
+    found = set()
+    while pending:
+        code = pending.pop()
+        if code not in found:
+            found.add(code)
+            pending.extend(c for c in code.co_consts
+                           if isinstance(c, types.CodeType))
+    return found
+
+
+def _function_name(code):
+    """Module and name of the function running code, if in this package."""
+    try:
+        path = Path(code.co_filename).resolve().relative_to(PACKAGE_DIR)
+    except ValueError:
+        return None
+    module = '.'.join((PACKAGE_DIR.name,) + path.with_suffix('').parts)
+    return f'{module}.{getattr(code, "co_qualname", code.co_name)}'
+
+
+class Stall:
+    """A time the event loop was blocked.
+
+    Attributes:
+        time (float): time.time() when it was found.
+        blame (str): Name of the processor running, or of the function if
+            no processor was.
+        stack (str): The loop thread's stack when it was found.
+        lag (float): Seconds the loop was late, once it runs again.
+    """
+    __slots__ = ('time', 'blame', 'stack', 'lag')
+
+    def __init__(self, blame, stack):
+        self.time = time.time()
+        self.blame = blame
+        self.stack = stack
+        self.lag = None
+
+
+class LoopWatchdog:
+    """Measure event loop lag and catch what blocks the loop."""
+    def __init__(self, processors=(), registry=None, interval=LAG_INTERVAL,
+                 threshold=LAG_THRESHOLD):
+        """Initialize the watchdog. Run run() as a task on the loop.
+
+        Args:
+            processors (iterable(PacketProcessor)): Processors to blame when
+                found running in a stack.
+            registry (metrics.Registry): Gets the lag and stall metrics.
+            interval (float): Seconds between lag measurements.
+            threshold (float): Seconds of lag that count as a stall.
+        """
+        # Processors running each code object. Methods shared by several
+        # processors can not tell them apart, so they blame none.
+        self.processors = {}
+        for processor in processors:
+            for code in _code_objects(type(processor)):
+                self.processors.setdefault(code, set()).add(processor.name)
+        self.interval = interval
+        self.threshold = threshold
+        if registry is None:
+            self.histogram = metrics.Histogram(
+                'bgse_loop_lag_seconds', 'Event loop lag.')
+        else:
+            self.histogram = registry.histogram(
+                'bgse_loop_lag_seconds',
+                'Delay of the event loop waking a task after a sleep.')
+            registry.gauge(
+                'bgse_loop_lag_latest_seconds', 'Most recent event loop lag.'
+                ).set_function(lambda: self.latest)
+            registry.gauge(
+                'bgse_loop_lag_max_seconds', 'Longest event loop lag.'
+                ).set_function(lambda: self.max_lag)
+            registry.counter(
+                'bgse_loop_stalls_total',
+                'Times the event loop was blocked, by what was running.',
+                ('blame',)).set_function(
+                    lambda: {(blame,): count for blame, count
+                             in self.blame.items()})
+        self.latest = 0.0
+        self.max_lag = 0.0
+        self.stalls = deque(maxlen=MAX_STALLS)
+        self.blame = Counter()
+        self._beat = 0
+        self._deadline = None
+        self._caught = None
+        self._loop_thread = None
+        self._stopped = threading.Event()
+
+    async def run(self):
+        """Measure the lag until cancelled."""
+        loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        thread = threading.Thread(target=self._watch, daemon=True,
+                                  name='loop-watchdog')
+        thread.start()
+        try:
+            while True:
+                start = loop.time()
+                self._deadline = time.monotonic() + self.interval \
+                    + self.threshold
+                await asyncio.sleep(self.interval)
+                # Stop the thread looking at this deadline before the next.
+                self._deadline = None
+                lag = max(0.0, loop.time() - start - self.interval)
+                self.histogram.observe(lag)
+                self.latest = lag
+                self.max_lag = max(self.max_lag, lag)
+                stall, self._caught = self._caught, None
+                self._beat += 1
+                if stall is not None and lag >= self.threshold:
+                    # Only counted once the loop was really that late.
+                    stall.lag = lag
+                    self.stalls.append(stall)
+                    self.blame[stall.blame] += 1
+                    logger.warning('Event loop was blocked for %.3f s by %s.',
+                                   lag, stall.blame)
+        finally:
+            self._stopped.set()
+            thread.join()
+            if self.blame:
+                logger.info('Event loop stalls: %s. Longest lag %.3f s.',
+                            dict(self.blame), self.max_lag)
+
+    def _watch(self):
+        caught_beat = None
+        while not self._stopped.wait(self.threshold / 4):
+            beat, deadline = self._beat, self._deadline
+            if deadline is None or time.monotonic() < deadline \
+                    or caught_beat == beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if beat != self._beat or deadline is not self._deadline:
+                # The loop woke up meanwhile, so the stack is not the stall.
+                frame = None
+            if frame is None:
+                continue
+            caught_beat = beat
+            stall = Stall(self._find_blame(frame), ''.join(
+                traceback.format_stack(frame, STACK_LIMIT)))
+            del frame
+            self._caught = stall
+            logger.warning('Event loop blocked for over %.3f s by %s:\n%s',
+                           self.threshold, stall.blame, stall.stack)
+
+    def _find_blame(self, frame):
+        """Name of the innermost processor running in a stack, or else the
+        innermost function of this package."""
+        function = None
+        while frame is not None:
+            code = frame.f_code
+            names = self.processors.get(code)
+            if names is not None and len(names) == 1:
+                return next(iter(names))
+            if function is None:
+                function = _function_name(code)
+            frame = frame.f_back
+        return function or 'unknown'
+
+    def stats(self):
+        """Number of stalls by what was blamed, and the longest lag."""
+        return {'stalls': dict(self.blame), 'max_lag': self.max_lag}
@@ -0,0 +1,326 @@
+"""Run packet processors in worker processes.
+
+A `WorkerProcessor` in the receiving process copies each packet it gets into
+a ring buffer in shared memory. A worker process reads the ring and runs the
+real processor on its own event loop, so slow serial writes or Bokeh
+rendering can not delay UDP reception, and each worker can use its own core.
+
+The ring has a single writer and a single reader. Each slot holds the
+packet number written to it, the packet length, whether its CRC was valid
+and the packet, so the worker does not check the CRC again. If the
+worker falls a full ring behind, the oldest packets are lost and counted,
+unless the worker uses the 'block' overflow policy. Then packets that do not
+fit wait in the receiving process and reading pauses until the worker
+catches up.
+"""
+import asyncio
+import logging
+import multiprocessing
+import struct
+import time
+from multiprocessing import shared_memory
+
+from .network import FlightComputerReceiver, PacketProcessor
+from .packet import Packet
+
+# Default ring geometry. Packets longer than a slot are dropped.
+RING_SLOTS = 8192
+SLOT_SIZE = 4096
+# Seconds a worker sleeps when the ring is empty.
+POLL_INTERVAL = 0.002
+# Seconds to wait for a worker to finish after the receiver closes.
+JOIN_TIMEOUT = 5.0
+
+# Packets written, packets read, packets lost to overruns, closed flag
+RING_HEADER = struct.Struct('<QQQQ')
+# Packet number, packet length, flags
+SLOT_HEADER = struct.Struct('<QHH')
+SLOT_VALID = 0x01
+
+logger = logging.getLogger(__name__)
+
+
+class PacketRing:
+    """Ring buffer of packets in shared memory."""
+    def __init__(self, name=None, slots=RING_SLOTS, slot_size=SLOT_SIZE):
+        """Create a new ring, or attach to an existing one by name.
+
+        Args:
+            name (str): Name of the shared memory of an existing ring.
+            slots (int): Number of packets the ring holds.
+            slot_size (int): Bytes in each slot, including its header.
+        """
+        self.slots = slots
+        self.slot_size = slot_size
+        self.max_packet = slot_size - SLOT_HEADER.size
+        size = RING_HEADER.size + slots * slot_size
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+            RING_HEADER.pack_into(self.memory.buf, 0, 0, 0, 0, 0)
+            self.owner = True
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.buf = self.memory.buf
+        self.written, self.read, self.lost, _ = \
+            RING_HEADER.unpack_from(self.buf, 0)
+        self.oversize = 0
+
+    @property
+    def name(self):
+        """Name of the shared memory, used to attach from another process."""
+        return self.memory.name
+
+    @property
+    def closed(self):
+        """True once the writer has closed the ring."""
+        return bool(RING_HEADER.unpack_from(self.buf, 0)[3])
+
+    def _slot(self, number):
+        return RING_HEADER.size + (number % self.slots) * self.slot_size
+
+    @property
+    def free(self):
+        """Number of slots the reader has finished with."""
+        return self.slots - (self.written
+                             - struct.unpack_from('<Q', self.buf, 8)[0])
+
+    def write(self, packets, overwrite=True):
+        """Write packets to the ring. Only call from the owning process.
+
+        Args:
+            packets (list(Packet)): The packets to write.
+            overwrite (bool): Overwrite packets the reader has not read yet.
+                If False, stop once the ring is full.
+
+        Returns:
+            int: Number of packets taken from the start of packets.
+        """
+        buf = self.buf
+        if not overwrite:
+            packets = packets[:self.free]
+        for packet in packets:
+            size = len(packet)
+            if size > self.max_packet:
+                self.oversize += 1
+                continue
+            offset = self._slot(self.written)
+            # The number is written first so a reader can tell the slot
+            # changed while it was copying.
+            SLOT_HEADER.pack_into(buf, offset, self.written, size,
+                                  SLOT_VALID if packet.valid else 0)
+            start = offset + SLOT_HEADER.size
+            buf[start:start + size] = packet.data
+            self.written += 1
+        struct.pack_into('<Q', buf, 0, self.written)
+        return len(packets)
+
+    def read_packets(self):
+        """Read every packet written since the last read. Only call from the
+        attached process.
+
+        Returns:
+            list(Packet): The packets in the order written.
+        """
+        buf = self.buf
+        written = struct.unpack_from('<Q', buf, 0)[0]
+        if written - self.read > self.slots:
+            self.lost += written - self.slots - self.read
+            self.read = written - self.slots
+
+        packets = []
+        while self.read < written:
+            offset = self._slot(self.read)
+            number, size, flags = SLOT_HEADER.unpack_from(buf, offset)
+            start = offset + SLOT_HEADER.size
+            data = bytes(buf[start:start + size])
+            if number == self.read and \
+                    SLOT_HEADER.unpack_from(buf, offset)[0] == number:
+                packets.append(Packet(data, valid=bool(flags & SLOT_VALID)))
+            else:
+                # Overwritten by the writer before or while copying.
+                self.lost += 1
+            self.read += 1
+
+        struct.pack_into('<QQ', buf, 8, self.read, self.lost)
+        return packets
+
+    def stats(self):
+        """Packets written, read by the worker, lost and too large."""
+        _, read, lost, _ = RING_HEADER.unpack_from(self.buf, 0)
+        return {'written': self.written, 'read': read, 'lost': lost,
+                'oversize': self.oversize}
+
+    def close(self):
+        """Mark the ring closed for the reader."""
+        struct.pack_into('<Q', self.buf, 24, 1)
+
+    def release(self):
+        """Detach from the shared memory, freeing it if it was created
+        here."""
+        self.buf = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+class WorkerProcessor(PacketProcessor):
+    """Run a processor in a worker process fed from a shared memory ring."""
+    def __init__(self, factory, args=(), kwargs=None, sysids=None,
+                 tmtypes=None, slots=RING_SLOTS, slot_size=SLOT_SIZE,
+                 overflow='drop-oldest'):
+        """Initialize the worker. The process starts with setup().
+
+        Args:
+            factory (callable): Creates the processor in the worker. Must be
+                picklable, like a `PacketProcessor` subclass.
+            args (tuple): Positional arguments for factory.
+            kwargs (dict): Keyword arguments for factory.
+            sysids (set(int)): System IDs to send to the worker. None for
+                all. Should cover the processor's own subscriptions.
+            tmtypes (set(int)): Telemetry types to send to the worker. None
+                for all.
+            slots (int): Number of packets the ring holds.
+            slot_size (int): Largest packet in bytes the ring can hold, plus
+                a 12 byte slot header.
+            overflow (str): 'drop-oldest' overwrites packets the worker has
+                not read when the ring is full. 'block' holds them back and
+                pauses the receiver until the worker catches up.
+        """
+        if overflow not in ('drop-oldest', 'block'):
+            raise ValueError(f'Unsupported overflow policy {overflow!r}.')
+        super().__init__()
+        self.factory = factory
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs or {})
+        self.sysids = sysids
+        self.tmtypes = tmtypes
+        self.slots = slots
+        self.slot_size = slot_size
+        self.overflow = overflow
+        self.ring = None
+        self.process = None
+        self.backlog = []
+        self._final_stats = None
+        self._task = None
+
+    @property
+    def name(self):
+        return f'{type(self).__name__}({self.factory.__name__})'
+
+    def setup(self, transport):
+        """Create the ring and start the worker process."""
+        super().setup(transport)
+        self.ring = PacketRing(slots=self.slots, slot_size=self.slot_size)
+        context = multiprocessing.get_context('spawn')
+        self.process = context.Process(
+            target=run_worker,
+            args=(self.ring.name, self.slots, self.slot_size,
+                  self.factory, self.args, self.kwargs),
+            name=self.name, daemon=True)
+        try:
+            self.process.start()
+        except Exception:
+            self.ring.release()
+            self.ring = None
+            raise
+
+    def receive(self, packet):
+        """Copy the packet to the ring."""
+        self.receive_batch([packet])
+
+    def receive_batch(self, packets):
+        """Copy the packets to the ring."""
+        if self.overflow != 'block':
+            self.ring.write(packets)
+            return
+
+        if not self.backlog:
+            packets = packets[self.ring.write(packets, overwrite=False):]
+        if packets:
+            self.backlog.extend(packets)
+            if self._task is None:
+                self.receiver.pause_reading(self)
+                self._task = asyncio.create_task(self._drain_backlog())
+
+    async def _drain_backlog(self):
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            self._write_backlog()
+            if not self.backlog:
+                break
+        self._task = None
+        self.receiver.resume_reading(self)
+
+    def _write_backlog(self):
+        written = self.ring.write(self.backlog, overwrite=False)
+        del self.backlog[:written]
+
+    def stats(self):
+        """Statistics of the ring."""
+        if self.ring is None:
+            return self._final_stats
+        return dict(self.ring.stats(), backlog=len(self.backlog))
+
+    def close(self):
+        """Let the worker finish the ring, then stop it."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.ring is not None:
+            deadline = time.monotonic() + JOIN_TIMEOUT
+            while self.backlog and self.process.is_alive() \
+                    and time.monotonic() < deadline:
+                self._write_backlog()
+                time.sleep(POLL_INTERVAL)
+            self.ring.close()
+            self.process.join(JOIN_TIMEOUT)
+            if self.process.is_alive():
+                logger.warning('%s did not stop, terminating.', self.name)
+                self.process.terminate()
+                self.process.join()
+            self._final_stats = self.stats()
+            self.ring.release()
+            self.ring = None
+        super().close()
+
+
+def run_worker(ring_name, slots, slot_size, factory, args, kwargs):
+    """Entry point of a worker process."""
+    try:
+        asyncio.run(_read_ring(ring_name, slots, slot_size,
+                               factory(*args, **kwargs)))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _read_ring(ring_name, slots, slot_size, processor):
+    """Pass packets from the ring to a processor until the ring closes."""
+    loop = asyncio.get_running_loop()
+    ring = PacketRing(ring_name, slots=slots, slot_size=slot_size)
+
+    # The socket is only used by processors that send packets.
+    transport, receiver = await loop.create_datagram_endpoint(
+        lambda: FlightComputerReceiver((processor,)),
+        local_addr=('0.0.0.0', 0))
+
+    try:
+        while True:
+            if not receiver.reading.is_set():
+                await receiver.reading.wait()
+            closed = ring.closed
+            packets = ring.read_packets()
+            if packets:
+                receiver.packets_received(packets)
+                await asyncio.sleep(0)
+            elif closed:
+                break
+            else:
+                await asyncio.sleep(POLL_INTERVAL)
+    except asyncio.CancelledError:
+        pass
+    finally:
+        transport.close()
+        # Let the processor's close() run.
+        await asyncio.sleep(0)
+        ring.release()
@@ -1,3 +1,10 @@
-from . import imager, spectrometer
+import importlib
 
-__all__ = imager, spectrometer
+__all__ = 'imager', 'spectrometer'
+
+
+def __getattr__(name):
+    # The GSEs load tkinter and matplotlib, so only import the one used.
+    if name in __all__:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
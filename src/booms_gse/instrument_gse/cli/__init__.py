@@ -1,8 +1,5 @@
 import click
 
-from .. import imager as bgse_imag
-from .. import spectrometer as bgse_spec
-
 
 # TODO: Explain what the replay speed actually selects.
 def source_options(f):
@@ -12,7 +9,37 @@ def source_options(f):
                         type=click.FloatRange(min=0, min_open=True),
                         help="When replaying use this speed.")(
            click.option('--serial', '-s', default=False, is_flag=True,
-                        help="The data target is a serial port.")(f)))
+                        help="The data target is a serial port.")(
+           click.option('--start', default=None, type=float,
+                        help="When replaying, start at this gondola time in "
+                             "seconds. Needs the index written by "
+                             "bgse-computer record.")(
+           click.option('--compress', default=None,
+                        type=click.Choice(['zlib', 'lzma']),
+                        help="Compress the serial data saved in packets/.")(
+               f)))))
+
+
+def start_offset(data_source, options):
+    """Find the byte offset to start replaying a recording from.
+
+    Raises:
+        click.UsageError: If --start is given for a serial port or a file
+            that is followed live, which have no index to seek in.
+    """
+    start = options['start']
+    if start is None:
+        return 0
+    if options['serial'] or not options['replay']:
+        raise click.UsageError('--start can only be used with --replay of a '
+                               'recording file.')
+    from ...computer_gse.recording import RecordingIndex
+
+    index = RecordingIndex(data_source)
+    try:
+        return index.find(start)
+    finally:
+        index.close()
 
 
 @click.group()
@@ -24,11 +51,16 @@ def gse():
 @click.argument('data_source', type=str)
 @source_options
 def imager(data_source, **kwargs):
+    offset = start_offset(data_source, kwargs)
+    from .. import imager as bgse_imag
+
     if kwargs['serial']:
         rate = None
     else:
         rate = kwargs['speed'] if kwargs['replay'] else 999_999_999.
-    bgse_imag.run_gse(data_source, rate, live=not kwargs['replay'])
+    bgse_imag.run_gse(data_source, rate, live=not kwargs['replay'],
+                      start_offset=offset,
+                      compress=kwargs['compress'])
 
 
 @gse.command()
@@ -37,12 +69,17 @@ def imager(data_source, **kwargs):
 @click.option('--save', default=False,
               help="Save the high resolution spectra to pd1.txt and pd2.txt")
 def spectrometer(data_source, **kwargs):
+    offset = start_offset(data_source, kwargs)
+    from .. import spectrometer as bgse_spec
+
     if kwargs['serial']:
         rate = None
     else:
         rate = kwargs['speed'] if kwargs['replay'] else 999_999_999.
     bgse_spec.run_gse(data_source, rate,
-                      save=kwargs['save'], live=not kwargs['replay'])
+                      save=kwargs['save'], live=not kwargs['replay'],
+                      start_offset=offset,
+                      compress=kwargs['compress'])
 
 
 if __name__ == '__main__':
@@ -78,6 +78,7 @@ class GetData(Thread):
     """ collect imager data
 
     INPUT: prefix---------string prepended to output filename
+           compress-------codec to compress the output file with, or None
     OUTPUT:
     Variables used outside this thread:
        datastreamActive---boolean to externally disable activity (__main__)
@@ -99,9 +100,10 @@ class GetData(Thread):
           _pktExtract()   identifies packets in data stream
     """
 
-    def __init__(self, prefix=None):
+    def __init__(self, prefix=None, compress=None):
         Thread.__init__(self)
         self._outFile = None
+        self._compress = compress
         self._rxbuf = b""
         self._bytesRead = 0
         self._junkBytes = 0
@@ -117,11 +119,15 @@ class GetData(Thread):
             self._outFile = None
             return
 
+        from ..computer_gse.recording import COMPRESSED_SUFFIX, open_capture
+
+        self._suffix = ".dat" if compress is None else COMPRESSED_SUFFIX
         if not path.isdir("packets"):
             mkdir("packets")
         try:
-            self._outfilename = prefix+f"{datetime.utcnow():%Y%b%dT%H%M%S}.dat"
-            self._outFile = open(path.join("packets", self._outfilename), "wb")
+            self._outfilename = prefix+f"{datetime.utcnow():%Y%b%dT%H%M%S}"+self._suffix
+            self._outFile = open_capture(path.join("packets", self._outfilename),
+                                         self._compress)
         except:
             print("failed to open output file")
             sys.exit(1)
@@ -161,10 +167,13 @@ class GetData(Thread):
         return self._outfilename
 
     def newOutfile(self):
+        from ..computer_gse.recording import open_capture
+
         self._outFile.close()
         try:
-            self._outfilename = self._prefix+f"{datetime.utcnow():%Y%b%dT%H%M%S}.dat"
-            self._outFile = open(path.join("packets", self._outfilename), "wb")
+            self._outfilename = self._prefix+f"{datetime.utcnow():%Y%b%dT%H%M%S}"+self._suffix
+            self._outFile = open_capture(path.join("packets", self._outfilename),
+                                         self._compress)
         except:
             print("failed to open output file")
             sys.exit(1)
@@ -181,8 +190,8 @@ class SerialThread(GetData):
     DESCRIPTION:
     
     """
-    def __init__(self, ser, prefix):
-        GetData.__init__(self, prefix)
+    def __init__(self, ser, prefix, compress=None):
+        GetData.__init__(self, prefix, compress)
         self._serialPort = ser
 
     def run(self):
@@ -946,7 +955,8 @@ class BMSDisplay(tk.Tk):
 
 ########################### END OF BMSDisplay CLASS ##############################
 
-def run_gse(serial_port, replay_rate=None, live=False):
+def run_gse(serial_port, replay_rate=None, live=False, start_offset=0,
+            compress=None):
     global thread1
 
     if replay_rate is None:
@@ -956,7 +966,7 @@ def run_gse(serial_port, replay_rate=None, live=False):
             print("ERROR: Cannot open serial port", serial_port)
             sys.exit(-1)
         print("starting serial thread")
-        thread1 = SerialThread(ser, "IMGR")
+        thread1 = SerialThread(ser, "IMGR", compress)
         thread1.datastreamActive = True
         thread1.start()
         starting = datetime.utcnow()
@@ -970,10 +980,14 @@ def run_gse(serial_port, replay_rate=None, live=False):
         time.sleep(1)
         ser.close()
     else:
+        from ..computer_gse.recording import open_recording
+
         try:
-            filePtr = open(serial_port, "rb")
+            filePtr = open_recording(serial_port)
             if live:
                 filePtr.seek(-1, 2)
+            elif start_offset:
+                filePtr.seek(start_offset)
         except:
             print("failed to open input file", serial_port)
             sys.exit(1)
@@ -73,18 +73,21 @@ class SerialThread(Thread):
     DESCRIPTION:
     
     """
-    def __init__(self,ser):
+    def __init__(self,ser,compress=None):
         Thread.__init__(self)
         self.serialPort = ser
         self.rxbuf = b""
         self.packets=queue.Queue()
         self.bytesRead = 0
         self.junkBytes = 0
+        from ..computer_gse.recording import COMPRESSED_SUFFIX, open_capture
+
         if not path.isdir("packets"):
             mkdir("packets")
         try:
-            self.outFile = open(path.join("packets",
-                  f"BSPC{datetime.utcnow():%Y%b%dT%H%M%S}.dat"), "wb")
+            suffix = ".dat" if compress is None else COMPRESSED_SUFFIX
+            self.outFile = open_capture(path.join("packets",
+                  f"BSPC{datetime.utcnow():%Y%b%dT%H%M%S}"+suffix), compress)
         except:
             print("failed to open output file")
             sys.exit(1)
@@ -783,7 +786,7 @@ class BMSDisplay(tk.Toplevel):
 ########################### END OF BMSDisplay CLASS ##############################
 
 def run_gse(serial_port, frames_per_s=None, parent=None,
-            save=False, live=False):
+            save=False, live=False, start_offset=0, compress=None):
     if parent is None:
         parent = tk.Tk()
         parent.withdraw()
@@ -797,7 +800,7 @@ def run_gse(serial_port, frames_per_s=None, parent=None,
             print("ERROR: Cannot open serial port", serial_port)
             sys.exit(-1)
         print("starting serial thread")
-        thread1 = SerialThread(ser)
+        thread1 = SerialThread(ser, compress)
         datastreamActive = True
         thread1.start()
         starting = datetime.utcnow()
@@ -814,10 +817,14 @@ def run_gse(serial_port, frames_per_s=None, parent=None,
             np.savetxt('pd1.txt', gui.hres.fig.lines[0].get_ydata())
             np.savetxt('pd2.txt', gui.hres.fig.lines[1].get_ydata())
     else:
+        from ..computer_gse.recording import open_recording
+
         try:
-            filePtr = open(sys.argv[1], "rb")
+            filePtr = open_recording(serial_port)
             if live:
                 filePtr.seek(-1, 2)
+            elif start_offset:
+                filePtr.seek(start_offset)
         except:
             print("failed to open input file", serial_port)
             sys.exit(1)